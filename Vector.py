@@ -1,62 +1,108 @@
 from math import *
+from numbers import Real
+import numpy as np
 
 class Vector:
-    
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x, self.y, self.z = x, y, z  #float(x), float(y), float(z)
 
     # basic operations ===========================================================
+    # Scalars are applied directly on each component, without a temporary Vector.
+    # float and int are checked first because isinstance(other, Real) (numpy scalars...) is much slower
     def __add__(self, other):
-        if type(other) == Vector:
-            return Vector(
-                self.x + other.x,
-                self.y + other.y,
-                self.z + other.z
-            )
-        elif type(other) == float or type(other) == int:
-            return self + Vector(other, other, other)
+        if other.__class__ is Vector:
+            return Vector(self.x + other.x, self.y + other.y, self.z + other.z)
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(self.x + other, self.y + other, self.z + other)
+        return NotImplemented
 
     def __sub__(self, other):
-        if type(other) == Vector:
-            return Vector(
-                self.x - other.x,
-                self.y - other.y,
-                self.z - other.z
-            )
-        elif type(other) == float or type(other) == int:
-            return self - Vector(other, other, other)
+        if other.__class__ is Vector:
+            return Vector(self.x - other.x, self.y - other.y, self.z - other.z)
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(self.x - other, self.y - other, self.z - other)
+        return NotImplemented
 
     def __mul__(self, other):
-        if type(other) == Vector:
-            return Vector(
-                self.x * other.x,
-                self.y * other.y,
-                self.z * other.z
-            )
-        elif type(other) == float or type(other) == int:
-            return self * Vector(other, other, other)
+        if other.__class__ is Vector:
+            return Vector(self.x * other.x, self.y * other.y, self.z * other.z)
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(self.x * other, self.y * other, self.z * other)
+        return NotImplemented
 
     def __truediv__(self, other):
-        if type(other) == Vector:
-            return Vector(
-                self.x / other.x,
-                self.y / other.y,
-                self.z / other.z
-            )
-        elif type(other) == float or type(other) == int:
-            return self / Vector(other, other, other)
-    
+        if other.__class__ is Vector:
+            return Vector(self.x / other.x, self.y / other.y, self.z / other.z)
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(self.x / other, self.y / other, self.z / other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(other + self.x, other + self.y, other + self.z)
+        return NotImplemented
+
+    def __rsub__(self, other):
+        if isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(other - self.x, other - self.y, other - self.z)
+        return NotImplemented
+
+    def __rmul__(self, other):
+        if isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(other * self.x, other * self.y, other * self.z)
+        return NotImplemented
+
+    def __rtruediv__(self, other):
+        if isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector(other / self.x, other / self.y, other / self.z)
+        return NotImplemented
+
     def __pow__(self, other):
-        if type(other) == Vector:
+        if other.__class__ is Vector:
             return Vector(
                 (self.x ** other.x).real,
                 (self.y ** other.y).real,
                 (self.z ** other.z).real
             )
-        elif type(other) == float or type(other) == int:
-            return self ** Vector(other, other, other)
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            return Vector((self.x ** other).real, (self.y ** other).real, (self.z ** other).real)
         else: raise TypeError("Vector POWER error")
-    
+
+    # in place operations: change the Vector itself instead of creating a new one
+    def __iadd__(self, other):
+        if other.__class__ is Vector:
+            self.x += other.x; self.y += other.y; self.z += other.z
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            self.x += other; self.y += other; self.z += other
+        else: return NotImplemented
+        return self
+
+    def __isub__(self, other):
+        if other.__class__ is Vector:
+            self.x -= other.x; self.y -= other.y; self.z -= other.z
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            self.x -= other; self.y -= other; self.z -= other
+        else: return NotImplemented
+        return self
+
+    def __imul__(self, other):
+        if other.__class__ is Vector:
+            self.x *= other.x; self.y *= other.y; self.z *= other.z
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            self.x *= other; self.y *= other; self.z *= other
+        else: return NotImplemented
+        return self
+
+    def __itruediv__(self, other):
+        if other.__class__ is Vector:
+            self.x /= other.x; self.y /= other.y; self.z /= other.z
+        elif isinstance(other, (float, int)) or isinstance(other, Real):
+            self.x /= other; self.y /= other; self.z /= other
+        else: return NotImplemented
+        return self
+
     def __neg__(self):
         return Vector(
             -self.x,
@@ -72,7 +118,7 @@ class Vector:
 
     def exp(self):
         return Vector(exp(self.x), exp(self.y), exp(self.z))
-    
+
     def round(self, value=0):
         return Vector(round(self.x, value), round(self.y, value), round(self.z, value))
 
@@ -93,17 +139,23 @@ class Vector:
     def getColor(self, position):
         return self
 
+    def getColorArray(self, positions):
+        return self.toArray()
+
+    def toArray(self):
+        return np.array((self.x, self.y, self.z), dtype=float)
+
     #vector operations===============================================================
 
     def length(self):
-        return sqrt(self.x**2 + self.y**2 + self.z**2)
+        return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
     def normalize(self):
-        return self / self.length()
+        length = sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+        return Vector(self.x / length, self.y / length, self.z / length)
 
     def dotProduct(self, other):
-        temp = self * other
-        return float(temp.x + temp.y + temp.z)
+        return float(self.x * other.x + self.y * other.y + self.z * other.z)
 
     def crossProduct(self, other):
         return Vector(
@@ -125,3 +177,116 @@ class Vector:
             tempZ.x + tempZ.y + tempZ.z
         )
 
+
+class VectorArray:
+    """Many vectors stored as a structure of arrays: x, y and z are NumPy arrays (N,)
+    Works with Vectors, scalars and arrays (N,) (one scalar per vector), and converts to an array (N, 3) with np.asarray.
+    """
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(z, dtype=float)
+
+    @classmethod
+    def fromArray(cls, array):
+        """array: (N, 3)"""
+        array = np.asarray(array, dtype=float)
+        return cls(array[:, 0], array[:, 1], array[:, 2])
+
+    @classmethod
+    def fromVectors(cls, vectors):
+        return cls([v.x for v in vectors], [v.y for v in vectors], [v.z for v in vectors])
+
+    def toArray(self):
+        return np.stack((self.x, self.y, self.z), axis=-1)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.toArray()
+        return array if dtype is None else array.astype(dtype)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Vector(float(self.x[index]), float(self.y[index]), float(self.z[index]))
+        return VectorArray(self.x[index], self.y[index], self.z[index])
+
+    def __setitem__(self, index, value):
+        value = self._components(value)
+        self.x[index], self.y[index], self.z[index] = value
+
+    def _components(self, other):
+        if isinstance(other, (Vector, VectorArray)):
+            return other.x, other.y, other.z
+        # scalar or array (N,)
+        return other, other, other
+
+    # basic operations ===========================================================
+    def __add__(self, other):
+        ox, oy, oz = self._components(other)
+        return VectorArray(self.x + ox, self.y + oy, self.z + oz)
+
+    def __sub__(self, other):
+        ox, oy, oz = self._components(other)
+        return VectorArray(self.x - ox, self.y - oy, self.z - oz)
+
+    def __mul__(self, other):
+        ox, oy, oz = self._components(other)
+        return VectorArray(self.x * ox, self.y * oy, self.z * oz)
+
+    def __truediv__(self, other):
+        ox, oy, oz = self._components(other)
+        return VectorArray(self.x / ox, self.y / oy, self.z / oz)
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __rsub__(self, other):
+        ox, oy, oz = self._components(other)
+        return VectorArray(ox - self.x, oy - self.y, oz - self.z)
+
+    def __iadd__(self, other):
+        ox, oy, oz = self._components(other)
+        self.x += ox; self.y += oy; self.z += oz
+        return self
+
+    def __isub__(self, other):
+        ox, oy, oz = self._components(other)
+        self.x -= ox; self.y -= oy; self.z -= oz
+        return self
+
+    def __imul__(self, other):
+        ox, oy, oz = self._components(other)
+        self.x *= ox; self.y *= oy; self.z *= oz
+        return self
+
+    def __itruediv__(self, other):
+        ox, oy, oz = self._components(other)
+        self.x /= ox; self.y /= oy; self.z /= oz
+        return self
+
+    def __neg__(self):
+        return VectorArray(-self.x, -self.y, -self.z)
+
+    def clip(self, min, max):
+        return VectorArray(np.clip(self.x, min, max), np.clip(self.y, min, max), np.clip(self.z, min, max))
+
+    #vector operations===============================================================
+    def length(self):
+        return np.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def normalize(self):
+        return self / self.length()
+
+    def dotProduct(self, other):
+        ox, oy, oz = self._components(other)
+        return self.x * ox + self.y * oy + self.z * oz
+
+    def crossProduct(self, other):
+        ox, oy, oz = self._components(other)
+        return VectorArray(
+            self.y * oz - self.z * oy,
+            self.z * ox - self.x * oz,
+            self.x * oy - self.y * ox
+        )
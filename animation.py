@@ -0,0 +1,321 @@
+import os
+import math
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import parallel_render
+from Vector import Vector
+from renderer import pixelRays, finishColors, renderBatch, screenBounds, cameraBasis
+from antialiasing import renderAdaptive
+from parallel_render import splitTiles, renderTile, _initWorker
+from shaders_class import nearestIntersectedObjectArray, tracePathsArray, DefaultShader, DiffuseShader
+from incremental_render import segmentsHitBox, lightVolumes
+from sampling import useStream
+from denoiser import postProcess
+from irradiance_cache import IrradianceCache
+from visibility_cache import VisibilityCache
+
+
+# Keyframes =============================================================================================================================
+# A keyframe is a dict with its time (in frames) and values: Vectors or numbers, interpolated linearly between the keyframes
+# (the first and last values are kept before and after them).
+
+def interpolate(keyframes: list, name: str, frame: float):
+    """Value of name at the frame, from the keyframes that have it (None if none has it)"""
+    keys = sorted((key for key in keyframes if name in key), key=lambda key: key["time"])
+    if not keys:
+        return None
+    if frame <= keys[0]["time"]:
+        return keys[0][name]
+    for previous, following in zip(keys, keys[1:]):
+        if frame <= following["time"]:
+            t = (frame - previous["time"]) / max(following["time"] - previous["time"], 1e-12)
+            return previous[name] * (1 - t) + following[name] * t
+    return keys[-1][name]
+
+
+def cameraAt(keyframes: list, frame: float):
+    """Camera dict(position, direction or target) of the frame, keyframes: dict(time, position, direction or target)
+    If some keyframes have a target, the camera always looks at the target interpolated between them.
+    """
+    camera = {"position": interpolate(keyframes, "position", frame)}
+    target = interpolate(keyframes, "target", frame)
+    if target is not None:
+        camera["target"] = target
+    else:
+        direction = interpolate(keyframes, "direction", frame)
+        camera["direction"] = Vector(0, 0, 0) if direction is None else direction
+    return camera
+
+
+def objectStates(objectKeyframes: dict, frame: float):
+    """Attributes of the animated objects at the frame: {object index: {attribute: value}}
+    objectKeyframes: {object index: list of keyframes dict(time, attribute: value...)}, for example the center of a Sphere
+    """
+    return {int(index): {name: interpolate(keyframes, name, frame) for name in {name for key in keyframes for name in key} - {"time"}}
+            for index, keyframes in objectKeyframes.items()}
+
+
+def turntable(target: Vector, radius: float, height: float, frames: int, turns: float = 1, startAngle: float = 0):
+    """Camera keyframes (one per frame) turning around target at radius and height above it, looking at it"""
+    keyframes = []
+    for frame in range(frames):
+        angle = math.radians(startAngle) + 2 * math.pi * turns * frame / frames
+        position = target + Vector(radius * math.sin(angle), height, radius * math.cos(angle))
+        keyframes.append({"time": frame, "position": position, "target": target})
+    return keyframes
+
+
+def _stateKey(values: dict):
+    return tuple((name, tuple(value.toArray().tolist()) if isinstance(value, Vector) else value) for name, value in sorted(values.items()))
+
+
+def applyObjectStates(objects, states: dict, previous: dict = None):
+    """Sets the attributes of the animated objects and repacks only them (PackedScene.update) or rebuilds the
+    acceleration structure (ObjectBVH.rebuild)
+    previous: states applied before, the objects whose state didn't change are skipped
+    Returns the indices of the objects changed
+    """
+    changed = [index for index, values in states.items()
+               if previous is None or index not in previous or _stateKey(previous[index]) != _stateKey(values)]
+    for index in changed:
+        for name, value in states[index].items():
+            setattr(objects[index], name, value)
+        if hasattr(objects, "update"):
+            objects.update(index)
+    if changed and not hasattr(objects, "update") and hasattr(objects, "rebuild"):
+        objects.rebuild()
+    return changed
+
+
+def refreshCaches(objects, parameters: dict):
+    """Caches of the parameters after objects moved: the shadow cache forgets the old geometry, the irradiance cache
+    starts again empty. Returns the parameters to render with
+    """
+    shadowCache = parameters.get("shadowCache")
+    if isinstance(shadowCache, VisibilityCache):
+        shadowCache.commit()
+        shadowCache.validate(objects)
+    irradianceCache = parameters.get("irradianceCache")
+    if isinstance(irradianceCache, IrradianceCache):
+        parameters = dict(parameters, irradianceCache=IrradianceCache(irradianceCache.error, irradianceCache.minRadius,
+                                                                      irradianceCache.maxRadius))
+    return parameters
+
+
+# Temporal reuse ========================================================================================================================
+
+class TemporalReuse:
+
+    def __init__(self, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, tolerance: float = 1, edgeThreshold: float = 0.05,
+                 chunkSize: int = 65536):
+        """Renders frames with one ray per pixel (as renderBatch, without antialiasing) and reuses the colors of the previous frame:
+        the hit of each pixel is projected in the previous frame, its color is copied if the pixel there saw the same object at
+        the same point (within tolerance pixels). Only static objects whose shading doesn't depend on the camera are reused:
+        no reflections, no highlights (DiffuseShader, or a black specular color). The pixels on an edge of the previous frame
+        (a neighbour more than edgeThreshold away in color: shadow edges...) aren't copied either. When objects move, the pixels
+        that see them and the pixels whose shadow rays can cross them (or whose indirect lighting / ambient occlusion can see them)
+        are shaded again.
+        The copied colors keep the point where they were shaded, so the error doesn't grow over the frames.
+        The lights must not change between the frames.
+        """
+        self.dimensions, self.FOV, self.worldInfos, self.parameters = dimensions, FOV, worldInfos, parameters
+        self.tolerance, self.edgeThreshold = tolerance, edgeThreshold
+        self.chunkSize = chunkSize
+        # camera, shading points (N, 3), objects hit (N,), colors (N, 3), smooth pixels (N,) of the previous frame
+        self.previous = None
+
+    def _reusableObjects(self):
+        """True for the objects whose shading doesn't depend on the camera (one more value, False, for the sky)"""
+        reusable = []
+        for obj in self.worldInfos[0]:
+            shader = getattr(obj, "_shader", None)
+            # glass and unknown shaders depend on the direction of the rays
+            if not isinstance(shader, (DefaultShader, DiffuseShader)):
+                reusable.append(False)
+                continue
+            reflects = shader.reflection > 0 and self.parameters["maxReflections"] > 0
+            specular = getattr(shader, "specular", None)
+            highlights = specular is not None and not (isinstance(specular, Vector) and not specular.toArray().any())
+            reusable.append(not reflects and not highlights)
+        return np.array(reusable + [False])
+
+    def _smooth(self, colors):
+        """True for the pixels whose color is within edgeThreshold of their 4 neighbours: not on a shadow or texture edge,
+        where a point a fraction of a pixel away can have another color
+        """
+        width, height = self.dimensions
+        image = colors.reshape((height, width, 3))
+        difference = np.zeros((height, width))
+        vertical = np.abs(image[1:] - image[:-1]).max(axis=2)
+        horizontal = np.abs(image[:, 1:] - image[:, :-1]).max(axis=2)
+        difference[1:] = np.maximum(difference[1:], vertical)
+        difference[:-1] = np.maximum(difference[:-1], vertical)
+        difference[:, 1:] = np.maximum(difference[:, 1:], horizontal)
+        difference[:, :-1] = np.maximum(difference[:, :-1], horizontal)
+        return (difference <= self.edgeThreshold).ravel()
+
+    def _project(self, points, camera):
+        """Nearest pixel (N,) of the points (N, 3) in the image of the camera, -1 for the points out of it"""
+        width, height = self.dimensions
+        relative = points - camera["position"].toArray()
+        basis = cameraBasis(camera)
+        local = relative if basis is None else relative @ basis
+        inFront = local[:, 2] < 0
+        depth = np.where(inFront, -local[:, 2], 1)
+        x, y = local[:, 0] * self.FOV / depth, local[:, 1] * self.FOV / depth
+        screen = screenBounds(self.dimensions)
+        columns = np.round((x - screen[0]) * max(width - 1, 1) / (screen[2] - screen[0])).astype(int)
+        rows = np.round((y - screen[1]) * max(height - 1, 1) / (screen[3] - screen[1])).astype(int)
+        inside = inFront & (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+        return np.where(inside, rows * width + columns, -1)
+
+    def render(self, camera: dict, moved: dict = None):
+        """Renders the frame of the camera
+        moved: {index: (old bounds, new bounds)} of the objects moved since the previous frame, their pixels are shaded again
+            (an unbounded object moved: nothing is reused)
+        Returns (image, infos) with infos dict(reused, shaded)
+        """
+        moved = moved or {}
+        movedBounds = [bounds for old, new in moved.values() for bounds in (old, new)]
+        width, height = self.dimensions
+        objects = self.worldInfos[0]
+        worldInfos = self.worldInfos[:3] + (camera,)
+        rows, columns = np.divmod(np.arange(width * height), width)
+        origin, directions = pixelRays(rows, columns, self.dimensions, self.FOV, camera)
+
+        objectIds = np.full(width * height, -1)
+        distances = np.full(width * height, np.inf)
+        normals = np.zeros((width * height, 3))
+        for start in range(0, len(directions), self.chunkSize):
+            chunk = slice(start, start + self.chunkSize)
+            objectIds[chunk], distances[chunk], normals[chunk] = nearestIntersectedObjectArray(objects, origin, directions[chunk])
+        hit = objectIds >= 0
+        points = np.zeros(directions.shape)
+        points[hit] = origin + directions[hit] * distances[hit, None]
+        colors = np.zeros(directions.shape)
+
+        reused = np.zeros(width * height, dtype=bool)
+        if self.previous is not None and not any(bounds is None for bounds in movedBounds):
+            previousCamera, previousPoints, previousIds, previousColors, previousSmooth = self.previous
+            reusable = self._reusableObjects()
+            reusable[list(moved)] = False
+            candidates = np.flatnonzero(reusable[objectIds])
+            source = self._project(points[candidates], previousCamera)
+            sameObject = source >= 0
+            sameObject[sameObject] = (previousIds[source[sameObject]] == objectIds[candidates[sameObject]]) & previousSmooth[source[sameObject]]
+            candidates, source = candidates[sameObject], source[sameObject]
+
+            # size of a pixel at the distance of the hit
+            screen = screenBounds(self.dimensions)
+            pixelSize = distances[candidates] * (screen[2] - screen[0]) / max(width - 1, 1) / self.FOV
+            close = np.linalg.norm(previousPoints[source] - points[candidates], axis=1) <= self.tolerance * pixelSize
+            candidates, source = candidates[close], source[close]
+
+            if len(movedBounds):
+                indirect = self.parameters["indirectLightingMaxBounces"] > 0 and self.parameters["Lighting"] != "Direct"
+                if indirect or self.parameters.get("ambientOcclusion"):
+                    candidates, source = candidates[:0], source[:0]
+                for bounds in movedBounds:
+                    for center, radius in zip(*lightVolumes(worldInfos[1])):
+                        shadowed = segmentsHitBox(points[candidates], np.broadcast_to(center, (len(candidates), 3)),
+                                                  bounds[0] - radius, bounds[1] + radius)
+                        candidates, source = candidates[~shadowed], source[~shadowed]
+
+            reused[candidates] = True
+            colors[candidates] = previousColors[source]
+            # the color stays the one of the point where it was shaded
+            points[candidates] = previousPoints[source]
+
+        shaded = np.flatnonzero(~reused)
+        with useStream(self.parameters.get("seed", 0), 0, 0):
+            for start in range(0, len(shaded), self.chunkSize):
+                chunk = shaded[start:start + self.chunkSize]
+                colors[chunk] = tracePathsArray(objects, origin, directions[chunk], np.ones(len(chunk)), 0, worldInfos, self.parameters, "all",
+                                                hits=(objectIds[chunk], distances[chunk], normals[chunk]))[0]
+
+        self.previous = (camera, points, objectIds, colors, self._smooth(colors))
+        return finishColors(colors).reshape((height, width, 3)), {"reused": int(reused.sum()), "shaded": len(shaded)}
+
+
+# Frames ================================================================================================================================
+
+# Animated objects already set in the current worker process (see _renderFrameTile)
+_workerStates = None
+
+
+def _renderFrameTile(tile, camera, states):
+    global _workerStates
+    dimensions, FOV, worldInfos, parameters = parallel_render._workerScene
+    if applyObjectStates(worldInfos[0], states, _workerStates):
+        parameters = refreshCaches(worldInfos[0], parameters)
+        parallel_render._workerScene = (dimensions, FOV, worldInfos, parameters)
+    _workerStates = states
+    return tile, renderTile(tile, dimensions, FOV, worldInfos[:3] + (camera,), parameters)
+
+
+def renderFrames(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, cameraKeyframes: list, frames: int,
+                 objectKeyframes: dict = None, renderer: str = "batch", workers: int = 1, temporalReuse: bool = False,
+                 reuseTolerance: float = 1, tileSize: int = 32):
+    """Generator of the frames of an animation: yields (frame, image, infos) for the frames 0 to frames - 1
+    worldInfos: prepared once for all the frames (objects packed, caches: see raytracer.prepareRender), its camera is replaced
+        by the one of cameraKeyframes (see cameraAt, turntable)
+    objectKeyframes: {object index: keyframes of its attributes} (see objectStates), only these objects are packed again,
+        they get their attributes back after the last frame
+    renderer: "batch" (renderBatch, renderAdaptive with maxSamples > 1) or "parallel": the pool of workers is made once,
+        each worker gets the scene once and only the camera and the animated attributes with each tile
+    temporalReuse: reuse the colors of the previous frame for static surfaces (see TemporalReuse), one ray per pixel
+        traced in this process (renderer and workers aren't used)
+    With the denoise parameter each frame is denoised (see denoiser.postProcess).
+    infos: dict(time, and reused, shaded with temporalReuse)
+    """
+    objectKeyframes = objectKeyframes or {}
+    objects = worldInfos[0]
+    reuse = TemporalReuse(dimensions, FOV, worldInfos, parameters, reuseTolerance) if temporalReuse else None
+    pool = None
+    if renderer == "parallel" and workers != 1 and not temporalReuse:
+        pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_initWorker,
+                                   initargs=(dimensions, FOV, worldInfos, parameters))
+    # put back after the last frame, the scene can be rendered again (scene cache of the jobs)
+    initialStates = {index: {name: getattr(objects[index], name) for name in values}
+                     for index, values in objectStates(objectKeyframes, 0).items()}
+    states = None
+    try:
+        for frame in range(frames):
+            frameTime = time.time()
+            camera = cameraAt(cameraKeyframes, frame)
+            newStates = objectStates(objectKeyframes, frame)
+            oldBounds = {index: objects[index].bounds() for index in newStates}
+            changed = applyObjectStates(objects, newStates, states)
+            moved = {index: (oldBounds[index], objects[index].bounds()) for index in changed} if states is not None else {}
+            if changed:
+                parameters = refreshCaches(objects, parameters)
+                if reuse is not None:
+                    reuse.parameters = parameters
+            states = newStates
+            frameInfos = worldInfos[:3] + (camera,)
+
+            infos = {}
+            if reuse is not None:
+                image, infos = reuse.render(camera, moved)
+            elif pool is not None:
+                width, height = dimensions
+                image = np.zeros((height, width, 3))
+                futures = [pool.submit(_renderFrameTile, tile, camera, states) for tile in splitTiles(dimensions, tileSize)]
+                for future in futures:
+                    tile, colors = future.result()
+                    image[tile[0]:tile[1], tile[2]:tile[3]] = colors
+            elif parameters.get("maxSamples", 1) > 1:
+                image = renderAdaptive(dimensions, FOV, frameInfos, parameters)[0]
+            else:
+                image = renderBatch(dimensions, FOV, frameInfos, parameters)[0]
+
+            image = postProcess(image, dimensions, FOV, frameInfos, parameters)[0]
+            infos["time"] = time.time() - frameTime
+            yield frame, image, infos
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if states is not None and applyObjectStates(objects, initialStates, states):
+            refreshCaches(objects, parameters)
@@ -0,0 +1,154 @@
+import time
+import numpy as np
+
+from renderer import shadePixels, splitTiles
+from sampling import hashUniform, radicalInverse, useStream
+
+
+# Sample patterns =======================================================================================================================
+
+def sampleOffsets(pixels, samples, maxSamples: int, pattern: str = "stratified", seed: int = 0):
+    """Sub-pixel offsets (rows, columns) in [-0.5, 0.5) of sample number samples of each pixel (arrays of indices)
+    pattern:
+        "stratified": the pixel is cut in a grid of at least maxSamples cells, successive samples go to cells far
+            apart and are jittered inside their cell
+        "halton": Halton sequence (bases 2, 3), shifted by a random amount for each pixel
+        "random": uniform random
+    seed: global seed of the render, the offsets are the same for the same seed
+    """
+    pixels = np.asarray(pixels, dtype=np.int64)
+    samples = np.asarray(samples, dtype=np.int64)
+    keys = pixels * 65536 + samples
+
+    if pattern == "stratified":
+        # grid of 2^levels x 2^levels cells visited in reversed Morton order: samples 0-3 are in the 4 quadrants,
+        # samples 0-15 in the 16 sub-quadrants... The order is scrambled for each pixel with a XOR, which keeps this property
+        levels = max(int(np.ceil(np.log2(max(maxSamples, 1)) / 2)), 1)
+        cells = 1 << (2 * levels)
+        code = np.zeros(samples.shape, dtype=np.int64)
+        for level in range(levels):
+            code |= ((samples >> (2 * level)) & 3) << (2 * (levels - 1 - level))
+        code ^= (hashUniform(pixels, 2, seed) * cells).astype(np.int64)
+        cellRows, cellColumns = np.zeros(code.shape, dtype=np.int64), np.zeros(code.shape, dtype=np.int64)
+        for level in range(levels):
+            cellRows |= ((code >> (2 * level + 1)) & 1) << level
+            cellColumns |= ((code >> (2 * level)) & 1) << level
+        size = 1 << levels
+        rows = (cellRows + hashUniform(keys, 0, seed)) / size
+        columns = (cellColumns + hashUniform(keys, 1, seed)) / size
+    elif pattern == "halton":
+        rows = (radicalInverse(samples, 2) + hashUniform(pixels, 0, seed)) % 1
+        columns = (radicalInverse(samples, 3) + hashUniform(pixels, 1, seed)) % 1
+    elif pattern == "random":
+        rows, columns = hashUniform(keys, 0, seed), hashUniform(keys, 1, seed)
+    else:
+        raise ValueError("Unknown sample pattern: %s" % pattern)
+
+    return rows - 0.5, columns - 0.5
+
+
+# Adaptive sampling =====================================================================================================================
+
+def neighbourContrast(image):
+    """Largest color difference between each pixel of an image (height, width, 3) and its 4 neighbours"""
+    contrast = np.zeros(image.shape[:2])
+    rowDifference = np.abs(image[1:] - image[:-1]).max(axis=2)
+    columnDifference = np.abs(image[:, 1:] - image[:, :-1]).max(axis=2)
+    contrast[1:] = np.maximum(contrast[1:], rowDifference)
+    contrast[:-1] = np.maximum(contrast[:-1], rowDifference)
+    contrast[:, 1:] = np.maximum(contrast[:, 1:], columnDifference)
+    contrast[:, :-1] = np.maximum(contrast[:, :-1], columnDifference)
+    return contrast
+
+
+def renderAdaptiveTile(tile: tuple, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, chunkSize: int = 65536, objects=None):
+    """Anti-aliased render of the pixels of a tile (rowStart, rowEnd, columnStart, columnEnd)
+    parameters:
+        minSamples: samples of every pixel (1: one ray through the center, the same image as renderBatch)
+        maxSamples: samples of the pixels that need the most
+        aaThreshold: pixels with a neighbour contrast or a standard error above this get more samples
+        samplePattern: "stratified", "halton" or "random" (see sampleOffsets)
+
+    Every pixel first gets minSamples. Pixels with a high contrast with their neighbours (edges, textures,
+    reflections...) get more samples, at least 4 then twice as many each round, until both their standard
+    error and their contrast are below aaThreshold or they have maxSamples.
+    minSamples 2 catches most of the details thinner than a pixel that one centered ray misses.
+    objects: the only objects the primary rays can hit (default: all, see renderer.shadeRays)
+    Returns colors (tileHeight, tileWidth, 3) and the number of samples of each pixel (tileHeight, tileWidth)
+    """
+    rowStart, rowEnd, columnStart, columnEnd = tile
+    tileHeight, tileWidth = rowEnd - rowStart, columnEnd - columnStart
+    maxSamples = max(int(parameters.get("maxSamples", 1)), 1)
+    minSamples = min(max(int(parameters.get("minSamples", 1)), 1), maxSamples)
+    threshold = parameters.get("aaThreshold", 0.05)
+    pattern = parameters.get("samplePattern", "stratified")
+    seed = parameters.get("seed", 0)
+
+    rows, columns = np.mgrid[rowStart:rowEnd, columnStart:columnEnd]
+    rows, columns = rows.ravel(), columns.ravel()
+    pixelIds = rows * dimensions[0] + columns
+
+    colorSum = np.zeros((len(rows), 3))
+    colorSquaredSum = np.zeros((len(rows), 3))
+    sampleCounts = np.zeros(len(rows), dtype=int)
+
+    def addSamples(pixels, target):
+        # samples are added one at a time to all the pixels that have less than target
+        while len(pixels):
+            samples = sampleCounts[pixels]
+            if minSamples == 1:
+                # the first sample is the center of the pixel, the pattern starts at the second one
+                rowOffsets, columnOffsets = np.zeros(len(pixels)), np.zeros(len(pixels))
+                jittered = samples > 0
+                if jittered.any():
+                    rowOffsets[jittered], columnOffsets[jittered] = sampleOffsets(
+                        pixelIds[pixels[jittered]], samples[jittered] - 1, maxSamples - 1, pattern, seed)
+            else:
+                rowOffsets, columnOffsets = sampleOffsets(pixelIds[pixels], samples, maxSamples, pattern, seed)
+            colors = shadePixels(rows[pixels] + rowOffsets, columns[pixels] + columnOffsets, dimensions, FOV, worldInfos, parameters, chunkSize, objects)
+            colorSum[pixels] += colors
+            colorSquaredSum[pixels] += colors ** 2
+            sampleCounts[pixels] += 1
+            pixels = pixels[sampleCounts[pixels] < target]
+
+    def standardErrors(pixels):
+        counts = sampleCounts[pixels, None]
+        mean = colorSum[pixels] / counts
+        variance = np.maximum(colorSquaredSum[pixels] / counts - mean ** 2, 0) / np.maximum(counts - 1, 1)
+        return np.sqrt(variance).max(axis=1)
+
+    allPixels = np.arange(len(rows))
+    addSamples(allPixels, minSamples)
+
+    image = (colorSum / sampleCounts[:, None]).reshape((tileHeight, tileWidth, 3))
+    active = neighbourContrast(image).ravel() > threshold
+    if minSamples > 1:
+        active |= standardErrors(allPixels) > threshold
+
+    target = minSamples
+    pixels = allPixels[active]
+    while len(pixels) and target < maxSamples:
+        target = min(max(target * 2, 4), maxSamples)
+        addSamples(pixels, target)
+        # edges stay refined while they stand out: a few samples on the same side of an edge have no variance
+        image = (colorSum / sampleCounts[:, None]).reshape((tileHeight, tileWidth, 3))
+        pixels = pixels[(standardErrors(pixels) > threshold) | (neighbourContrast(image).ravel()[pixels] > threshold)]
+
+    colors = colorSum / sampleCounts[:, None]
+    return colors.reshape((tileHeight, tileWidth, 3)), sampleCounts.reshape((tileHeight, tileWidth))
+
+
+def renderAdaptive(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, chunkSize: int = 65536, tileSize: int = 32):
+    """renderBatch with adaptive anti-aliasing (see renderAdaptiveTile for the parameters)
+    Rendered tile by tile (tileSize) with the random stream of each tile: the contrast of the pixels is measured inside
+    their tile, the image is the same as renderParallel with the same seed and tileSize.
+    """
+    actualTime = time.time()
+
+    width, height = dimensions
+    image = np.empty((height, width, 3))
+    for tile in splitTiles(dimensions, tileSize):
+        with useStream(parameters.get("seed", 0), tile[0], tile[2]):
+            image[tile[0]:tile[1], tile[2]:tile[3]] = renderAdaptiveTile(tile, dimensions, FOV, worldInfos, parameters, chunkSize)[0]
+
+    return image, time.time() - actualTime
@@ -0,0 +1,61 @@
+#! /bin/env python
+"""Checks that the kernel backends (kernels.availableBackends) give the same results, then times a render with each.
+The scene is the scene of raytracer.py with random small spheres and triangles added (primitives).
+The Numba kernels are compiled (or loaded from the disk cache) by the parity check, before the timings.
+
+Usage: python benchmarks/backend_benchmark.py [primitives] [width] [height]
+"""
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import kernels
+import raytracer
+from Vector import Vector
+from objects_class import Sphere, Triangle
+from packed_scene import PackedScene
+from renderer import renderBatch
+
+
+def buildScene(primitives, seed=0):
+    rng = np.random.default_rng(seed)
+    shader = raytracer.objects[0]._shader
+    objects = list(raytracer.objects)
+    for _ in range(primitives // 2):
+        center = Vector(*rng.uniform((-3, -1, -8), (3, 2, -3)))
+        objects.append(Sphere(center, 0.1, shader))
+        point = Vector(*rng.uniform((-3, -1, -8), (3, 2, -3)))
+        objects.append(Triangle(point, point + Vector(0.2, 0, 0), point + Vector(0, 0.2, 0.05), shader))
+    return PackedScene(objects)
+
+
+def randomRays(count, seed=0):
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    return rng.uniform(-1, 1, (count, 3)), directions, rng.uniform(0, 5, count)
+
+
+if __name__ == "__main__":
+    primitives = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    dimensions = (int(sys.argv[2]) if len(sys.argv) > 2 else 320, int(sys.argv[3]) if len(sys.argv) > 3 else 240)
+    scene = buildScene(primitives)
+    worldInfos = (scene, raytracer.light, raytracer.skyDiffuse, raytracer.camera)
+    parameters = dict(raytracer.parameters, tileCulling=False)
+
+    origins, directions, maxDistances = randomRays(20000)
+    print("largest difference with the NumPy backend (0 or 1 for the hit/miss and any-hit results):")
+    for origin in (origins, np.zeros(3)):
+        for name, differences in kernels.compareBackends(scene.rows, origin, directions, maxDistances).items():
+            print("%-7s %s" % (name, ", ".join("%s %.2g" % item for item in differences.items())))
+
+    images = {}
+    print("\n%-7s %10s" % ("backend", "render (s)"))
+    for name in kernels.availableBackends():
+        kernels.setBackend(name)
+        images[name], renderTime = renderBatch(dimensions, raytracer.FOVP, worldInfos, parameters)
+        print("%-7s %10.3f" % (name, renderTime))
+
+    for name, image in images.items():
+        print("%s image, largest difference with numpy: %.2g" % (name, np.abs(image - images["numpy"]).max()))
@@ -0,0 +1,231 @@
+#! /bin/env python
+"""Renders the reference scenes and measures each of them: time per frame, rays per second, peak memory and
+image error (PSNR against the reference images of benchmarks/references).
+The results are written as JSON and compared with a saved baseline: a case is flagged as a regression if it is
+slower or uses more memory than the baseline (beyond the tolerances), or if its image got worse.
+The exit status is 1 if there is a regression.
+
+Each case is rendered in its own process (peak memory of the case only), with the batch renderer.
+The rays are counted by a first render with the profiler (profiler.profileRender), the time is the best of the
+next renders without it.
+
+Usage:
+    python benchmarks/benchmark_suite.py                        all the cases, compared with the baseline
+    python benchmarks/benchmark_suite.py --cases default,mesh   some of the cases
+    python benchmarks/benchmark_suite.py --save-baseline        the results become the baseline
+    python benchmarks/benchmark_suite.py --update-references    the images become the references (after an intended change)
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import resource
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+benchmarkDirectory = os.path.join(root, "benchmarks")
+
+
+# Reference scenes: scene file (relative to the repository), image size and parameters replacing those of the scene,
+# referenceCase: compared with the reference image of another case (never written by this case), minPSNR: replaces --min-psnr
+CASES = {
+    "default": {"scene": "scenes/default.json", "width": 160, "height": 120},
+    "reflective": {"scene": "benchmarks/scenes/reflective.json", "width": 160, "height": 120},
+    "gi32": {"scene": "benchmarks/scenes/gi.json", "width": 160, "height": 120, "parameters": {"indirectLightingSamples": 32}},
+    "gi64": {"scene": "benchmarks/scenes/gi.json", "width": 160, "height": 120, "parameters": {"indirectLightingSamples": 64}},
+    # 8 samples and the denoiser against the 64 samples image
+    "gi8denoise": {"scene": "benchmarks/scenes/gi.json", "width": 160, "height": 120,
+                   "parameters": {"indirectLightingSamples": 8, "denoise": True}, "referenceCase": "gi64", "minPSNR": 35.0},
+    "mesh": {"scene": "benchmarks/scenes/mesh.json", "width": 160, "height": 120},
+}
+
+# Torus of the mesh scene, written by makeTorus the first time (rings * segments * 2 triangles)
+torusPath = os.path.join(benchmarkDirectory, "scenes", "meshes", "torus.obj")
+torusRings, torusSegments = 500, 200
+
+
+def makeTorus(path: str, rings: int = torusRings, segments: int = torusSegments, radius: float = 0.55, tubeRadius: float = 0.22):
+    """Writes an OBJ torus (always the same file for the same arguments), tilted towards the camera"""
+    u, v = np.meshgrid(np.linspace(0, 2 * np.pi, rings, endpoint=False), np.linspace(0, 2 * np.pi, segments, endpoint=False), indexing="ij")
+    x = (radius + tubeRadius * np.cos(v)) * np.cos(u)
+    y = (radius + tubeRadius * np.cos(v)) * np.sin(u)
+    z = tubeRadius * np.sin(v)
+    tilt = math.radians(60)
+    vertices = np.stack((x, y * math.cos(tilt) - z * math.sin(tilt), y * math.sin(tilt) + z * math.cos(tilt)), axis=-1).reshape((-1, 3))
+
+    i, j = np.meshgrid(np.arange(rings), np.arange(segments), indexing="ij")
+    a, b = i * segments + j, ((i + 1) % rings) * segments + j
+    c, d = ((i + 1) % rings) * segments + (j + 1) % segments, i * segments + (j + 1) % segments
+    faces = np.concatenate((np.stack((a, b, c), axis=-1).reshape((-1, 3)), np.stack((a, c, d), axis=-1).reshape((-1, 3)))) + 1
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".%d.tmp" % os.getpid()
+    with open(temporary, "w") as f:
+        f.write("".join("v %.6f %.6f %.6f\n" % tuple(vertex) for vertex in vertices.tolist()))
+        f.write("".join("f %d %d %d\n" % tuple(face) for face in faces.tolist()))
+    os.replace(temporary, path)
+
+
+# Measures ==============================================================================================================================
+
+def psnr(image, reference):
+    """Peak signal to noise ratio (dB) of an image against a reference, both between 0 and 1 (inf if they are equal)"""
+    error = np.mean((np.clip(image, 0, 1) - reference) ** 2)
+    return math.inf if error == 0 else 10 * math.log10(1 / error)
+
+
+def quantize(image):
+    """Image as it is written in a PNG file by renderer.writeImage (8 bits per channel, truncated)"""
+    return np.floor(np.clip(image, 0, 1) * 255) / 255
+
+
+def runCase(case: dict, repeat: int):
+    """Renders one case (in a worker process), returns its measures and its image"""
+    from scene_loader import Scene
+    from raytracer import renderWith
+    from profiler import profileRender
+    from kernels import backend
+
+    loadTime = time.time()
+    scene = Scene.fromFile(os.path.join(root, case["scene"]))
+    loadTime = time.time() - loadTime
+    dimensions = (case["width"], case["height"])
+    parameters = dict(scene.parameters, **case.get("parameters", {}))
+
+    _image, _profileTime, profiler = profileRender(dimensions, scene.FOV, scene.worldInfos(), parameters)
+    rays = profiler.report()["rays"]
+
+    times = []
+    for _ in range(repeat):
+        image, renderTime = renderWith("batch", dimensions, scene.FOV, scene.worldInfos(), parameters)
+        times.append(renderTime)
+
+    frameTime = min(times)
+    return {
+        "scene": case["scene"], "width": dimensions[0], "height": dimensions[1], "parameters": case.get("parameters", {}),
+        "backend": backend().name, "loadTime": loadTime, "frameTime": frameTime, "frameTimes": times,
+        "rays": rays, "raysPerSecond": rays["total"] / frameTime,
+        # kilobytes on Linux
+        "peakMemoryMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }, image
+
+
+def measureCase(name: str, case: dict, repeat: int, updateReference: bool):
+    """runCase in a new process, then the PSNR of its image against the reference (written if there is none)"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        result, image = pool.submit(runCase, case, repeat).result()
+
+    from renderer import writeImage
+    import matplotlib.image
+
+    referencePath = os.path.join(benchmarkDirectory, "references", case.get("referenceCase", name) + ".png")
+    if "referenceCase" not in case and (updateReference or not os.path.exists(referencePath)):
+        writeImage(referencePath, image)
+        result["reference"] = "written"
+    if "minPSNR" in case:
+        result["minPSNR"] = case["minPSNR"]
+    reference = np.round(matplotlib.image.imread(referencePath)[:, :, :3].astype(float) * 255) / 255
+    result["psnr"] = psnr(quantize(image), reference) if reference.shape == image.shape else None
+    return result
+
+
+# Regressions ===========================================================================================================================
+
+def findRegressions(results: dict, baseline: dict, timeTolerance: float, memoryTolerance: float, minPSNR: float, psnrTolerance: float,
+                    timeSlack: float = 0.02):
+    """Regressions of the cases of results (name -> measures) against the baseline (same format)
+    timeSlack: seconds always allowed on top of timeTolerance, the times of the fastest cases are noisy
+    Returns a list of dict(case, measure, value, baseline, message)
+    """
+    regressions = []
+
+    def flag(name, measure, value, reference, message):
+        regressions.append({"case": name, "measure": measure, "value": value, "baseline": reference, "message": message})
+
+    for name, result in results.items():
+        if result["psnr"] is None:
+            flag(name, "psnr", None, None, "the image doesn't have the size of the reference")
+        elif result["psnr"] < result.get("minPSNR", minPSNR):
+            flag(name, "psnr", result["psnr"], result.get("minPSNR", minPSNR),
+                 "image too far from the reference (%.1f dB < %.1f dB)" % (result["psnr"], result.get("minPSNR", minPSNR)))
+
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["frameTime"] > previous["frameTime"] * (1 + timeTolerance) + timeSlack:
+            flag(name, "frameTime", result["frameTime"], previous["frameTime"], "%.0f%% slower" % (100 * (result["frameTime"] / previous["frameTime"] - 1)))
+        if result["peakMemoryMB"] > previous["peakMemoryMB"] * (1 + memoryTolerance):
+            flag(name, "peakMemoryMB", result["peakMemoryMB"], previous["peakMemoryMB"],
+                 "%.0f%% more memory" % (100 * (result["peakMemoryMB"] / previous["peakMemoryMB"] - 1)))
+        if result["psnr"] is not None and previous.get("psnr") is not None and result["psnr"] < previous["psnr"] - psnrTolerance:
+            flag(name, "psnr", result["psnr"], previous["psnr"], "image error increased (%.1f dB -> %.1f dB)" % (previous["psnr"], result["psnr"]))
+    return regressions
+
+
+def _jsonValue(value):
+    """inf PSNR (identical images) written as a string, JSON has no infinity"""
+    return "inf" if isinstance(value, float) and math.isinf(value) else value
+
+
+def readResults(path: str):
+    with open(path) as f:
+        results = json.load(f)
+    for result in results["cases"].values():
+        if result.get("psnr") == "inf":
+            result["psnr"] = math.inf
+    return results
+
+
+def writeResults(path: str, results: dict):
+    cases = {name: {key: _jsonValue(value) for key, value in result.items()} for name, result in results["cases"].items()}
+    with open(path, "w") as f:
+        json.dump(dict(results, cases=cases), f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the reference scenes with regression tracking")
+    parser.add_argument("--cases", help="comma separated case names (default: all): " + ", ".join(CASES))
+    parser.add_argument("--repeat", type=int, default=3, help="timed renders of each case, the best one is kept")
+    parser.add_argument("--output", default=os.path.join(benchmarkDirectory, "results.json"), help="results (JSON)")
+    parser.add_argument("--baseline", default=os.path.join(benchmarkDirectory, "baseline.json"), help="baseline results (JSON)")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file too")
+    parser.add_argument("--update-references", action="store_true", help="write the images as the new reference images")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="slowdown allowed before a regression (fraction)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="memory increase allowed before a regression (fraction)")
+    parser.add_argument("--min-psnr", type=float, default=40.0, help="lowest PSNR (dB) accepted against the references")
+    parser.add_argument("--psnr-tolerance", type=float, default=1.0, help="PSNR decrease (dB) against the baseline allowed")
+    arguments = parser.parse_args()
+
+    names = arguments.cases.split(",") if arguments.cases else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error("unknown cases: %s" % ", ".join(unknown))
+    if "mesh" in names and not os.path.exists(torusPath):
+        makeTorus(torusPath)
+
+    results = {}
+    print("%-11s %10s %12s %10s %9s" % ("case", "frame (s)", "rays/s", "peak (MB)", "PSNR (dB)"))
+    for name in names:
+        result = results[name] = measureCase(name, CASES[name], arguments.repeat, arguments.update_references)
+        print("%-11s %10.3f %12.0f %10.1f %9s" % (name, result["frameTime"], result["raysPerSecond"], result["peakMemoryMB"],
+                                                 "-" if result["psnr"] is None else "%.1f" % result["psnr"]))
+
+    baseline = readResults(arguments.baseline)["cases"] if os.path.exists(arguments.baseline) else {}
+    regressions = findRegressions(results, baseline, arguments.time_tolerance, arguments.memory_tolerance,
+                                  arguments.min_psnr, arguments.psnr_tolerance)
+    report = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "machine": platform.platform(), "processor": platform.processor(),
+              "python": platform.python_version(), "cases": results, "regressions": regressions}
+    writeResults(arguments.output, report)
+    if arguments.save_baseline:
+        writeResults(arguments.baseline, report)
+
+    for regression in regressions:
+        print("REGRESSION %s %s: %s" % (regression["case"], regression["measure"], regression["message"]))
+    print("%d regressions, results written to %s" % (len(regressions), arguments.output))
+    sys.exit(1 if regressions else 0)
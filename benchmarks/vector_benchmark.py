@@ -0,0 +1,105 @@
+#! /bin/env python
+"""Microbenchmark of the Vector operations used by the intersect and shader hot paths.
+Compares each operation with the previous Vector implementation (LegacyVector below),
+then a loop over Vectors with the same operations on a VectorArray.
+
+Usage: python benchmarks/vector_benchmark.py [repeat]
+"""
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Vector import Vector, VectorArray
+
+
+# Previous implementation (instance __dict__, temporary Vector for scalars, type() dispatch)
+class LegacyVector:
+
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+    def __add__(self, other):
+        if type(other) == LegacyVector:
+            return LegacyVector(self.x + other.x, self.y + other.y, self.z + other.z)
+        elif type(other) == float or type(other) == int:
+            return self + LegacyVector(other, other, other)
+
+    def __sub__(self, other):
+        if type(other) == LegacyVector:
+            return LegacyVector(self.x - other.x, self.y - other.y, self.z - other.z)
+        elif type(other) == float or type(other) == int:
+            return self - LegacyVector(other, other, other)
+
+    def __mul__(self, other):
+        if type(other) == LegacyVector:
+            return LegacyVector(self.x * other.x, self.y * other.y, self.z * other.z)
+        elif type(other) == float or type(other) == int:
+            return self * LegacyVector(other, other, other)
+
+    def __truediv__(self, other):
+        if type(other) == LegacyVector:
+            return LegacyVector(self.x / other.x, self.y / other.y, self.z / other.z)
+        elif type(other) == float or type(other) == int:
+            return self / LegacyVector(other, other, other)
+
+    def length(self):
+        return (self.x**2 + self.y**2 + self.z**2) ** 0.5
+
+    def normalize(self):
+        return self / self.length()
+
+    def dotProduct(self, other):
+        temp = self * other
+        return float(temp.x + temp.y + temp.z)
+
+
+OPERATIONS = {
+    "vector + vector": "a + b",
+    "vector - vector": "a - b",
+    "vector * scalar": "a * 0.5",
+    "vector / scalar": "a / 3.0",
+    "vector + scalar": "a + 1.0",
+    "dotProduct": "a.dotProduct(b)",
+    "normalize": "a.normalize()",
+    "accumulate (+=)": "c += b",
+}
+
+
+def timeOperation(cls, statement, number, repeat):
+    setup = "a = cls(0.1, 0.2, 0.3); b = cls(1.0, 2.0, 3.0); c = cls(0.0, 0.0, 0.0)"
+    return min(timeit.repeat(statement, setup, globals={"cls": cls}, number=number, repeat=repeat)) / number
+
+
+def timeArray(count, repeat):
+    rng = np.random.default_rng(0)
+    data = rng.random((count, 3))
+    vectors = [Vector(*row) for row in data.tolist()]
+    light = Vector(5.0, 5.0, 5.0)
+    array = VectorArray.fromArray(data)
+
+    def loop():
+        return [(light - v).normalize().dotProduct(v) for v in vectors]
+
+    def packed():
+        return (array - light).normalize().dotProduct(array)
+
+    return (min(timeit.repeat(loop, number=1, repeat=repeat)) / count,
+            min(timeit.repeat(packed, number=1, repeat=repeat)) / count)
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    number = 200000
+
+    print("%-18s %12s %12s %8s" % ("operation", "legacy (ns)", "Vector (ns)", "speedup"))
+    for name, statement in OPERATIONS.items():
+        legacy = timeOperation(LegacyVector, statement, number, repeat)
+        current = timeOperation(Vector, statement, number, repeat)
+        print("%-18s %12.1f %12.1f %7.2fx" % (name, legacy * 1e9, current * 1e9, legacy / current))
+
+    loop, packed = timeArray(100000, repeat)
+    print("\nper vector, (light - v).normalize().dotProduct(v) on 100000 vectors:")
+    print("%-18s %12.1f ns" % ("Vector loop", loop * 1e9))
+    print("%-18s %12.1f ns (%.1fx)" % ("VectorArray", packed * 1e9, loop / packed))
@@ -0,0 +1,444 @@
+import time
+import numpy as np
+
+from Vector import Vector
+
+
+def surfaceArea(boundsMin, boundsMax):
+    size = np.maximum(boundsMax - boundsMin, 0)
+    return 2 * (size[..., 0] * size[..., 1] + size[..., 1] * size[..., 2] + size[..., 2] * size[..., 0])
+
+
+def inverseDirections(rayDirections):
+    """1/direction, with a huge value instead of infinity so that the slab test never computes 0 * inf"""
+    with np.errstate(divide="ignore"):
+        return np.where(rayDirections == 0, 1e30, 1 / rayDirections)
+
+
+def segmentPositions(starts, counts):
+    """Concatenation of arange(start, start + count) for each segment, the segment of each position
+    and the offset of each segment in the concatenation
+    """
+    offsets = np.cumsum(counts) - counts
+    segments = np.repeat(np.arange(len(counts)), counts)
+    return np.arange(counts.sum()) - offsets[segments] + starts[segments], segments, offsets
+
+
+# Bounding Volume Hierarchy
+class BVH:
+    arrayNames = ("nodeMin", "nodeMax", "nodeFirst", "nodeSize", "nodeLeft", "nodeRight", "nodeAxis", "primitives")
+
+    def __init__(self, boundsMin, boundsMax, leafSize: int = 2, maxLeafSize: int = 16, bins: int = 16):
+        """boundsMin, boundsMax: arrays (N, 3), axis aligned bounding box of each primitive
+        leafSize: nodes with this many primitives or less are never split
+        maxLeafSize: nodes with more primitives are always split, even if the SAH says otherwise
+        bins: number of candidate split positions per node
+
+        The tree is built with a binned Surface Area Heuristic, one level at a time: all the nodes of a level
+        are split together with array operations, so that meshes with millions of triangles build in seconds.
+        It is stored as flat arrays: the primitives of a leaf are primitives[nodeFirst:nodeFirst + nodeSize],
+        interior nodes have nodeSize 0 and their children are nodeLeft and nodeRight.
+        """
+        buildTime = time.time()
+        if boundsMin is not None:
+            self._build(np.asarray(boundsMin, dtype=float).reshape((-1, 3)), np.asarray(boundsMax, dtype=float).reshape((-1, 3)),
+                        leafSize, maxLeafSize, bins)
+        self.buildTime = time.time() - buildTime
+        self._lists = None
+
+    def _build(self, boundsMin, boundsMax, leafSize, maxLeafSize, bins):
+        count = len(boundsMin)
+        centroids = (boundsMin + boundsMax) / 2
+        self.primitives = np.arange(count)
+
+        # a binary tree with at least one primitive per leaf has at most 2 * count - 1 nodes
+        capacity = max(2 * count - 1, 0)
+        nodeMin, nodeMax = np.empty((capacity, 3)), np.empty((capacity, 3))
+        nodeFirst, nodeSize = np.zeros(capacity, dtype=int), np.zeros(capacity, dtype=int)
+        nodeLeft, nodeRight, nodeAxis = np.full(capacity, -1), np.full(capacity, -1), np.zeros(capacity, dtype=int)
+        nodeTotal = self.depth = 0
+        if count:
+            nodeMin[0], nodeMax[0], nodeSize[0] = boundsMin.min(axis=0), boundsMax.max(axis=0), count
+            nodeTotal = self.depth = 1
+
+        # nodes to split at this level
+        nodes = np.array([0] if count > leafSize else [], dtype=int)
+        while len(nodes):
+            rows = np.arange(len(nodes))
+            starts, counts = nodeFirst[nodes], nodeSize[nodes]
+            positions, segments, offsets = segmentPositions(starts, counts)
+            items = self.primitives[positions]
+
+            # split axis: largest extent of the centroids
+            centroidMin = np.minimum.reduceat(centroids[items], offsets)
+            centroidMax = np.maximum.reduceat(centroids[items], offsets)
+            axes = np.argmax(centroidMax - centroidMin, axis=1)
+            low, extent = centroidMin[rows, axes], (centroidMax - centroidMin)[rows, axes]
+
+            # bin of each primitive, then the primitives of each node are sorted by bin
+            keys = centroids[items, axes[segments]]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                itemBins = np.where(extent[segments] > 0, (keys - low[segments]) / extent[segments] * bins, 0)
+            binKeys = segments * bins + np.clip(itemBins.astype(int), 0, bins - 1)
+            order = np.argsort(binKeys, kind="stable")
+            items, binKeys = items[order], binKeys[order]
+            self.primitives[positions] = items
+
+            # bounds and number of primitives of each bin
+            binStarts = np.flatnonzero(np.r_[True, binKeys[1:] != binKeys[:-1]])
+            binMin = np.full((len(nodes) * bins, 3), np.inf)
+            binMax = np.full((len(nodes) * bins, 3), -np.inf)
+            binCount = np.zeros(len(nodes) * bins, dtype=int)
+            binMin[binKeys[binStarts]] = np.minimum.reduceat(boundsMin[items], binStarts)
+            binMax[binKeys[binStarts]] = np.maximum.reduceat(boundsMax[items], binStarts)
+            binCount[binKeys[binStarts]] = np.diff(np.r_[binStarts, len(items)])
+            binMin, binMax, binCount = binMin.reshape((-1, bins, 3)), binMax.reshape((-1, bins, 3)), binCount.reshape((-1, bins))
+
+            # SAH cost of a split after each bin, relative to the cost of intersecting one primitive
+            leftCount = np.cumsum(binCount, axis=1)[:, :-1]
+            leftArea = surfaceArea(np.minimum.accumulate(binMin, axis=1), np.maximum.accumulate(binMax, axis=1))[:, :-1]
+            rightArea = surfaceArea(np.minimum.accumulate(binMin[:, ::-1], axis=1)[:, ::-1],
+                                    np.maximum.accumulate(binMax[:, ::-1], axis=1)[:, ::-1])[:, 1:]
+            nodeArea = surfaceArea(nodeMin[nodes], nodeMax[nodes])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                costs = 1 + (leftArea * leftCount + rightArea * (counts[:, None] - leftCount)) / nodeArea[:, None]
+            costs[(leftCount == 0) | (leftCount == counts[:, None]) | ~np.isfinite(costs)] = np.inf
+            bestSplit = np.argmin(costs, axis=1)
+            bestCost = costs[rows, bestSplit]
+            leftSizes = leftCount[rows, bestSplit]
+
+            # nodes the SAH can't split (all the centroids in one bin) are cut in the middle if they are too big
+            forced = ~np.isfinite(bestCost) & (counts > maxLeafSize)
+            leftSizes[forced] = counts[forced] // 2
+            split = (bestCost < counts) | (counts > maxLeafSize)
+            if not split.any():
+                break
+
+            parents, leftSizes = nodes[split], leftSizes[split]
+            children = nodeTotal + np.arange(2 * len(parents))
+            childStarts = np.stack((starts[split], starts[split] + leftSizes), axis=1).ravel()
+            childCounts = np.stack((leftSizes, counts[split] - leftSizes), axis=1).ravel()
+            childPositions, _segments, childOffsets = segmentPositions(childStarts, childCounts)
+            childItems = self.primitives[childPositions]
+
+            nodeMin[children] = np.minimum.reduceat(boundsMin[childItems], childOffsets)
+            nodeMax[children] = np.maximum.reduceat(boundsMax[childItems], childOffsets)
+            nodeFirst[children], nodeSize[children] = childStarts, childCounts
+            nodeSize[parents], nodeAxis[parents] = 0, axes[split]
+            nodeLeft[parents], nodeRight[parents] = children[0::2], children[1::2]
+
+            nodeTotal += len(children)
+            self.depth += 1
+            nodes = children[childCounts > leafSize]
+
+        self.nodeMin, self.nodeMax = nodeMin[:nodeTotal].copy(), nodeMax[:nodeTotal].copy()
+        self.nodeFirst, self.nodeSize = nodeFirst[:nodeTotal].copy(), nodeSize[:nodeTotal].copy()
+        self.nodeLeft, self.nodeRight, self.nodeAxis = nodeLeft[:nodeTotal].copy(), nodeRight[:nodeTotal].copy(), nodeAxis[:nodeTotal].copy()
+
+    # Save / load ============================================================================================
+    def toArrays(self):
+        """The arrays of the tree, to save it (see fromArrays)"""
+        arrays = {name: getattr(self, name) for name in self.arrayNames}
+        arrays["depth"] = np.array(self.depth)
+        return arrays
+
+    @classmethod
+    def fromArrays(cls, arrays, offset=0, scale=1):
+        """Tree saved with toArrays, its bounds can be moved (offset) then scaled (scale > 0) like its primitives"""
+        bvh = cls(None, None)
+        for name in cls.arrayNames:
+            setattr(bvh, name, np.asarray(arrays[name]))
+        bvh.nodeMin = (bvh.nodeMin + offset) * scale
+        bvh.nodeMax = (bvh.nodeMax + offset) * scale
+        bvh.depth = int(arrays["depth"])
+        return bvh
+
+    # Stats ==================================================================================================
+    @property
+    def nodeCount(self):
+        return len(self.nodeSize)
+
+    @property
+    def leafCount(self):
+        return int(np.count_nonzero(self.nodeSize))
+
+    def stats(self):
+        return {"buildTime": self.buildTime, "nodes": self.nodeCount, "leaves": self.leafCount,
+                "depth": self.depth, "primitives": len(self.primitives)}
+
+    # Traversal ==============================================================================================
+    def _scalarLists(self):
+        # plain lists are much faster than arrays to read one item at a time,
+        # they are only made the first time the scalar traversal is used
+        if self._lists is None:
+            self._lists = (self.nodeMin.tolist(), self.nodeMax.tolist(), self.nodeFirst.tolist(), self.nodeSize.tolist(),
+                           self.nodeLeft.tolist(), self.nodeRight.tolist(), self.primitives.tolist())
+        return self._lists
+
+    def _slab(self, rayOrigin, rayDirection):
+        """Returns slab(node): distance where the ray enters the box of the node, None if it misses it"""
+        ox, oy, oz = rayOrigin.x, rayOrigin.y, rayOrigin.z
+        ix = 1 / rayDirection.x if rayDirection.x else 1e30
+        iy = 1 / rayDirection.y if rayDirection.y else 1e30
+        iz = 1 / rayDirection.z if rayDirection.z else 1e30
+        nodeMin, nodeMax = self._scalarLists()[:2]
+
+        def slab(node):
+            mn, mx = nodeMin[node], nodeMax[node]
+            t1, t2 = (mn[0] - ox) * ix, (mx[0] - ox) * ix
+            tNear, tFar = min(t1, t2), max(t1, t2)
+            t1, t2 = (mn[1] - oy) * iy, (mx[1] - oy) * iy
+            tNear, tFar = max(tNear, min(t1, t2)), min(tFar, max(t1, t2))
+            t1, t2 = (mn[2] - oz) * iz, (mx[2] - oz) * iz
+            tNear, tFar = max(tNear, min(t1, t2)), min(tFar, max(t1, t2))
+            return tNear if tFar >= max(tNear, 0) else None
+
+        return slab
+
+    def intersect(self, rayOrigin, rayDirection, intersectPrimitive, maxDistance=np.inf):
+        """Closest hit of one ray (Vectors)
+        intersectPrimitive(index, rayOrigin, rayDirection): returns (distance, normal) or (None, None)
+        maxDistance: hits further than this are ignored
+        Returns (primitive index or None, distance, normal)
+        """
+        if not self.nodeCount:
+            return None, maxDistance, None
+        _min, _max, nodeFirst, nodeSize, nodeLeft, nodeRight, primitives = self._scalarLists()
+        slab = self._slab(rayOrigin, rayDirection)
+
+        nearestPrimitive, minDistance, normalToSurface = None, maxDistance, None
+        stack = [(0, slab(0))]
+        while stack:
+            node, tNear = stack.pop()
+            if tNear is None or tNear > minDistance:
+                continue
+
+            size = nodeSize[node]
+            if size:
+                first = nodeFirst[node]
+                for primitive in primitives[first:first + size]:
+                    distance, normal = intersectPrimitive(primitive, rayOrigin, rayDirection)
+                    if distance and distance < minDistance:
+                        nearestPrimitive, minDistance, normalToSurface = primitive, distance, normal
+            else:
+                left, right = nodeLeft[node], nodeRight[node]
+                tLeft, tRight = slab(left), slab(right)
+                # the nearest child is visited first so that the other one is often skipped
+                if tRight is None or (tLeft is not None and tLeft <= tRight):
+                    stack.append((right, tRight))
+                    stack.append((left, tLeft))
+                else:
+                    stack.append((left, tLeft))
+                    stack.append((right, tRight))
+
+        return nearestPrimitive, minDistance, normalToSurface
+
+    def _slabArray(self, node, rayOrigins, inverseDirs):
+        t1 = (self.nodeMin[node] - rayOrigins) * inverseDirs
+        t2 = (self.nodeMax[node] - rayOrigins) * inverseDirs
+        tNear = np.minimum(t1, t2).max(axis=1)
+        tFar = np.maximum(t1, t2).min(axis=1)
+        return tNear, tFar >= np.maximum(tNear, 0)
+
+    def intersectArray(self, rayOrigins, rayDirections, intersectLeaf, maxDistances=None):
+        """Closest hit of a packet of rays, rayOrigins: array (N, 3) or (3,), rayDirections: array (N, 3)
+        intersectLeaf(primitives, rayOrigins, rayDirections): intersects the primitives of a leaf (array of indices)
+            with a subset of the rays, returns the nearest primitive (-1 if none), the distance and the normal for each ray
+        maxDistances: array (N,), hits further than this are ignored
+        Returns primitive indices (N,) (-1 if none), distances (N,), normals (N, 3)
+        """
+        count = len(rayDirections)
+        rayOrigins = np.broadcast_to(rayOrigins, rayDirections.shape)
+        inverseDirs = inverseDirections(rayDirections)
+
+        nearestPrimitives = np.full(count, -1)
+        minDistances = np.full(count, np.inf) if maxDistances is None else np.array(maxDistances, dtype=float)
+        normalsToSurface = np.zeros(rayDirections.shape)
+
+        stack = [(0, np.arange(count))] if self.nodeCount else []
+        while stack:
+            node, rays = stack.pop()
+            tNear, hit = self._slabArray(node, rayOrigins[rays], inverseDirs[rays])
+            rays = rays[hit & (tNear <= minDistances[rays])]
+            if not len(rays):
+                continue
+
+            size = self.nodeSize[node]
+            if size:
+                first = self.nodeFirst[node]
+                primitives, distances, normals = intersectLeaf(self.primitives[first:first + size], rayOrigins[rays], rayDirections[rays])
+                closer = (primitives >= 0) & (distances > 0) & (distances < minDistances[rays])
+                hitRays = rays[closer]
+                nearestPrimitives[hitRays] = primitives[closer]
+                minDistances[hitRays] = distances[closer]
+                normalsToSurface[hitRays] = normals[closer]
+            else:
+                left, right = self.nodeLeft[node], self.nodeRight[node]
+                # visit first the child on the side the rays come from
+                if rayDirections[rays, self.nodeAxis[node]].sum() >= 0:
+                    stack.append((right, rays))
+                    stack.append((left, rays))
+                else:
+                    stack.append((left, rays))
+                    stack.append((right, rays))
+
+        return nearestPrimitives, minDistances, normalsToSurface
+
+    def occluded(self, rayOrigin, rayDirection, maxDistance, occludesPrimitive):
+        """Any hit of one ray (Vectors): stops at the first primitive found closer than maxDistance
+        occludesPrimitive(index, rayOrigin, rayDirection, maxDistance): returns a bool
+        """
+        if not self.nodeCount:
+            return False
+        _min, _max, nodeFirst, nodeSize, nodeLeft, nodeRight, primitives = self._scalarLists()
+        slab = self._slab(rayOrigin, rayDirection)
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            tNear = slab(node)
+            if tNear is None or tNear >= maxDistance:
+                continue
+
+            size = nodeSize[node]
+            if size:
+                first = nodeFirst[node]
+                for primitive in primitives[first:first + size]:
+                    if occludesPrimitive(primitive, rayOrigin, rayDirection, maxDistance):
+                        return True
+            else:
+                stack.append(nodeRight[node])
+                stack.append(nodeLeft[node])
+
+        return False
+
+    def occludedArray(self, rayOrigins, rayDirections, maxDistances, occludesLeaf):
+        """Any hit of a packet of rays, rays are dropped from the traversal as soon as they are occluded
+        occludesLeaf(primitives, rayOrigins, rayDirections, maxDistances): returns bools for a subset of the rays
+        Returns bools (N,)
+        """
+        count = len(rayDirections)
+        rayOrigins = np.broadcast_to(rayOrigins, rayDirections.shape)
+        maxDistances = np.broadcast_to(maxDistances, (count,))
+        inverseDirs = inverseDirections(rayDirections)
+        isOccluded = np.zeros(count, dtype=bool)
+
+        stack = [(0, np.arange(count))] if self.nodeCount else []
+        while stack:
+            node, rays = stack.pop()
+            rays = rays[~isOccluded[rays]]
+            tNear, hit = self._slabArray(node, rayOrigins[rays], inverseDirs[rays])
+            rays = rays[hit & (tNear < maxDistances[rays])]
+            if not len(rays):
+                continue
+
+            size = self.nodeSize[node]
+            if size:
+                first = self.nodeFirst[node]
+                isOccluded[rays] |= occludesLeaf(self.primitives[first:first + size], rayOrigins[rays], rayDirections[rays], maxDistances[rays])
+            else:
+                stack.append((self.nodeRight[node], rays))
+                stack.append((self.nodeLeft[node], rays))
+
+        return isOccluded
+
+
+# List of scene objects with a BVH
+class ObjectBVH(list):
+
+    def __init__(self, objects, leafSize: int = 1):
+        """objects: scene objects, can be used as the objects list of worldInfos
+        Objects without bounds (planes) are tested one by one next to the tree.
+        Call rebuild() after changing the list or moving an object.
+        """
+        super().__init__(objects)
+        self.leafSize = leafSize
+        self.rebuild()
+
+    def rebuild(self):
+        bounds = [obj.bounds() for obj in self]
+        self.bounded = np.array([i for i, objectBounds in enumerate(bounds) if objectBounds is not None], dtype=int)
+        self.unbounded = [i for i, objectBounds in enumerate(bounds) if objectBounds is None]
+        boundsMin = np.array([bounds[i][0] for i in self.bounded]).reshape((-1, 3))
+        boundsMax = np.array([bounds[i][1] for i in self.bounded]).reshape((-1, 3))
+        self.bvh = BVH(boundsMin, boundsMax, self.leafSize)
+
+    def _intersectPrimitive(self, primitive, rayOrigin, rayDirection):
+        return self[self.bounded[primitive]].intersect(rayOrigin, rayDirection)
+
+    def _intersectLeaf(self, primitives, rayOrigins, rayDirections):
+        nearestPrimitives = np.full(len(rayDirections), -1)
+        minDistances = np.full(len(rayDirections), np.inf)
+        normalsToSurface = np.zeros(rayDirections.shape)
+        for primitive in primitives:
+            distances, normals = self[self.bounded[primitive]].intersectArray(rayOrigins, rayDirections)
+            closer = (distances > 0) & (distances < minDistances)
+            nearestPrimitives[closer] = primitive
+            minDistances[closer] = distances[closer]
+            normalsToSurface[closer] = normals[closer]
+        return nearestPrimitives, minDistances, normalsToSurface
+
+    def _occludesPrimitive(self, primitive, rayOrigin, rayDirection, maxDistance):
+        return self[self.bounded[primitive]].occludes(rayOrigin, rayDirection, maxDistance)
+
+    def _occludesLeaf(self, primitives, rayOrigins, rayDirections, maxDistances):
+        isOccluded = np.zeros(len(rayDirections), dtype=bool)
+        for primitive in primitives:
+            isOccluded |= self[self.bounded[primitive]].occludesArray(rayOrigins, rayDirections, maxDistances)
+        return isOccluded
+
+    def nearestIntersected(self, rayOrigin, rayDirection):
+        """Same as nearestIntersectedObject"""
+        nearestObject = None
+        minDistance = np.inf
+        normalToSurface = Vector(0, 0, 0)
+        for i in self.unbounded:
+            distance, normal = self[i].intersect(rayOrigin, rayDirection)
+            if distance and distance < minDistance:
+                nearestObject, minDistance, normalToSurface = self[i], distance, normal
+
+        primitive, minDistance, normal = self.bvh.intersect(rayOrigin, rayDirection, self._intersectPrimitive, minDistance)
+        if primitive is not None:
+            nearestObject, normalToSurface = self[self.bounded[primitive]], normal
+
+        return nearestObject, minDistance, normalToSurface
+
+    def nearestIntersectedArray(self, rayOrigins, rayDirections):
+        """Same as nearestIntersectedObjectArray"""
+        nearestObjects = np.full(len(rayDirections), -1)
+        minDistances = np.full(len(rayDirections), np.inf)
+        normalsToSurface = np.zeros(rayDirections.shape)
+        for i in self.unbounded:
+            distances, normals = self[i].intersectArray(rayOrigins, rayDirections)
+            closer = (distances > 0) & (distances < minDistances)
+            nearestObjects[closer] = i
+            minDistances[closer] = distances[closer]
+            normalsToSurface[closer] = normals[closer]
+
+        primitives, minDistances, normals = self.bvh.intersectArray(rayOrigins, rayDirections, self._intersectLeaf, minDistances)
+        hit = primitives >= 0
+        nearestObjects[hit] = self.bounded[primitives[hit]]
+        normalsToSurface[hit] = normals[hit]
+
+        return nearestObjects, minDistances, normalsToSurface
+
+    def occluded(self, rayOrigin, rayDirection, maxDistance):
+        """Same as shaders_class.occluded"""
+        for i in self.unbounded:
+            if self[i].occludes(rayOrigin, rayDirection, maxDistance):
+                return True
+
+        return self.bvh.occluded(rayOrigin, rayDirection, maxDistance, self._occludesPrimitive)
+
+    def occludedArray(self, rayOrigins, rayDirections, maxDistances):
+        """Same as shaders_class.occludedArray"""
+        isOccluded = np.zeros(len(rayDirections), dtype=bool)
+        for i in self.unbounded:
+            isOccluded |= self[i].occludesArray(rayOrigins, rayDirections, maxDistances)
+
+        rays = np.flatnonzero(~isOccluded)
+        if len(rays):
+            origins = np.broadcast_to(rayOrigins, rayDirections.shape)[rays]
+            isOccluded[rays] = self.bvh.occludedArray(origins, rayDirections[rays], np.broadcast_to(maxDistances, isOccluded.shape)[rays], self._occludesLeaf)
+
+        return isOccluded
@@ -0,0 +1,130 @@
+import time
+import numpy as np
+
+from renderer import pixelRays
+from shaders_class import nearestIntersectedObjectArray, normalizeArray
+
+
+# Auxiliary buffers =====================================================================================================================
+
+def auxiliaryBuffers(dimensions: tuple, FOV: int, worldInfos: tuple, chunkSize: int = 65536):
+    """Features of the surface seen by each pixel (one ray through its center), to guide the denoiser
+    Returns dict of arrays (height, width, ...):
+        albedo: diffuse color of the shader at the hit (diffuse.getColorArray), the sky color for the sky
+        normals: unit normal of the hit, 0 for the sky
+        depth: distance of the hit, np.inf for the sky
+        objectIds: index of the object hit, -1 for the sky
+    """
+    width, height = dimensions
+    objects, skyDiffuse = worldInfos[0], worldInfos[2]
+    rows, columns = np.divmod(np.arange(width * height), width)
+    origin, directions = pixelRays(rows, columns, dimensions, FOV, worldInfos[3])
+
+    albedo = np.broadcast_to(skyDiffuse.toArray(), directions.shape).copy()
+    normals = np.zeros(directions.shape)
+    depth = np.full(len(directions), np.inf)
+    objectIds = np.full(len(directions), -1)
+    for start in range(0, len(directions), chunkSize):
+        chunk = slice(start, start + chunkSize)
+        objectIds[chunk], depth[chunk], normals[chunk] = nearestIntersectedObjectArray(objects, origin, directions[chunk])
+
+    # triangles give the normal of their plane unnormalized, the cosines of denoise need unit normals
+    hits = objectIds >= 0
+    normals[hits] = normalizeArray(normals[hits])
+    for i in np.unique(objectIds[hits]):
+        hit = np.flatnonzero(objectIds == i)
+        shader = getattr(objects[i], "_shader", None)
+        diffuse = getattr(shader, "diffuse", None)
+        if diffuse is not None:
+            albedo[hit] = diffuse.getColorArray(origin + directions[hit] * depth[hit, None])
+
+    return {"albedo": albedo.reshape((height, width, 3)), "normals": normals.reshape((height, width, 3)),
+            "depth": depth.reshape((height, width)), "objectIds": objectIds.reshape((height, width))}
+
+
+def writeBuffers(path: str, buffers: dict):
+    """Saves the auxiliary buffers (and the image, if it is in buffers) as a .npz file"""
+    np.savez_compressed(path, **buffers)
+
+
+# A-trous filter ========================================================================================================================
+
+# B3 spline, the 5x5 kernel of each pass is its outer product (Dammertz et al. 2010, "Edge-Avoiding A-Trous Wavelet Transform")
+_kernel = np.array([1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16])
+
+
+def _padded(array, margin: int):
+    """array (height, width, ...) with margin pixels added on each side (edges repeated)"""
+    return np.pad(array, ((margin, margin), (margin, margin)) + ((0, 0),) * (array.ndim - 2), mode="edge")
+
+
+def _shifted(padded, margin: int, dy: int, dx: int):
+    """View of the padded array (see _padded) with the value of the pixel (y + dy, x + dx) at (y, x)"""
+    height, width = padded.shape[0] - 2 * margin, padded.shape[1] - 2 * margin
+    return padded[margin + dy:margin + dy + height, margin + dx:margin + dx + width]
+
+
+def denoise(image, buffers: dict, iterations: int = 3, sigmaColor: float = 0.4, sigmaNormal: float = 64, sigmaDepth: float = 1,
+            sigmaAlbedo: float = 0.1):
+    """Edge-avoiding a-trous wavelet filter of a noisy image (height, width, 3) guided by the auxiliary buffers:
+    each pass averages every pixel with 5x5 pixels 2^pass apart, weighted by the kernel and by how much they look alike:
+        color: exp(-|color difference|^2 / sigmaColor^2), sigmaColor halved at each pass (the noise left is smaller)
+        normals: max(normal . normal, 0) ^ sigmaNormal
+        depth: exp(-|depth difference| / (sigmaDepth * |depth difference expected from the slope| + 1e-3))
+        albedo: exp(-|albedo difference|^2 / sigmaAlbedo^2), keeps the textures sharp
+        objects: only pixels of the same object (or the sky) are averaged
+    The lighting noise is averaged over a wide area (2^(iterations+1) pixels) but not across the edges of the scene.
+    Returns the filtered image
+    """
+    depth = np.where(np.isfinite(buffers["depth"]), buffers["depth"], 0)
+    depthSlopeY, depthSlopeX = np.gradient(depth)
+    colors = np.asarray(image, dtype=float)
+
+    # guides padded once for the largest step
+    margin = 2 << max(iterations - 1, 0)
+    albedo, normals = _padded(buffers["albedo"], margin), _padded(buffers["normals"], margin)
+    objectIds, depth = _padded(buffers["objectIds"], margin), _padded(depth, margin)
+    center = lambda padded: _shifted(padded, margin, 0, 0)
+
+    for iteration in range(iterations):
+        step = 1 << iteration
+        sigma2 = (sigmaColor / step) ** 2
+        paddedColors = _padded(colors, margin)
+        colorSum = np.zeros(colors.shape)
+        weightSum = np.zeros(colors.shape[:2])
+        for i, ky in enumerate(_kernel):
+            for j, kx in enumerate(_kernel):
+                dy, dx = (i - 2) * step, (j - 2) * step
+                neighbourColors = _shifted(paddedColors, margin, dy, dx)
+                # logarithm of the product of the weights, a single exp
+                exponent = -np.einsum("ijk,ijk->ij", neighbourColors - colors, neighbourColors - colors) / sigma2
+                cosines = np.einsum("ijk,ijk->ij", _shifted(normals, margin, dy, dx), center(normals))
+                # the sky has no normal
+                exponent += sigmaNormal * np.log(np.where(center(objectIds) < 0, 1, np.maximum(cosines, 1e-12)))
+                expected = np.abs(depthSlopeY * dy + depthSlopeX * dx)
+                exponent -= np.abs(_shifted(depth, margin, dy, dx) - center(depth)) / (sigmaDepth * expected + 1e-3)
+                albedoDifferences = _shifted(albedo, margin, dy, dx) - center(albedo)
+                exponent -= np.einsum("ijk,ijk->ij", albedoDifferences, albedoDifferences) / sigmaAlbedo ** 2
+                weights = ky * kx * np.exp(exponent) * (_shifted(objectIds, margin, dy, dx) == center(objectIds))
+                colorSum += neighbourColors * weights[:, :, None]
+                weightSum += weights
+        # the pixel itself always has a weight (its kernel weight), the sums are never 0
+        colors = colorSum / weightSum[:, :, None]
+    return colors
+
+
+def postProcess(image, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, auxiliaryPath: str = None):
+    """Denoises a rendered image if the denoise parameter is set: True, or dict of arguments of denoise (iterations, sigmaColor...),
+    and writes the auxiliary buffers with the image (before denoising) to auxiliaryPath (.npz, optional)
+    Returns (image, time spent)
+    """
+    options = parameters.get("denoise")
+    if not options and not auxiliaryPath:
+        return image, 0
+    startTime = time.time()
+    buffers = auxiliaryBuffers(dimensions, FOV, worldInfos)
+    if auxiliaryPath:
+        writeBuffers(auxiliaryPath, dict(buffers, image=image))
+    if options:
+        image = denoise(image, buffers, **(options if isinstance(options, dict) else {}))
+    return image, time.time() - startTime
@@ -0,0 +1,98 @@
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from renderer import PNGWriter, toBytes
+from parallel_render import splitTiles, renderTile, _initWorker, _renderWorkerTile
+
+
+# Images bigger than this (pixels) are rendered by renderToFile in runJob, whatever the job says
+outOfCorePixels = 8192 * 8192
+
+
+# Memory-mapped framebuffer =============================================================================================================
+
+def openFramebuffer(path: str, dimensions: tuple, dtype: str = "float16"):
+    """Framebuffer (height, width, 3) in a .npy file (header then raw pixels) memory-mapped: only the pages
+    being written are in memory, the system writes them to the disk
+    dtype: "float16", "float32" (colors between 0 and 1) or "uint8" (toBytes)
+    """
+    if dtype not in ("float16", "float32", "uint8"):
+        raise ValueError("Unknown framebuffer type: %s" % dtype)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(dimensions[1], dimensions[0], 3))
+
+
+def readFramebuffer(path: str):
+    """Framebuffer written by renderToFile, memory-mapped (read only)"""
+    return np.load(path, mmap_mode="r")
+
+
+def storeColors(framebuffer, rows: slice, colors):
+    framebuffer[rows] = toBytes(colors) if framebuffer.dtype == np.uint8 else colors
+
+
+# Out-of-core render ====================================================================================================================
+
+def _bands(dimensions: tuple, tileSize: int):
+    """Tiles of the image by band of tileSize rows, from the top"""
+    tiles = splitTiles(dimensions, tileSize)
+    columns = len(range(0, dimensions[0], tileSize))
+    return [tiles[start:start + columns] for start in range(0, len(tiles), columns)]
+
+
+def renderToFile(path: str, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, workers: int = 1, tileSize: int = 32,
+                 framebufferPath: str = None, dtype: str = "float16"):
+    """Renders the image band by band (tileSize rows of tiles, see parallel_render.renderTile) and streams every band
+    to the outputs as soon as it is finished, without the whole image in memory:
+        path: .png (PNGWriter), or .npy: memory-mapped framebuffer (openFramebuffer with dtype)
+        framebufferPath: also write the framebuffer there (with a PNG path)
+    The memory used only depends on the width of the image: one band, and the next one rendered by the workers meanwhile.
+    The image is the same as the other renderers (same tiles and random streams as renderParallel).
+    Returns (framebuffer or None, render time)
+    """
+    actualTime = time.time()
+    width, height = dimensions
+    bands = _bands(dimensions, tileSize)
+    if path.endswith(".npy"):
+        framebufferPath = path
+    framebuffer = openFramebuffer(framebufferPath, dimensions, dtype) if framebufferPath else None
+    writer = PNGWriter(path, width, height) if path.endswith(".png") else None
+    if framebuffer is None and writer is None:
+        raise ValueError("The output must be a .png or .npy file: %s" % path)
+
+    def store(band, results):
+        rowStart, rowEnd = band[0][0], band[0][1]
+        colors = np.empty((rowEnd - rowStart, width, 3))
+        for tile, tileColors in results:
+            colors[:, tile[2]:tile[3]] = tileColors
+        if framebuffer is not None:
+            storeColors(framebuffer, slice(rowStart, rowEnd), colors)
+        if writer is not None:
+            writer.writeRows(colors)
+
+    try:
+        if workers == 1:
+            for i, band in enumerate(bands):
+                store(band, [(tile, renderTile(tile, dimensions, FOV, worldInfos, parameters)) for tile in band])
+                print("%d/%d bands" % (i+1, len(bands)))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker,
+                                     initargs=(dimensions, FOV, worldInfos, parameters)) as pool:
+                # the tiles of the next band are already queued while a band is stored
+                pending = [pool.submit(_renderWorkerTile, tile) for tile in bands[0]]
+                for i, band in enumerate(bands):
+                    following = [pool.submit(_renderWorkerTile, tile) for tile in bands[i + 1]] if i + 1 < len(bands) else []
+                    store(band, [future.result()[:2] for future in pending])
+                    pending = following
+                    print("%d/%d bands" % (i+1, len(bands)))
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        if framebuffer is not None:
+            framebuffer.flush()
+    if writer is not None:
+        writer.close()
+
+    return framebuffer, time.time() - actualTime
@@ -0,0 +1,210 @@
+import time
+import numpy as np
+
+from renderer import pixelRays, finishColors, splitTiles
+from shaders_class import nearestIntersectedObjectArray, tracePathsArray
+from packed_scene import packObjects
+from lights_class import asLights, Lights
+from sampling import useStream, needsRandom
+from irradiance_cache import IrradianceCache, prepareCache
+from visibility_cache import VisibilityCache, prepareVisibilityCache, sceneSignature
+
+
+def segmentsHitBox(starts, ends, boxMin, boxMax):
+    """True for the segments (N, 3) -> (N, 3) that go through the box (slab test)"""
+    directions = ends - starts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t1, t2 = (boxMin - starts) / directions, (boxMax - starts) / directions
+    # segments parallel to a slab: inside it or not for their whole length
+    parallel = directions == 0
+    inside = (starts >= boxMin) & (starts <= boxMax)
+    t1 = np.where(parallel, np.where(inside, -np.inf, np.inf), t1)
+    t2 = np.where(parallel, np.where(inside, np.inf, -np.inf), t2)
+    near = np.minimum(t1, t2).max(axis=1)
+    far = np.maximum(t1, t2).min(axis=1)
+    return (near <= far) & (far >= 0) & (near <= 1)
+
+
+def lightVolumes(light):
+    """Centers (L, 3) and radii (L,) of spheres around the lights (a point, or the rectangle of an area light)"""
+    lights = asLights(light)
+    centers = lights.positions + (lights.edge1 + lights.edge2) / 2
+    return centers, np.linalg.norm(lights.edge1 + lights.edge2, axis=1) / 2
+
+
+class IncrementalRender:
+
+    def __init__(self, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, chunkSize: int = 65536):
+        """Render that keeps its primary hits to update the image after an edit of the scene, instead of rendering it again.
+        One ray per pixel (same image as renderBatch), the antialiasing parameters are not used.
+
+        Buffers of each pixel: object hit (-1 for the sky), distance and normal of the hit, color before finishColors.
+        After an edit, only the pixels that depend on what changed are updated:
+            objectChanged(index): an object moved or changed shape: the pixels it covered or covers now are traced again
+                (other pixels keep their hit), and they are shaded again with the pixels whose shadow rays cross its
+                old or new bounds. If only its shader changed, only the pixels that see it are shaded again.
+            lightChanged(): every pixel that hits an object is shaded again, from its buffered hit
+            cameraChanged(camera): everything is rendered again
+        The pixels whose shading traces rays in any direction (reflections, indirect lighting, ambient occlusion) depend
+        on every object: they are always shaded again. An object without bounds (plane) that moves, or an object added or
+        removed (call render()), renders everything again.
+        The random samples of each update come from their own stream: with random sampling the noise of the updated pixels
+        changes, the image is otherwise the same as a full render of the edited scene.
+        chunkSize: maximum number of rays traced together (bounds the memory used)
+        """
+        self.dimensions, self.FOV = dimensions, FOV
+        self.worldInfos = (packObjects(worldInfos[0]),) + tuple(worldInfos[1:])
+        self.parameters = prepareVisibilityCache(prepareCache(parameters), self.worldInfos[0])
+        self.chunkSize = chunkSize
+        self.updates = 0
+        self.image = None
+        self.render()
+
+    @property
+    def objects(self):
+        return self.worldInfos[0]
+
+    # Full render =========================================================================================================
+    def render(self):
+        """Renders every pixel (after adding or removing objects...), returns (image, infos) as the edits"""
+        startTime = time.time()
+        width, height = self.dimensions
+        rows, columns = np.divmod(np.arange(width * height), width)
+        self.origin, self.directions = pixelRays(rows, columns, self.dimensions, self.FOV, self.worldInfos[3])
+        self.objectIds = np.full(width * height, -1)
+        self.distances = np.full(width * height, np.inf)
+        self.normals = np.zeros((width * height, 3))
+        self.colors = np.zeros((width * height, 3))
+        self.signatures = [sceneSignature([obj]) for obj in self.objects]
+        self.bounds = [obj.bounds() for obj in self.objects]
+        self._refreshCaches(geometry=True)
+
+        everything = np.arange(width * height)
+        self._trace(everything)
+        if needsRandom(self.parameters, self.worldInfos[1]):
+            # the random streams of renderBatch: one per tile
+            for rowStart, rowEnd, columnStart, columnEnd in splitTiles(self.dimensions, 32):
+                rows, columns = np.mgrid[rowStart:rowEnd, columnStart:columnEnd]
+                with useStream(self.parameters.get("seed", 0), rowStart, columnStart):
+                    self._shade((rows * width + columns).ravel())
+        else:
+            self._shade(everything)
+        return self._finish(startTime, len(everything), len(everything))
+
+    # Edits ===============================================================================================================
+    def objectChanged(self, index: int, obj=None):
+        """Updates the image after objects[index] changed (moved, resized, other shader...)
+        obj: new object replacing it, else it was changed in place
+        Returns (image, infos), infos: dict(traced, shaded, time) with the number of pixels traced and shaded again
+        """
+        startTime = time.time()
+        objects = self.objects
+        if obj is not None:
+            objects[index] = obj
+        obj = objects[index]
+        signature = sceneSignature([obj])
+        if signature == self.signatures[index]:
+            # same geometry: only the shading of the pixels that see it changed
+            self._refreshCaches(geometry=False)
+            shaded = np.flatnonzero((self.objectIds == index) | self._spreading())
+            return self._reshade(startTime, shaded, 0)
+
+        oldBounds, newBounds = self.bounds[index], obj.bounds()
+        self.signatures[index], self.bounds[index] = signature, newBounds
+        if hasattr(objects, "update"):
+            objects.update(index)
+        elif hasattr(objects, "rebuild"):
+            objects.rebuild()
+        if oldBounds is None or newBounds is None:
+            return self.render()
+        self._refreshCaches(geometry=True)
+
+        # pixels it covered, and pixels whose rays now hit it before their current hit
+        distances = obj.intersectArray(self.origin, self.directions)[0]
+        traced = np.flatnonzero((self.objectIds == index) | (distances < self.distances))
+        self._trace(traced)
+
+        shaded = np.zeros(len(self.objectIds), dtype=bool)
+        shaded[traced] = True
+        shaded |= self._spreading() | self._shadowedBy(oldBounds) | self._shadowedBy(newBounds)
+        return self._reshade(startTime, np.flatnonzero(shaded), len(traced))
+
+    def lightChanged(self, light=None):
+        """Updates the image after the lights changed, light: new light of worldInfos, else it was changed in place"""
+        startTime = time.time()
+        if light is not None:
+            self.worldInfos = self.worldInfos[:1] + (light,) + self.worldInfos[2:]
+        if isinstance(self.worldInfos[1], Lights):
+            self.worldInfos[1].update()
+        self._refreshCaches(geometry=False)
+        return self._reshade(startTime, np.flatnonzero(self.objectIds >= 0), 0)
+
+    def cameraChanged(self, camera: dict):
+        """Renders the image again from another camera"""
+        self.worldInfos = self.worldInfos[:3] + (camera,)
+        return self.render()
+
+    # Buffers =============================================================================================================
+    def _trace(self, pixels):
+        """Nearest hits of the primary rays of the pixels"""
+        for start in range(0, len(pixels), self.chunkSize):
+            chunk = pixels[start:start + self.chunkSize]
+            self.objectIds[chunk], self.distances[chunk], self.normals[chunk] = nearestIntersectedObjectArray(
+                self.objects, self.origin, self.directions[chunk])
+
+    def _shade(self, pixels):
+        """Colors of the pixels from their buffered hits"""
+        for start in range(0, len(pixels), self.chunkSize):
+            chunk = pixels[start:start + self.chunkSize]
+            hits = (self.objectIds[chunk], self.distances[chunk], self.normals[chunk])
+            self.colors[chunk] = tracePathsArray(self.objects, self.origin, self.directions[chunk], np.ones(len(chunk)), 0,
+                                                 self.worldInfos, self.parameters, "all", hits=hits)[0]
+
+    def _reshade(self, startTime, pixels, traced):
+        self.updates += 1
+        with useStream(self.parameters.get("seed", 0), 0, 0, self.updates):
+            self._shade(pixels)
+        return self._finish(startTime, traced, len(pixels))
+
+    def _finish(self, startTime, traced, shaded):
+        width, height = self.dimensions
+        self.image = finishColors(self.colors).reshape((height, width, 3))
+        return self.image, {"traced": traced, "shaded": shaded, "time": time.time() - startTime}
+
+    # Dependencies ========================================================================================================
+    def _spreading(self):
+        """True for the pixels whose shading traces rays that can hit any object"""
+        parameters = self.parameters
+        hit = self.objectIds >= 0
+        indirect = parameters["indirectLightingMaxBounces"] > 0 and parameters["Lighting"] != "Direct"
+        if indirect or parameters.get("ambientOcclusion"):
+            return hit
+        if parameters["maxReflections"] <= 0:
+            return np.zeros(len(hit), dtype=bool)
+        reflective = np.array([getattr(getattr(obj, "_shader", None), "reflection", 1) > 0 for obj in self.objects] + [False])
+        return reflective[self.objectIds]
+
+    def _shadowedBy(self, bounds):
+        """True for the pixels whose shadow rays can cross the box bounds (min, max)"""
+        shadowed = np.zeros(len(self.objectIds), dtype=bool)
+        hit = np.flatnonzero(self.objectIds >= 0)
+        points = self.origin + self.directions[hit] * self.distances[hit, None]
+        for center, radius in zip(*lightVolumes(self.worldInfos[1])):
+            # the shadow rays go to points of the light at most radius from its center
+            ends = np.broadcast_to(center, points.shape)
+            shadowed[hit] |= segmentsHitBox(points, ends, bounds[0] - radius, bounds[1] + radius)
+        return shadowed
+
+    def _refreshCaches(self, geometry: bool):
+        """Caches of the parameters that the edit made wrong: the shadow cache if the geometry changed,
+        the irradiance cache after any edit
+        """
+        shadowCache = self.parameters.get("shadowCache")
+        if isinstance(shadowCache, VisibilityCache):
+            shadowCache.commit()
+            if geometry:
+                shadowCache.validate(self.objects)
+        irradianceCache = self.parameters.get("irradianceCache")
+        if isinstance(irradianceCache, IrradianceCache) and self.image is not None:
+            self.parameters = dict(self.parameters, irradianceCache=IrradianceCache(
+                irradianceCache.error, irradianceCache.minRadius, irradianceCache.maxRadius))
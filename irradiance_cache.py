@@ -0,0 +1,176 @@
+import os
+import numpy as np
+
+from bvh_class import segmentPositions
+
+
+def _cellKeys(cells):
+    """Integer cell coordinates (N, 3) -> one int64 key per cell"""
+    cells = np.clip(cells + (1 << 20), 0, (1 << 21) - 1)
+    return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+
+# Irradiance cache
+class IrradianceCache:
+
+    def __init__(self, error: float = 0.3, minRadius: float = 0.02, maxRadius: float = 0.5):
+        """Indirect lighting computed at some points (records), interpolated at the points around them (Ward et al. 1988)
+        error: maximum error allowed, a record is used at a point if distance / radius + sqrt(1 - normal . recordNormal) < error
+        minRadius, maxRadius: bounds of the radius of the records (harmonic mean distance of the objects around them)
+
+        The records are stored in a linear octree: each record is put in the cells of the level whose cells are
+        just bigger than its area of use, so a lookup only reads the cell of the point at each level.
+        """
+        self.error = error
+        self.minRadius = minRadius
+        self.maxRadius = maxRadius
+
+        self.positions = np.zeros((0, 3))
+        self.normals = np.zeros((0, 3))
+        self.irradiance = np.zeros((0, 3))
+        self.radii = np.zeros(0)
+        # number of indirect bounces of the records, the cache is only used for this number
+        self.bounces = None
+
+        self.lookups = 0
+        self.hits = 0
+        self._levels = {}
+        # records in the octree, the others are added by the next lookup
+        self._indexedCount = 0
+
+    def __len__(self):
+        return len(self.radii)
+
+    def usable(self, bounces: int):
+        """True if the records can be used for indirect lighting with this number of bounces (the first one used)"""
+        if self.bounces is None:
+            self.bounces = bounces
+        return self.bounces == bounces
+
+    # Octree ==============================================================================================
+    def _cellSize(self, level):
+        return 2 * self.error * self.maxRadius / 2 ** level
+
+    def _indexRecords(self):
+        """Adds the records inserted since the last lookup to the octree"""
+        first = self._indexedCount
+        radii, positions = self.radii[first:], self.positions[first:]
+        # area of use of each record: sphere of radius error * radius, level with cells at least twice as big
+        influence = self.error * radii
+        levels = np.floor(np.log2(np.maximum(self.maxRadius / radii, 1))).astype(np.int64)
+        cellSizes = self._cellSize(levels)[:, None]
+        low = np.floor((positions - influence[:, None]) / cellSizes).astype(np.int64)
+        high = np.floor((positions + influence[:, None]) / cellSizes).astype(np.int64)
+
+        # the sphere overlaps at most 2 cells on each axis: 8 corners, duplicates removed
+        records, keys = [], []
+        for corner in range(8):
+            cells = np.where([(corner >> axis) & 1 for axis in range(3)], high, low)
+            records.append(np.arange(first, len(self)))
+            keys.append(_cellKeys(cells))
+        records, keys = np.concatenate(records), np.concatenate(keys)
+        recordLevels = levels[records - first]
+
+        for level in np.unique(recordLevels):
+            inLevel = recordLevels == level
+            pairs = np.unique(np.stack((keys[inLevel], records[inLevel]), axis=1), axis=0)
+            levelKeys, levelRecords = self._levels.get(int(level), (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)))
+            # merged after the records of the same cells, which are older: sorted by cell then record
+            at = np.searchsorted(levelKeys, pairs[:, 0], "right")
+            self._levels[int(level)] = (np.insert(levelKeys, at, pairs[:, 0]), np.insert(levelRecords, at, pairs[:, 1]))
+        self._indexedCount = len(self)
+
+    # Records =============================================================================================
+    def insert(self, positions, normals, irradiance, distances):
+        """Adds records: positions, normals (normalized, on the side of the surface where the light was gathered),
+        irradiance (N, 3) and harmonic mean distance of the objects seen from each position (N,)
+        The next lookup adds them to the octree: only the new records are indexed, so small inserts stay cheap.
+        """
+        self.positions = np.concatenate((self.positions, positions))
+        self.normals = np.concatenate((self.normals, normals))
+        self.irradiance = np.concatenate((self.irradiance, irradiance))
+        self.radii = np.concatenate((self.radii, np.clip(distances, self.minRadius, self.maxRadius)))
+
+    def lookup(self, positions, normals):
+        """Interpolates the records around each point (N, 3), weighted by 1 / (distance / radius + sqrt(1 - n . n'))
+        Records in front of the point (that could hide it) are not used.
+        Returns the irradiance (N, 3) and found (N,): False where no record is close enough
+        """
+        if self._indexedCount < len(self):
+            self._indexRecords()
+        count = len(positions)
+        self.lookups += count
+        pointList, recordList = [], []
+        for level, (keys, records) in self._levels.items():
+            pointKeys = _cellKeys(np.floor(positions / self._cellSize(level)).astype(np.int64))
+            starts = np.searchsorted(keys, pointKeys, "left")
+            counts = np.searchsorted(keys, pointKeys, "right") - starts
+            candidates, points, _offsets = segmentPositions(starts, counts)
+            pointList.append(points)
+            recordList.append(records[candidates])
+
+        irradiance = np.zeros((count, 3))
+        if not pointList:
+            return irradiance, np.zeros(count, dtype=bool)
+        points, records = np.concatenate(pointList), np.concatenate(recordList)
+
+        offsets = positions[points] - self.positions[records]
+        pointNormals = normals[points]
+        normalError = np.sqrt(np.maximum(1 - np.einsum("ij,ij->i", pointNormals, self.normals[records]), 0))
+        errors = np.linalg.norm(offsets, axis=1) / self.radii[records] + normalError
+        inFront = np.einsum("ij,ij->i", offsets, pointNormals + self.normals[records]) / 2 < -0.05 * self.radii[records]
+        used = (errors < self.error) & ~inFront
+
+        points, records = points[used], records[used]
+        weights = 1 / np.maximum(errors[used], 1e-6)
+        weightSums = np.bincount(points, weights, minlength=count)
+        found = weightSums > 0
+        for channel in range(3):
+            irradiance[:, channel] = np.bincount(points, weights * self.irradiance[records, channel], minlength=count)
+        irradiance[found] /= weightSums[found, None]
+
+        self.hits += int(found.sum())
+        return irradiance, found
+
+    def stats(self):
+        return {"records": len(self), "lookups": self.lookups, "hits": self.hits,
+                "hitRate": self.hits / self.lookups if self.lookups else 0.0}
+
+    # Save / load =========================================================================================
+    def save(self, path: str):
+        """Saves the records (.npz), to reuse them for another frame of the same static scene"""
+        np.savez(path, positions=self.positions, normals=self.normals, irradiance=self.irradiance, radii=self.radii,
+                 bounces=np.array(-1 if self.bounces is None else self.bounces),
+                 settings=np.array((self.error, self.minRadius, self.maxRadius)))
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        cache = cls(*data["settings"].tolist())
+        cache.positions, cache.normals = data["positions"], data["normals"]
+        cache.irradiance, cache.radii = data["irradiance"], data["radii"]
+        cache.bounces = None if int(data["bounces"]) < 0 else int(data["bounces"])
+        return cache
+
+
+def prepareCache(parameters: dict):
+    """Render parameters with an IrradianceCache instead of "irradianceCache": true
+    irradianceCacheError: error of the cache (default 0.3)
+    irradianceCachePath: the records are loaded from this file if it exists (see saveCache)
+    """
+    if parameters.get("irradianceCache") is not True:
+        return parameters
+
+    path = parameters.get("irradianceCachePath")
+    if path and os.path.exists(path):
+        cache = IrradianceCache.load(path)
+    else:
+        cache = IrradianceCache(parameters.get("irradianceCacheError", 0.3))
+    return dict(parameters, irradianceCache=cache)
+
+
+def saveCache(parameters: dict):
+    """Saves the cache of parameters prepared by prepareCache to irradianceCachePath (if given)"""
+    cache = parameters.get("irradianceCache")
+    if isinstance(cache, IrradianceCache) and parameters.get("irradianceCachePath"):
+        cache.save(parameters["irradianceCachePath"])
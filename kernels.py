@@ -0,0 +1,257 @@
+import os
+import numpy as np
+
+
+# Maximum number of (ray, primitive) pairs tested together by the NumPy backend (bounds the memory used)
+pairsPerPacket = 1 << 17
+
+
+# Array kernels =========================================================================================================================
+# rayOrigins (N, 3) or (3,), rayDirections (N, 3), rows (K, rowSize) of packed_scene.packRow: distances (N, K) with np.inf where the ray misses
+
+def _toRows(vectors, rayDirections, rows):
+    """vectors (N, 3) or (3,) minus the first 3 values of the rows, as an array (N, K, 3)"""
+    return np.broadcast_to(vectors[..., None, :] - rows[:, :3], (len(rayDirections), len(rows), 3))
+
+
+def sphereDistances(rayOrigins, rayDirections, rows):
+    originToCenters = _toRows(rayOrigins, rayDirections, rows)
+    b = np.einsum("nj,nkj->nk", rayDirections, originToCenters) * 2
+    c = np.einsum("nkj,nkj->nk", originToCenters, originToCenters) - rows[:, 3]
+    delta = b ** 2 - 4 * c
+
+    hit = delta > 0
+    root = np.sqrt(np.where(hit, delta, 0))
+    t1 = (-b + root) / 2
+    t2 = (-b - root) / 2
+    hit &= (t1 > 0) & (t2 > 0)
+    return np.where(hit, np.minimum(t1, t2), np.inf)
+
+
+def planeDistances(rayOrigins, rayDirections, rows):
+    dotDir = rayDirections @ rows[:, :3].T
+    dot = np.broadcast_to(np.atleast_2d(rayOrigins) @ rows[:, :3].T, dotDir.shape)
+
+    hit = dotDir != 0
+    dist = np.full(dotDir.shape, np.inf)
+    dist[hit] = (dot[hit] + np.broadcast_to(rows[:, 3], dotDir.shape)[hit]) / dotDir[hit]
+    hit &= dist < 0
+    return np.where(hit, -dist, np.inf)
+
+
+def triangleDistances(rayOrigins, rayDirections, rows):
+    """Moller-Trumbore, double sided, rays almost parallel to the triangle miss it (as Triangle.intersect)"""
+    edges1, edges2 = rows[:, 3:6], rows[:, 6:9]
+    pVectors = np.cross(rayDirections[:, None, :], edges2)
+    determinants = np.einsum("kj,nkj->nk", edges1, pVectors)
+    hit = np.abs(determinants) >= 1e-8
+    inverse = 1 / np.where(hit, determinants, 1)
+
+    tVectors = _toRows(rayOrigins, rayDirections, rows)
+    u = np.einsum("nkj,nkj->nk", tVectors, pVectors) * inverse
+    qVectors = np.cross(tVectors, edges1)
+    v = np.einsum("nj,nkj->nk", rayDirections, qVectors) * inverse
+    t = np.einsum("kj,nkj->nk", edges2, qVectors) * inverse
+    hit &= (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
+
+
+kernels = {"sphere": sphereDistances, "plane": planeDistances, "triangle": triangleDistances}
+
+
+# NumPy backend =========================================================================================================================
+
+def _packets(rows, rayCount):
+    raysPerPacket = max(pairsPerPacket // max(len(rows), 1), 1)
+    for start in range(0, rayCount, raysPerPacket):
+        yield slice(start, start + raysPerPacket)
+
+
+class NumpyBackend:
+    """Kernels of the packed primitives on whole arrays: each packet of rays is tested against all the rows together"""
+
+    name = "numpy"
+
+    @staticmethod
+    def nearestHits(kind: str, rayOrigins, rayDirections, rows):
+        """Nearest primitive of the rows (kind of packed_scene.packRow) hit by each ray
+        Returns positions (N,) in the rows (-1 without hit) and distances (N,) (> 0, np.inf without hit)
+        """
+        count = len(rayDirections)
+        positions, distances = np.full(count, -1), np.full(count, np.inf)
+        for rays in _packets(rows, count):
+            origins = rayOrigins if np.ndim(rayOrigins) == 1 else rayOrigins[rays]
+            packetDistances = kernels[kind](origins, rayDirections[rays], rows)
+            packetDistances = np.where(packetDistances > 0, packetDistances, np.inf)
+            nearest = np.argmin(packetDistances, axis=1)
+            distances[rays] = packetDistances[np.arange(len(nearest)), nearest]
+            positions[rays] = np.where(distances[rays] < np.inf, nearest, -1)
+        return positions, distances
+
+    @staticmethod
+    def anyHits(kind: str, rayOrigins, rayDirections, rows, maxDistances):
+        """True for the rays (N,) that hit one of the primitives of the rows between 0 and maxDistances (N,)"""
+        count = len(rayDirections)
+        isOccluded = np.zeros(count, dtype=bool)
+        for rays in _packets(rows, count):
+            origins = rayOrigins if np.ndim(rayOrigins) == 1 else rayOrigins[rays]
+            distances = kernels[kind](origins, rayDirections[rays], rows)
+            isOccluded[rays] = ((distances > 0) & (distances < maxDistances[rays, None])).any(axis=1)
+        return isOccluded
+
+    @staticmethod
+    def accumulateLighting(diffuse, visible, highlights, highlightWeights, colors, weights, toLight, normals, lit,
+                           toCamera, shininess, sampleCount):
+        """Adds packetSamples light samples of each of the N points to the results of shaders_class.directLightingArray
+        (diffuse, visible, highlights, highlightWeights, changed in place)
+        colors (S*N, 3), weights (S*N,), toLight (S*N, 3), lit (S*N,): samples, sample s of point n at s * N + n
+        normals, toCamera (N, 3), shininess None without highlights, sampleCount: number of samples of the whole render
+        """
+        count = len(normals)
+        packetSamples = len(weights) // count
+        contributions = colors * (weights * np.einsum("ij,ij->i", toLight, np.tile(normals, (packetSamples, 1))) * lit)[:, None]
+        diffuse += contributions.reshape((packetSamples, count, 3)).sum(axis=0)
+        visible |= lit.reshape((packetSamples, count)).any(axis=0)
+        if shininess is not None:
+            halfVectors = toLight + np.tile(toCamera, (packetSamples, 1))
+            halfVectors /= np.linalg.norm(halfVectors, axis=-1)[:, None]
+            factors = np.einsum("ij,ij->i", np.tile(normals, (packetSamples, 1)), halfVectors) ** (shininess / 4)
+            highlights += (contributions * factors[:, None]).reshape((packetSamples, count, 3)).sum(axis=0)
+            highlightWeights += factors.reshape((packetSamples, count)).sum(axis=0) / sampleCount
+
+    @staticmethod
+    def directLighting(diffuse, visible, highlights, highlightWeights, shiftedPoints, intersections, normals, positions, colors,
+                       weights, toCamera, shininess, sampleCount, rows):
+        """Shadow rays of the light samples against the packed rows (kind -> rows) then accumulateLighting, for the
+        scenes whose objects are all packed
+        shiftedPoints (N, 3): origins of the shadow rays (the intersections moved off their surface)
+        positions, colors (S*N, 3), weights (S*N,): light samples, sample s of point n at s * N + n
+        """
+        count = len(normals)
+        points = np.tile(np.arange(count), len(weights) // count)
+        toLight = positions - shiftedPoints[points]
+        toLight = toLight / np.linalg.norm(toLight, axis=-1)[..., None]
+        distances = np.linalg.norm(positions - intersections[points], axis=1)
+        isShadowed = np.zeros(len(weights), dtype=bool)
+        for kind, kindRows in rows.items():
+            if len(kindRows):
+                isShadowed |= NumpyBackend.anyHits(kind, shiftedPoints[points], toLight, kindRows, distances)
+        NumpyBackend.accumulateLighting(diffuse, visible, highlights, highlightWeights, colors, weights, toLight, normals,
+                                        ~isShadowed, toCamera, shininess, sampleCount)
+
+
+# Backend selection =====================================================================================================================
+
+# Backend used by the packed scenes and the shaders, chosen by the first call of backend()
+_backend = None
+# numba_kernels.NumbaBackend, False if Numba isn't installed, None before the first try
+_numbaBackend = None
+
+
+def _loadNumba():
+    global _numbaBackend
+    if _numbaBackend is None:
+        try:
+            from numba_kernels import NumbaBackend
+            NumbaBackend.useForkSafeThreads()
+            _numbaBackend = NumbaBackend
+        except ImportError:
+            _numbaBackend = False
+    return _numbaBackend or None
+
+
+def availableBackends():
+    """Names of the backends that can be used here"""
+    return ["numpy"] + (["numba"] if _loadNumba() else [])
+
+
+def setBackend(name: str = "auto"):
+    """Selects the kernels of the render:
+        "numba": compiled with Numba (numba_kernels), NumPy if Numba isn't installed
+        "numpy": NumPy arrays
+        "auto": Numba if it is installed, else NumPy
+    Loading Numba also selects its fork-safe threading layer for the whole process (see numba_kernels.NumbaBackend.useForkSafeThreads),
+    so that the parallel renderer can fork after the kernels ran. Other code using Numba in the process gets this layer too.
+    Returns the name of the previous backend (None if none was selected)
+    """
+    global _backend
+    if name not in ("auto", "numba", "numpy"):
+        raise ValueError("Unknown backend: %s" % name)
+    previous = _backend.name if _backend else None
+    numbaBackend = _loadNumba() if name != "numpy" else None
+    if name == "numba" and numbaBackend is None:
+        print("Numba is not installed, the NumPy backend is used")
+    _backend = numbaBackend or NumpyBackend
+    return previous
+
+
+def backend():
+    """Current backend (NumpyBackend or numba_kernels.NumbaBackend), by default the one of the RAYTRACER_BACKEND
+    environment variable or "auto" (see setBackend)
+    """
+    if _backend is None:
+        setBackend(os.environ.get("RAYTRACER_BACKEND", "auto"))
+    return _backend
+
+
+# Parity ================================================================================================================================
+
+def _difference(a, b):
+    """Largest difference of two arrays, infinite if they don't have their NaNs at the same places"""
+    if (np.isnan(a) != np.isnan(b)).any():
+        return np.inf
+    return float(np.nanmax(np.abs(a - b), initial=0))
+
+
+def compareBackends(rows: dict, rayOrigins, rayDirections, maxDistances, seed: int = 0):
+    """Runs every kernel of every available backend on the same rays and packed rows (kind -> rows),
+    and on random light samples for accumulateLighting and directLighting (shadowed by the same rows).
+    Returns {backend name: {kernel: largest difference with the NumPy backend}}, positions count as a difference
+    of 1 where the hit distances differ too (a different primitive at the same distance isn't an error)
+    """
+    rng = np.random.default_rng(seed)
+    count = len(rayDirections)
+    normals = rng.normal(size=(count, 3))
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    colors, weights, lit = rng.random((4 * count, 3)), rng.random(4 * count), rng.random(4 * count) > 0.3
+    toLight = rng.normal(size=(4 * count, 3))
+    toLight /= np.linalg.norm(toLight, axis=1)[:, None]
+    toCamera = -rayDirections
+    # points along the rays, lit by light samples 1 to 5 away from them
+    points = np.broadcast_to(rayOrigins, rayDirections.shape) + rayDirections * rng.random((count, 1))
+    lightPositions = np.tile(points, (4, 1)) + toLight * rng.uniform(1, 5, (4 * count, 1))
+
+    def run(kernelBackend):
+        results = {}
+        for kind, kindRows in rows.items():
+            if len(kindRows):
+                results[kind + " nearest"] = kernelBackend.nearestHits(kind, rayOrigins, rayDirections, kindRows)
+                results[kind + " any"] = kernelBackend.anyHits(kind, rayOrigins, rayDirections, kindRows, maxDistances)
+        lighting = (np.zeros((count, 3)), np.zeros(count, dtype=bool), np.zeros((count, 3)), np.zeros(count))
+        kernelBackend.accumulateLighting(*lighting, colors, weights, toLight, normals, lit, toCamera, 20.0, 4)
+        results["lighting"] = lighting
+        shadowed = (np.zeros((count, 3)), np.zeros(count, dtype=bool), np.zeros((count, 3)), np.zeros(count))
+        kernelBackend.directLighting(*shadowed, points, points, normals, lightPositions, colors, weights, toCamera, 20.0, 4, rows)
+        results["direct lighting"] = shadowed
+        return results
+
+    reference = run(NumpyBackend)
+    report = {}
+    for name in availableBackends():
+        results = run(NumpyBackend if name == "numpy" else _loadNumba())
+        differences = {}
+        for kernel, expected in reference.items():
+            if kernel.endswith("nearest"):
+                (positions, distances), (expectedPositions, expectedDistances) = results[kernel], expected
+                finite = np.isfinite(distances) & np.isfinite(expectedDistances)
+                distanceErrors = np.abs(distances[finite] - expectedDistances[finite])
+                missed = np.isfinite(distances) != np.isfinite(expectedDistances)
+                other = (positions != expectedPositions) & ~np.isclose(distances, expectedDistances, rtol=1e-9, atol=1e-12)
+                differences[kernel] = max(float(distanceErrors.max(initial=0)), float((missed | other).any()))
+            elif kernel.endswith("any"):
+                differences[kernel] = float((results[kernel] != expected).any())
+            else:
+                differences[kernel] = max(_difference(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+                                          for a, b in zip(results[kernel], expected))
+        report[name] = differences
+    return report
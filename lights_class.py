@@ -0,0 +1,162 @@
+import math
+import numpy as np
+
+from Vector import Vector
+
+
+def _luminance(color: Vector):
+    return 0.2126 * color.x + 0.7152 * color.y + 0.0722 * color.z
+
+
+# Point light
+class PointLight:
+
+    def __init__(self, position: Vector, diffuse: Vector, ambient: Vector = None, specular: Vector = None):
+        """position: position of the light
+        diffuse: color of the light (no attenuation with the distance)
+        ambient: color added to the ambient of every object (default black)
+        specular: color of the highlights (default white)
+        """
+        self.position = position
+        self.diffuse = diffuse
+        self.ambient = Vector(0, 0, 0) if ambient is None else ambient
+        self.specular = Vector(1, 1, 1) if specular is None else specular
+
+    def power(self):
+        """Light sent in all directions, relative to a point light of the same color"""
+        return _luminance(self.diffuse)
+
+
+# Spot light
+class SpotLight:
+
+    def __init__(self, position: Vector, direction: Vector, angle: float, diffuse: Vector, ambient: Vector = None,
+                 specular: Vector = None, softness: float = 0.1):
+        """Point light that only lights a cone
+        direction: axis of the cone
+        angle: angle between the axis and the edge of the cone (degrees)
+        softness: fraction of the angle where the light fades out at the edge of the cone
+        """
+        self.position = position
+        self.direction = direction.normalize()
+        self.angle = angle
+        self.diffuse = diffuse
+        self.ambient = Vector(0, 0, 0) if ambient is None else ambient
+        self.specular = Vector(1, 1, 1) if specular is None else specular
+        self.softness = softness
+
+    def power(self):
+        return _luminance(self.diffuse) * (1 - math.cos(math.radians(self.angle))) / 2
+
+
+# Area light
+class AreaLight:
+
+    def __init__(self, corner: Vector, edge1: Vector, edge2: Vector, diffuse: Vector, ambient: Vector = None, specular: Vector = None):
+        """Rectangle corner, corner + edge1, corner + edge1 + edge2, corner + edge2 that lights like point lights
+        spread over its surface (soft shadows). Each light sample is a random point of the rectangle.
+        diffuse: color of the whole light, the same as a point light at its center without shadows
+        """
+        self.corner = corner
+        self.edge1 = edge1
+        self.edge2 = edge2
+        self.diffuse = diffuse
+        self.ambient = Vector(0, 0, 0) if ambient is None else ambient
+        self.specular = Vector(1, 1, 1) if specular is None else specular
+
+    def power(self):
+        return _luminance(self.diffuse)
+
+
+# Lights of a scene
+class Lights(list):
+
+    # kinds of lights in the arrays
+    POINT, SPOT, AREA = 0, 1, 2
+
+    def __init__(self, lights):
+        """lights: PointLight, SpotLight and AreaLight objects, can be used as the light of worldInfos
+        Their parameters are copied in arrays so that the samples of many lights are computed together.
+        Call update() after changing the list or a light.
+        """
+        super().__init__(lights)
+        self.update()
+
+    def update(self):
+        count = len(self)
+        zeros = np.zeros((count, 3))
+        self.kinds = np.array([self.SPOT if isinstance(light, SpotLight) else self.AREA if isinstance(light, AreaLight) else self.POINT
+                               for light in self], dtype=int)
+        self.positions = np.array([(light.corner if isinstance(light, AreaLight) else light.position).toArray() for light in self]).reshape((-1, 3))
+        self.colors = np.array([light.diffuse.toArray() for light in self]).reshape((-1, 3))
+        self.edge1, self.edge2, self.directions = zeros.copy(), zeros.copy(), zeros.copy()
+        self.cosOuter, self.cosInner = np.full(count, -1.0), np.full(count, -1.0)
+        for i, light in enumerate(self):
+            if isinstance(light, AreaLight):
+                self.edge1[i], self.edge2[i] = light.edge1.toArray(), light.edge2.toArray()
+            elif isinstance(light, SpotLight):
+                self.directions[i] = light.direction.toArray()
+                self.cosOuter[i] = math.cos(math.radians(light.angle))
+                self.cosInner[i] = math.cos(math.radians(light.angle * (1 - light.softness)))
+
+        self.ambient = sum((light.ambient for light in self), Vector(0, 0, 0))
+        powers = np.array([max(light.power(), 0) for light in self], dtype=float)
+        if count and powers.sum() <= 0:
+            powers[:] = 1
+        self.probabilities = powers / powers.sum() if count else powers
+        self.cumulative = np.cumsum(self.probabilities)
+        # area lights need random points
+        self.isRandom = bool((self.kinds == self.AREA).any())
+
+    def fixedPosition(self, indices):
+        """True for the lights whose samples all come from the same point (not area lights)"""
+        return self.kinds[indices] != self.AREA
+
+    def choose(self, u):
+        """Lights chosen with a probability proportional to their power for uniform numbers u in [0, 1)
+        Returns the indices of the lights and their probabilities
+        """
+        indices = np.minimum(np.searchsorted(self.cumulative, u * self.cumulative[-1], "right"), len(self) - 1)
+        return indices, self.probabilities[indices]
+
+    def sample(self, indices, points, u1=None, u2=None):
+        """Samples of the lights (indices) lighting the points (N, 3), u1, u2: uniform numbers for the area lights
+        Returns the positions of the samples (N, 3) and the colors they send to the points (N, 3)
+        """
+        positions = self.positions[indices].copy()
+        colors = self.colors[indices].copy()
+
+        area = self.kinds[indices] == self.AREA
+        if area.any():
+            positions[area] += u1[area, None] * self.edge1[indices[area]] + u2[area, None] * self.edge2[indices[area]]
+
+        spot = np.flatnonzero(self.kinds[indices] == self.SPOT)
+        if len(spot):
+            lightToPoints = points[spot] - positions[spot]
+            cosAngles = np.einsum("ij,ij->i", lightToPoints, self.directions[indices[spot]]) / np.linalg.norm(lightToPoints, axis=1)
+            outer, inner = self.cosOuter[indices[spot]], self.cosInner[indices[spot]]
+            fade = np.clip((cosAngles - outer) / np.maximum(inner - outer, 1e-9), 0, 1)
+            colors[spot] *= (fade * fade * (3 - 2 * fade))[:, None]
+
+        return positions, colors
+
+
+# Last dict light converted by asLights: (id and values of the dict, Lights)
+_convertedDict = (None, None)
+
+
+def asLights(light):
+    """Lights of the light of worldInfos: a Lights list, or the dict(position, ambient, diffuse, specular)
+    of a single point light (older scenes)
+    """
+    global _convertedDict
+    if isinstance(light, Lights):
+        return light
+    if isinstance(light, dict):
+        # the scalar shaders call it for every pixel: the dict is only converted again if it changed
+        key = (id(light),) + tuple((name, value.x, value.y, value.z) for name, value in sorted(light.items()))
+        if _convertedDict[0] != key:
+            pointLight = PointLight(light["position"], light["diffuse"], light.get("ambient", Vector(0, 0, 0)), light.get("specular", Vector(1, 1, 1)))
+            _convertedDict = (key, Lights([pointLight]))
+        return _convertedDict[1]
+    return Lights(light)
@@ -0,0 +1,229 @@
+import os
+import math
+import numpy as np
+from numba import config, njit, prange
+
+
+# Compiled kernels ======================================================================================================================
+# One ray per iteration of the prange loops (threads), the primitives of the rows tested one by one.
+# origins (N, 3) (broadcast for rays from the same origin), directions (N, 3), rows (K, rowSize) of packed_scene.packRow.
+# cache=True: the machine code is saved next to this file (__pycache__), only compiled again when the file changes.
+
+@njit(cache=True)
+def _sphereDistance(ox, oy, oz, dx, dy, dz, rows, k):
+    x, y, z = ox - rows[k, 0], oy - rows[k, 1], oz - rows[k, 2]
+    b = (dx * x + dy * y + dz * z) * 2
+    delta = b * b - 4 * ((x * x + y * y + z * z) - rows[k, 3])
+    if delta > 0:
+        root = math.sqrt(delta)
+        t1, t2 = (-b + root) / 2, (-b - root) / 2
+        if t1 > 0 and t2 > 0:
+            return min(t1, t2)
+    return np.inf
+
+
+@njit(cache=True)
+def _planeDistance(ox, oy, oz, dx, dy, dz, rows, k):
+    dotDir = dx * rows[k, 0] + dy * rows[k, 1] + dz * rows[k, 2]
+    if dotDir != 0:
+        dist = ((ox * rows[k, 0] + oy * rows[k, 1] + oz * rows[k, 2]) + rows[k, 3]) / dotDir
+        if dist < 0:
+            return -dist
+    return np.inf
+
+
+@njit(cache=True)
+def _triangleDistance(ox, oy, oz, dx, dy, dz, rows, k):
+    ax, ay, az, bx, by, bz = rows[k, 3], rows[k, 4], rows[k, 5], rows[k, 6], rows[k, 7], rows[k, 8]
+    px, py, pz = dy * bz - dz * by, dz * bx - dx * bz, dx * by - dy * bx
+    determinant = ax * px + ay * py + az * pz
+    if abs(determinant) < 1e-8:
+        return np.inf
+    inverse = 1 / determinant
+    tx, ty, tz = ox - rows[k, 0], oy - rows[k, 1], oz - rows[k, 2]
+    u = (tx * px + ty * py + tz * pz) * inverse
+    if u < 0:
+        return np.inf
+    qx, qy, qz = ty * az - tz * ay, tz * ax - tx * az, tx * ay - ty * ax
+    v = (dx * qx + dy * qy + dz * qz) * inverse
+    if v < 0 or u + v > 1:
+        return np.inf
+    t = (bx * qx + by * qy + bz * qz) * inverse
+    return t if t >= 0 else np.inf
+
+
+@njit(cache=True, inline="always")
+def _distance(kind, ox, oy, oz, dx, dy, dz, rows, k):
+    # kind: index in _kinds, a constant of the kernels: the branches are resolved when they are compiled
+    if kind == 0:
+        return _sphereDistance(ox, oy, oz, dx, dy, dz, rows, k)
+    if kind == 1:
+        return _planeDistance(ox, oy, oz, dx, dy, dz, rows, k)
+    return _triangleDistance(ox, oy, oz, dx, dy, dz, rows, k)
+
+
+# The kernels of each kind are made by these functions, kind is a variable of their closure (an integer, so that
+# Numba can still save them on the disk, which it can't do with a function)
+
+def _nearestKernel(kind):
+    @njit(parallel=True, cache=True)
+    def nearestHits(origins, directions, rows):
+        count = directions.shape[0]
+        positions, distances = np.full(count, -1), np.full(count, np.inf)
+        for n in prange(count):
+            for k in range(rows.shape[0]):
+                t = _distance(kind, origins[n, 0], origins[n, 1], origins[n, 2], directions[n, 0], directions[n, 1], directions[n, 2], rows, k)
+                # the first primitive wins at the same distance (as np.argmin)
+                if 0 < t < distances[n]:
+                    positions[n], distances[n] = k, t
+        return positions, distances
+    return nearestHits
+
+
+def _anyKernel(kind):
+    @njit(parallel=True, cache=True)
+    def anyHits(origins, directions, rows, maxDistances):
+        count = directions.shape[0]
+        isOccluded = np.zeros(count, dtype=np.bool_)
+        for n in prange(count):
+            for k in range(rows.shape[0]):
+                t = _distance(kind, origins[n, 0], origins[n, 1], origins[n, 2], directions[n, 0], directions[n, 1], directions[n, 2], rows, k)
+                if 0 < t < maxDistances[n]:
+                    isOccluded[n] = True
+                    break
+        return isOccluded
+    return anyHits
+
+
+_kinds = {"sphere": 0, "plane": 1, "triangle": 2}
+_nearestKernels = {name: _nearestKernel(kind) for name, kind in _kinds.items()}
+_anyKernels = {name: _anyKernel(kind) for name, kind in _kinds.items()}
+# kinds and row sizes of the rows given to _directLighting (packed_scene.rowSizes)
+_rowSizes = (("sphere", 4), ("plane", 4), ("triangle", 12))
+
+
+@njit(cache=True)
+def _addSample(diffuse, visible, highlights, highlightWeights, n, i, colors, weights, lx, ly, lz, normals, lit,
+               toCamera, shininess, sampleCount):
+    # light sample i of the point n, coming from the direction (lx, ly, lz)
+    cosine = lx * normals[n, 0] + ly * normals[n, 1] + lz * normals[n, 2]
+    weight = weights[i] * cosine * lit
+    r, g, b = colors[i, 0] * weight, colors[i, 1] * weight, colors[i, 2] * weight
+    diffuse[n, 0] += r
+    diffuse[n, 1] += g
+    diffuse[n, 2] += b
+    if lit:
+        visible[n] = True
+    if shininess >= 0:
+        hx, hy, hz = lx + toCamera[n, 0], ly + toCamera[n, 1], lz + toCamera[n, 2]
+        length = math.sqrt(hx * hx + hy * hy + hz * hz)
+        factor = ((normals[n, 0] * (hx / length) + normals[n, 1] * (hy / length)) + normals[n, 2] * (hz / length)) ** (shininess / 4)
+        highlights[n, 0] += r * factor
+        highlights[n, 1] += g * factor
+        highlights[n, 2] += b * factor
+        highlightWeights[n] += factor / sampleCount
+
+
+@njit(parallel=True, cache=True)
+def _accumulateLighting(diffuse, visible, highlights, highlightWeights, colors, weights, toLight, normals, lit,
+                        toCamera, shininess, sampleCount):
+    count = normals.shape[0]
+    packetSamples = weights.shape[0] // count
+    for n in prange(count):
+        for s in range(packetSamples):
+            i = s * count + n
+            _addSample(diffuse, visible, highlights, highlightWeights, n, i, colors, weights, toLight[i, 0], toLight[i, 1], toLight[i, 2],
+                       normals, lit[i], toCamera, shininess, sampleCount)
+
+
+@njit(parallel=True, cache=True)
+def _directLighting(diffuse, visible, highlights, highlightWeights, shiftedPoints, intersections, normals, positions, colors,
+                    weights, toCamera, shininess, sampleCount, spheres, planes, triangles):
+    count = normals.shape[0]
+    packetSamples = weights.shape[0] // count
+    for n in prange(count):
+        ox, oy, oz = shiftedPoints[n, 0], shiftedPoints[n, 1], shiftedPoints[n, 2]
+        for s in range(packetSamples):
+            i = s * count + n
+            # shadow ray from the shifted point to the light sample, as long as the distance from the intersection
+            lx, ly, lz = positions[i, 0] - ox, positions[i, 1] - oy, positions[i, 2] - oz
+            length = math.sqrt(lx * lx + ly * ly + lz * lz)
+            lx, ly, lz = lx / length, ly / length, lz / length
+            ex, ey, ez = positions[i, 0] - intersections[n, 0], positions[i, 1] - intersections[n, 1], positions[i, 2] - intersections[n, 2]
+            distance = math.sqrt(ex * ex + ey * ey + ez * ez)
+
+            lit = True
+            for k in range(spheres.shape[0]):
+                t = _sphereDistance(ox, oy, oz, lx, ly, lz, spheres, k)
+                if 0 < t < distance:
+                    lit = False
+                    break
+            if lit:
+                for k in range(planes.shape[0]):
+                    t = _planeDistance(ox, oy, oz, lx, ly, lz, planes, k)
+                    if 0 < t < distance:
+                        lit = False
+                        break
+            if lit:
+                for k in range(triangles.shape[0]):
+                    t = _triangleDistance(ox, oy, oz, lx, ly, lz, triangles, k)
+                    if 0 < t < distance:
+                        lit = False
+                        break
+            _addSample(diffuse, visible, highlights, highlightWeights, n, i, colors, weights, lx, ly, lz, normals, lit,
+                       toCamera, shininess, sampleCount)
+
+
+# Numba backend =========================================================================================================================
+
+def _rays(rayOrigins, rayDirections):
+    rayDirections = np.ascontiguousarray(rayDirections, dtype=float)
+    return np.broadcast_to(np.asarray(rayOrigins, dtype=float), rayDirections.shape), rayDirections
+
+
+class NumbaBackend:
+    """Same kernels as kernels.NumpyBackend, compiled by Numba and run on all the cores, without (N, K) arrays"""
+
+    name = "numba"
+
+    @staticmethod
+    def useForkSafeThreads():
+        """Runs the parallel kernels on the threads of the workqueue layer of Numba, for the whole process, unless
+        NUMBA_THREADING_LAYER chooses another one. The threads of the TBB layer (Numba's default when TBB is installed)
+        don't survive the fork of the parallel renderer: the process hangs on exit. The workqueue kernels must only be
+        called from one thread at a time (the renderers don't use threads).
+        Only has an effect before the first parallel kernel of the process.
+        """
+        if "NUMBA_THREADING_LAYER" not in os.environ:
+            config.THREADING_LAYER = "workqueue"
+
+    @staticmethod
+    def nearestHits(kind: str, rayOrigins, rayDirections, rows):
+        return _nearestKernels[kind](*_rays(rayOrigins, rayDirections), np.ascontiguousarray(rows))
+
+    @staticmethod
+    def anyHits(kind: str, rayOrigins, rayDirections, rows, maxDistances):
+        maxDistances = np.ascontiguousarray(np.broadcast_to(maxDistances, len(rayDirections)), dtype=float)
+        return _anyKernels[kind](*_rays(rayOrigins, rayDirections), np.ascontiguousarray(rows), maxDistances)
+
+    @staticmethod
+    def accumulateLighting(diffuse, visible, highlights, highlightWeights, colors, weights, toLight, normals, lit,
+                           toCamera, shininess, sampleCount):
+        if shininess is None:
+            shininess, toCamera = -1.0, normals
+        _accumulateLighting(diffuse, visible, highlights, highlightWeights, np.ascontiguousarray(colors, dtype=float),
+                            np.ascontiguousarray(weights, dtype=float), np.ascontiguousarray(toLight, dtype=float),
+                            np.ascontiguousarray(normals, dtype=float), np.ascontiguousarray(lit, dtype=np.bool_),
+                            np.ascontiguousarray(toCamera, dtype=float), float(shininess), sampleCount)
+
+    @staticmethod
+    def directLighting(diffuse, visible, highlights, highlightWeights, shiftedPoints, intersections, normals, positions, colors,
+                       weights, toCamera, shininess, sampleCount, rows):
+        if shininess is None:
+            shininess, toCamera = -1.0, normals
+        kindRows = [np.ascontiguousarray(rows.get(kind, np.zeros((0, size))), dtype=float) for kind, size in _rowSizes]
+        _directLighting(diffuse, visible, highlights, highlightWeights, np.ascontiguousarray(shiftedPoints, dtype=float),
+                        np.ascontiguousarray(intersections, dtype=float), np.ascontiguousarray(normals, dtype=float),
+                        np.ascontiguousarray(positions, dtype=float), np.ascontiguousarray(colors, dtype=float),
+                        np.ascontiguousarray(weights, dtype=float), np.ascontiguousarray(toCamera, dtype=float),
+                        float(shininess), sampleCount, *kindRows)
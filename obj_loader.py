@@ -0,0 +1,143 @@
+import os
+import time
+import shutil
+import hashlib
+import numpy as np
+
+from bvh_class import BVH
+
+
+# Parser ================================================================================================================================
+
+def _indices(values, count):
+    """OBJ indices (1 based, negative: relative to the end, 0: missing) -> 0 based indices, -1 if missing"""
+    return np.where(values > 0, values - 1, np.where(values < 0, count + values, -1))
+
+
+def _parseVectors(lines, size):
+    """'v x y z', 'vn x y z' or 'vt u v' lines -> array (N, size)"""
+    if not lines:
+        return np.zeros((0, size))
+    tokens = b" ".join(lines).split()
+    columns = len(lines[0].split())
+    if len(tokens) == columns * len(lines):
+        # every line has the same number of values (the usual case): converted all at once
+        return np.array(tokens).reshape((len(lines), columns))[:, 1:size + 1].astype(float)
+    return np.array([[float(value) for value in line.split()[1:size + 1]] for line in lines])
+
+
+def _parseCorners(lines, corners):
+    """'f ...' lines that all have this number of corners -> array (faces, corners, 3) of v, vt, vn indices (0: missing)"""
+    # without the "f" of each line
+    text = b" ".join(line.lstrip()[1:] for line in lines)
+    components = lines[0].split()[1].count(b"/") + 1
+    if text.count(b"/") == (components - 1) * corners * len(lines):
+        try:
+            values = np.array(text.replace(b"//", b"/0/").replace(b"/", b" ").split()).astype(np.int64)
+            values = values.reshape((len(lines), corners, components))
+            return np.concatenate((values, np.zeros((len(lines), corners, 3 - components), dtype=np.int64)), axis=2)
+        except ValueError:
+            pass
+
+    # mixed formats: one corner at a time
+    values = np.zeros((len(lines), corners, 3), dtype=np.int64)
+    for i, line in enumerate(lines):
+        for j, token in enumerate(line.split()[1:]):
+            for k, value in enumerate(token.split(b"/")):
+                values[i, j, k] = int(value) if value else 0
+    return values
+
+
+def parseOBJ(path: str, data: bytes = None):
+    """Reads an OBJ file, polygons are split in triangles
+    Returns dict of arrays:
+        vertices (V, 3), uvs (T, 2), normals (N, 3)
+        faces (F, 3): vertex indices of each triangle
+        faceUVs, faceNormals (F, 3): uv and normal indices of each triangle corner, -1 if the file has none
+    """
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+
+    vertexLines, uvLines, normalLines, faceLines = [], [], [], []
+    for line in data.split(b"\n"):
+        start = line[:3]
+        if start[:2] == b"v ":
+            vertexLines.append(line)
+        elif start == b"vt ":
+            uvLines.append(line)
+        elif start == b"vn ":
+            normalLines.append(line)
+        elif start[:2] == b"f ":
+            faceLines.append(line)
+
+    vertices = _parseVectors(vertexLines, 3)
+    uvs = _parseVectors(uvLines, 2)
+    normals = _parseVectors(normalLines, 3)
+
+    # faces grouped by number of corners, then split in triangles (fan)
+    faceGroups = {}
+    for line in faceLines:
+        faceGroups.setdefault(len(line.split()) - 1, []).append(line)
+
+    triangles = [np.zeros((0, 3, 3), dtype=np.int64)]
+    for corners, lines in faceGroups.items():
+        if corners < 3:
+            continue
+        values = _parseCorners(lines, corners)
+        fans = [values[:, [0, i, i + 1]] for i in range(1, corners - 1)]
+        triangles.append(np.stack(fans, axis=1).reshape((-1, 3, 3)))
+    triangles = np.concatenate(triangles)
+
+    return {
+        "vertices": vertices, "uvs": uvs, "normals": normals,
+        "faces": _indices(triangles[:, :, 0], len(vertices)).astype(np.int32),
+        "faceUVs": _indices(triangles[:, :, 1], len(uvs)).astype(np.int32),
+        "faceNormals": _indices(triangles[:, :, 2], len(normals)).astype(np.int32),
+    }
+
+
+# Cache =================================================================================================================================
+
+def triangleBounds(vertices, faces):
+    corners = vertices[faces]
+    return corners.min(axis=1), corners.max(axis=1)
+
+
+def loadOBJ(path: str, cacheDirectory: str = None):
+    """parseOBJ with a binary cache: the arrays (and the BVH of the triangles) are saved as .npy files
+    in cacheDirectory (default: .meshcache next to the OBJ file), under a key made of the content and
+    modification time of the file. Next loads memory-map them instead of parsing the file.
+    Returns the arrays of parseOBJ plus the arrays of the BVH (BVH.toArrays), and loadTime, cached
+    """
+    loadTime = time.time()
+    with open(path, "rb") as f:
+        data = f.read()
+    key = hashlib.sha1(data + str(os.stat(path).st_mtime_ns).encode()).hexdigest()
+
+    if cacheDirectory is None:
+        cacheDirectory = os.path.join(os.path.dirname(os.path.abspath(path)), ".meshcache")
+    directory = os.path.join(cacheDirectory, key)
+
+    if os.path.isdir(directory):
+        mesh = {name[:-4]: np.load(os.path.join(directory, name), mmap_mode="r")
+                for name in os.listdir(directory) if name.endswith(".npy")}
+        mesh["loadTime"], mesh["cached"] = time.time() - loadTime, True
+        return mesh
+
+    mesh = parseOBJ(path, data)
+    mesh.update(BVH(*triangleBounds(mesh["vertices"], mesh["faces"]), leafSize=4).toArrays())
+
+    # written in a temporary directory first, so that an interrupted save is never loaded
+    temporary = directory + ".%d.tmp" % os.getpid()
+    os.makedirs(temporary, exist_ok=True)
+    for name, array in mesh.items():
+        np.save(os.path.join(temporary, name + ".npy"), array)
+    try:
+        os.rename(temporary, directory)
+    except OSError:
+        # saved at the same time by another process
+        shutil.rmtree(temporary, ignore_errors=True)
+
+    mesh["loadTime"], mesh["cached"] = time.time() - loadTime, False
+    return mesh
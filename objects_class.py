@@ -2,9 +2,17 @@ import math
 import numpy as np
 
 from Vector import Vector
+from bvh_class import BVH
+from obj_loader import loadOBJ
 #from shader_class import Default
 
 
+def _normalizeRows(vectors):
+    # degenerate triangles have a null normal, it stays null instead of becoming nan
+    lengths = np.linalg.norm(vectors, axis=1)
+    return vectors / np.where(lengths > 0, lengths, 1)[:, None]
+
+
 # Class Sphere
 class Sphere:
 
@@ -14,8 +22,18 @@ class Sphere:
         self._shader = shader
 
     def intersect(self, rayOrigin, rayDirection):
-        b = rayDirection.dotProduct(rayOrigin - self.center) * 2
-        c = Vector.length(rayOrigin - self.center) ** 2 - self.radius ** 2
+        distance = self.intersectDistance(rayOrigin, rayDirection)
+        if distance is None:
+            return None, None
+
+        intersection = rayOrigin + rayDirection * distance
+        normal = Vector.normalize(intersection - self.center)
+        return distance, normal
+
+    def intersectDistance(self, rayOrigin, rayDirection):
+        originToCenter = rayOrigin - self.center
+        b = rayDirection.dotProduct(originToCenter) * 2
+        c = originToCenter.dotProduct(originToCenter) - self.radius ** 2
         delta = b ** 2 - 4 * c
 
         if delta > 0:
@@ -23,16 +41,64 @@ class Sphere:
             t2 = (-b - math.sqrt(delta)) / 2
 
             if t1 > 0 and t2 > 0:
-                intersection = rayOrigin + rayDirection * min(t1, t2)
-                normal = Vector.normalize(intersection - self.center)
-                return min(t1, t2), normal
+                return min(t1, t2)
+
+        return None
+
+    def occludes(self, rayOrigin, rayDirection, maxDistance):
+        distance = self.intersectDistance(rayOrigin, rayDirection)
+        return distance is not None and distance < maxDistance
+
+    def intersectArray(self, rayOrigins, rayDirections):
+        """rayOrigins: array (N, 3) or (3,)
+        rayDirections: array (N, 3)
+        Returns distances (N,) with np.inf where the ray misses, and normals (N, 3)
+        """
+        distances = self.intersectDistanceArray(rayOrigins, rayDirections)
+        hit = distances < np.inf
+
+        normals = np.zeros(rayDirections.shape)
+        if hit.any():
+            normal = np.broadcast_to(rayOrigins, rayDirections.shape)[hit] + rayDirections[hit] * distances[hit, None] - self.center.toArray()
+            normals[hit] = normal / np.linalg.norm(normal, axis=1)[:, None]
+
+        return distances, normals
+
+    def intersectDistanceArray(self, rayOrigins, rayDirections):
+        originToCenter = np.broadcast_to(rayOrigins - self.center.toArray(), rayDirections.shape)
+        b = np.einsum("ij,ij->i", rayDirections, originToCenter) * 2
+        c = np.einsum("ij,ij->i", originToCenter, originToCenter) - self.radius ** 2
+        delta = b ** 2 - 4 * c
+
+        hit = delta > 0
+        root = np.sqrt(np.where(hit, delta, 0))
+        t1 = (-b + root) / 2
+        t2 = (-b - root) / 2
+        hit &= (t1 > 0) & (t2 > 0)
+
+        return np.where(hit, np.minimum(t1, t2), np.inf)
+
+    def occludesArray(self, rayOrigins, rayDirections, maxDistances):
+        return self.intersectDistanceArray(rayOrigins, rayDirections) < maxDistances
+
+    def bounds(self):
+        center = self.center.toArray()
+        return center - self.radius, center + self.radius
 
-        return None, None
-        
     def shader(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
 
         return self._shader.calculate(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
 
+    def shaderArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+
+        return self._shader.calculateArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
+    def surface(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
+        return self._shader.surface(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
+
+    def surfaceArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        return self._shader.surfaceArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
 
 # Class Plane
 class Plane:
@@ -55,74 +121,186 @@ class Plane:
 
         else: return None, None
 
+    def intersectArray(self, rayOrigins, rayDirections):
+        normal = self.normal.toArray()
+        dotDir = rayDirections @ normal
+        dot = np.broadcast_to(rayOrigins @ normal, dotDir.shape)
+
+        hit = dotDir != 0
+        dist = np.full(dotDir.shape, np.inf)
+        dist[hit] = (dot[hit] + self.distance) / dotDir[hit]
+        hit &= dist < 0
+
+        return np.where(hit, -dist, np.inf), np.broadcast_to(normal, rayDirections.shape)
+
+    def occludes(self, rayOrigin, rayDirection, maxDistance):
+        distance, _normal = self.intersect(rayOrigin, rayDirection)
+        return distance is not None and 0 < distance < maxDistance
+
+    def occludesArray(self, rayOrigins, rayDirections, maxDistances):
+        distances, _normals = self.intersectArray(rayOrigins, rayDirections)
+        return (distances > 0) & (distances < maxDistances)
+
+    def bounds(self):
+        # infinite
+        return None
+
+    def coneOverlaps(self, origin, directions):
+        """True if a ray from origin with a direction between the directions (N, 3) can hit the plane
+        The rays that hit it are on one side of a plane of directions: if none of the edges of the cone does, none does.
+        """
+        return bool(np.isfinite(self.intersectArray(origin, directions)[0]).any())
+
     def shader(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
 
         return self._shader.calculate(rayDirection, intersection, self.normal, worldInfos, parameters, renderMode)
 
+    def shaderArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        normals = np.broadcast_to(self.normal.toArray(), rayDirections.shape)
+        return self._shader.calculateArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
+    def surface(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
+        return self._shader.surface(rayDirection, intersection, self.normal, worldInfos, parameters, renderMode)
+
+    def surfaceArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        normals = np.broadcast_to(self.normal.toArray(), rayDirections.shape)
+        return self._shader.surfaceArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
 
 class ImportedOBJ:
-    
-    def __init__(self, path: str, position: Vector, size: float, shader):
-        
+
+    def __init__(self, path: str, position: Vector, size: float, shader, cacheDirectory: str = None):
+        """path: OBJ file, loaded with obj_loader.loadOBJ (cached in cacheDirectory, default: .meshcache next to the file)
+        position, size: the vertices of the file are moved by position then scaled by size
+        The mesh is kept as arrays: vertices, faces (vertex indices of each triangle), normals, uvs...
+        """
         self._shader = shader
-        vertices = []
-        self.faces = []
-        
-        f = open(path)
-        for line in f:
-            if line[:2] == "v ":
-                print("v")
-                index1 = line.find(" ") + 1
-                index2 = line.find(" ", index1 + 1)
-                index3 = line.find(" ", index2 + 1)
-
-                vertex = (
-                    Vector(
-                        float(line[index1:index2]),
-                        float(line[index2:index3]),
-                        float(line[index3:-index1])
-                    ).round(2) + position
-                ) * size
-                vertices.append(vertex)
-
-            elif line[:2] == "f ":
-                print("f")
-                string = line.replace("//", "/")
-                i = string.find(" ") + 1
-                face = []
-                for item in range(string.count(" ")):
-                    if string.find(" ", i) == -1:
-                        print(string[i:-1])
-                        face.append(vertices[int(string[i:-1])-1])
-                        break
-                    face.append(vertices[int(string[i:string.find(" ", i)])-1])
-                    i = string.find(" ", i) + 1
-                self.faces.append(Triangle(face[0], face[1], face[2], None))
-
-        print(len(self.faces))
+        self.mesh = loadOBJ(path, cacheDirectory)
+        self.faces = self.mesh["faces"]
+        self.vertices = (self.mesh["vertices"] + position.toArray()) * size
+
+        # Möller–Trumbore data of each triangle
+        corners = self.vertices[self.faces]
+        self.v0 = corners[:, 0]
+        self.edge1 = corners[:, 1] - self.v0
+        self.edge2 = corners[:, 2] - self.v0
+        self.faceNormals = _normalizeRows(np.cross(self.edge1, self.edge2))
+        self.hasVertexNormals = len(self.mesh["normals"]) > 0 and bool((self.mesh["faceNormals"] >= 0).all())
+        self._lists = None
+
+        if size > 0:
+            # the tree of the cache is built on the vertices of the file
+            self.bvh = BVH.fromArrays(self.mesh, position.toArray(), size)
+        else:
+            self.bvh = BVH(corners.min(axis=1), corners.max(axis=1), leafSize=4)
+
+    def _scalarLists(self):
+        if self._lists is None:
+            self._lists = (self.v0.tolist(), self.edge1.tolist(), self.edge2.tolist())
+        return self._lists
+
+    def _shadingNormals(self, faces, u, v, rayDirections):
+        """Normals at the barycentric coordinates u, v of the faces, facing the rays"""
+        if self.hasVertexNormals:
+            corners = self.mesh["normals"][self.mesh["faceNormals"][faces]]
+            normals = _normalizeRows(corners[:, 0] * (1 - u - v)[:, None] + corners[:, 1] * u[:, None] + corners[:, 2] * v[:, None])
+        else:
+            normals = self.faceNormals[faces]
+        return np.where((np.einsum("ij,ij->i", normals, rayDirections) > 0)[:, None], -normals, normals)
+
+    def _intersectFace(self, face, rayOrigin, rayDirection):
+        v0, edge1, edge2 = (values[face] for values in self._scalarLists())
+        dx, dy, dz = rayDirection.x, rayDirection.y, rayDirection.z
+        px, py, pz = dy * edge2[2] - dz * edge2[1], dz * edge2[0] - dx * edge2[2], dx * edge2[1] - dy * edge2[0]
+        det = edge1[0] * px + edge1[1] * py + edge1[2] * pz
+        if abs(det) < 1e-12:
+            return None, None
+
+        sx, sy, sz = rayOrigin.x - v0[0], rayOrigin.y - v0[1], rayOrigin.z - v0[2]
+        u = (sx * px + sy * py + sz * pz) / det
+        if u < 0 or u > 1:
+            return None, None
+        qx, qy, qz = sy * edge1[2] - sz * edge1[1], sz * edge1[0] - sx * edge1[2], sx * edge1[1] - sy * edge1[0]
+        v = (dx * qx + dy * qy + dz * qz) / det
+        if v < 0 or u + v > 1:
+            return None, None
+        t = (edge2[0] * qx + edge2[1] * qy + edge2[2] * qz) / det
+        if t <= 0:
+            return None, None
+
+        normal = self._shadingNormals(np.array([face]), np.array([u]), np.array([v]), np.array([[dx, dy, dz]]))[0]
+        return t, Vector(*normal.tolist())
+
+    def _intersectLeafFaces(self, faces, rayOrigins, rayDirections):
+        """All the rays against all the faces: returns distances (rays, faces) (np.inf if missed), u, v"""
+        v0, edge1, edge2 = self.v0[faces], self.edge1[faces], self.edge2[faces]
+        p = np.cross(rayDirections[:, None], edge2)
+        det = np.einsum("fi,rfi->rf", edge1, p)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverseDet = np.where(np.abs(det) < 1e-12, 0, 1 / det)
+            s = rayOrigins[:, None] - v0
+            u = np.einsum("rfi,rfi->rf", s, p) * inverseDet
+            q = np.cross(s, edge1)
+            v = np.einsum("ri,rfi->rf", rayDirections, q) * inverseDet
+            t = np.einsum("fi,rfi->rf", edge2, q) * inverseDet
+        hit = (inverseDet != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+        return np.where(hit, t, np.inf), u, v
+
+    def _intersectLeaf(self, faces, rayOrigins, rayDirections):
+        distances, u, v = self._intersectLeafFaces(faces, rayOrigins, rayDirections)
+        nearest = np.argmin(distances, axis=1)
+        rays = np.arange(len(rayDirections))
+        minDistances = distances[rays, nearest]
+        hit = minDistances < np.inf
+
+        nearestFaces = np.where(hit, faces[nearest], -1)
+        normals = np.zeros(rayDirections.shape)
+        if hit.any():
+            normals[hit] = self._shadingNormals(nearestFaces[hit], u[rays, nearest][hit], v[rays, nearest][hit], rayDirections[hit])
+        return nearestFaces, minDistances, normals
+
+    def _occludesFace(self, face, rayOrigin, rayDirection, maxDistance):
+        distance, _normal = self._intersectFace(face, rayOrigin, rayDirection)
+        return distance is not None and distance < maxDistance
+
+    def _occludesLeaf(self, faces, rayOrigins, rayDirections, maxDistances):
+        distances, _u, _v = self._intersectLeafFaces(faces, rayOrigins, rayDirections)
+        return (distances < maxDistances[:, None]).any(axis=1)
 
     def intersect(self, rayOrigin, rayDirection):
-        distances = []
-        normals = []
-        for triangle in self.faces:
-            distance, normal = triangle.intersect(rayOrigin, rayDirection)
-            print(normal)
-            distances.append(distance)
-            normals.append(normal)
-
-        minDistance = np.inf
-        for i, distance in enumerate(distances):
-            if distance and distance < minDistance:
-                print("obj import")
-                minDistance = distance
-                normalToSurface = normals[i]
+        face, minDistance, normalToSurface = self.bvh.intersect(rayOrigin, rayDirection, self._intersectFace)
+        if face is None:
+            return None, None
 
         return minDistance, normalToSurface
 
+    def intersectArray(self, rayOrigins, rayDirections):
+        _faces, minDistances, normalsToSurface = self.bvh.intersectArray(rayOrigins, rayDirections, self._intersectLeaf)
+        return minDistances, normalsToSurface
+
+    def occludes(self, rayOrigin, rayDirection, maxDistance):
+        return self.bvh.occluded(rayOrigin, rayDirection, maxDistance, self._occludesFace)
+
+    def occludesArray(self, rayOrigins, rayDirections, maxDistances):
+        return self.bvh.occludedArray(rayOrigins, rayDirections, maxDistances, self._occludesLeaf)
+
+    def bounds(self):
+        return self.bvh.nodeMin[0], self.bvh.nodeMax[0]
+
     def shader(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
 
         return self._shader.calculate(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
 
+    def shaderArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+
+        return self._shader.calculateArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
+    def surface(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
+        return self._shader.surface(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
+
+    def surfaceArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        return self._shader.surfaceArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
 
 class Triangle():
     def __init__(self, point1:Vector, point2:Vector, point3:Vector, shader):
@@ -147,7 +325,7 @@ class Triangle():
         D = normal.dotProduct(self.p1)
 
         #find t
-        t = (normal.dotProduct(rayOrigin) + D) / normalDotRayDir
+        t = (D - normal.dotProduct(rayOrigin)) / normalDotRayDir
         # check if triangle is behind the ray
         if t < 0:
             return None, None
@@ -182,6 +360,48 @@ class Triangle():
         #u /= denom
         #v /= denom
 
+    def intersectArray(self, rayOrigins, rayDirections):
+        p1, p2, p3 = self.p1.toArray(), self.p2.toArray(), self.p3.toArray()
+        normal = np.cross(p2 - p1, p3 - p1)
+
+        normalDotRayDir = rayDirections @ normal
+        hit = np.abs(normalDotRayDir) >= 1e-8
+
+        D = normal @ p1
+        t = np.full(normalDotRayDir.shape, np.inf)
+        t[hit] = (D - np.broadcast_to(rayOrigins @ normal, t.shape)[hit]) / normalDotRayDir[hit]
+        hit &= t >= 0
+
+        P = rayOrigins + rayDirections * np.where(hit, t, 0)[:, None]
+        # same edge order as the scalar test
+        for start, end in ((p1, p2), (p2, p3), (p3, p1)):
+            hit &= np.cross(end - start, P - start) @ normal >= 0
+
+        return np.where(hit, t, np.inf), np.broadcast_to(-normal, rayDirections.shape)
+
+    def occludes(self, rayOrigin, rayDirection, maxDistance):
+        distance, _normal = self.intersect(rayOrigin, rayDirection)
+        return distance is not None and 0 < distance < maxDistance
+
+    def occludesArray(self, rayOrigins, rayDirections, maxDistances):
+        distances, _normals = self.intersectArray(rayOrigins, rayDirections)
+        return (distances > 0) & (distances < maxDistances)
+
+    def bounds(self):
+        points = np.array((self.p1.toArray(), self.p2.toArray(), self.p3.toArray()))
+        return points.min(axis=0), points.max(axis=0)
+
     def shader(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
 
         return self._shader.calculate(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
+
+    def shaderArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+
+        return self._shader.calculateArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
+    def surface(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
+        return self._shader.surface(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
+
+    def surfaceArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        return self._shader.surfaceArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+
@@ -0,0 +1,257 @@
+import math
+import numpy as np
+
+from Vector import Vector
+from objects_class import Sphere, Plane, Triangle
+from kernels import backend
+
+
+# Values of a primitive in the packed arrays
+rowSizes = {"sphere": 4, "plane": 4, "triangle": 12}
+
+
+def packRow(obj):
+    """(kind, row) of an object in the packed arrays, kind None for the objects tested by their own methods
+    sphere: center, radius ** 2
+    plane: normal, distance
+    triangle: first point, edges p1p2 and p1p3 (Moller-Trumbore), normal returned by Triangle.intersect (not normalized)
+    """
+    kind = type(obj)
+    if kind is Sphere:
+        return "sphere", np.array(obj.center.toArray().tolist() + [obj.radius ** 2], dtype=float)
+    if kind is Plane:
+        return "plane", np.array(obj.normal.toArray().tolist() + [obj.distance], dtype=float)
+    if kind is Triangle:
+        p1, p2, p3 = obj.p1.toArray(), obj.p2.toArray(), obj.p3.toArray()
+        return "triangle", np.concatenate((p1, p2 - p1, p3 - p1, -np.cross(p2 - p1, p3 - p1)))
+    return None, None
+
+
+# Scalar kernels ========================================================================================================================
+# origin and direction (floats), row: tuple of floats. Distance or None
+
+def sphereDistance(ox, oy, oz, dx, dy, dz, row):
+    cx, cy, cz, radius2 = row
+    x, y, z = ox - cx, oy - cy, oz - cz
+    b = (dx * x + dy * y + dz * z) * 2
+    delta = b * b - 4 * (x * x + y * y + z * z - radius2)
+    if delta > 0:
+        root = math.sqrt(delta)
+        t1, t2 = (-b + root) / 2, (-b - root) / 2
+        if t1 > 0 and t2 > 0:
+            return min(t1, t2)
+    return None
+
+
+def planeDistance(ox, oy, oz, dx, dy, dz, row):
+    nx, ny, nz, distance = row
+    dotDir = nx * dx + ny * dy + nz * dz
+    if dotDir != 0:
+        dist = (nx * ox + ny * oy + nz * oz + distance) / dotDir
+        if dist < 0:
+            return -dist
+    return None
+
+
+def triangleDistance(ox, oy, oz, dx, dy, dz, row):
+    vx, vy, vz, ax, ay, az, bx, by, bz = row[:9]
+    px, py, pz = dy * bz - dz * by, dz * bx - dx * bz, dx * by - dy * bx
+    determinant = ax * px + ay * py + az * pz
+    if abs(determinant) < 1e-8:
+        return None
+    inverse = 1 / determinant
+    tx, ty, tz = ox - vx, oy - vy, oz - vz
+    u = (tx * px + ty * py + tz * pz) * inverse
+    if u < 0 or u > 1:
+        return None
+    qx, qy, qz = ty * az - tz * ay, tz * ax - tx * az, tx * ay - ty * ax
+    v = (dx * qx + dy * qy + dz * qz) * inverse
+    if v < 0 or u + v > 1:
+        return None
+    t = (bx * qx + by * qy + bz * qz) * inverse
+    return t if t >= 0 else None
+
+
+scalarKernels = {"sphere": sphereDistance, "plane": planeDistance, "triangle": triangleDistance}
+
+
+# Packed scene
+class PackedScene(list):
+
+    def __init__(self, objects):
+        """objects: scene objects, can be used as the objects list of worldInfos
+        The spheres, planes and triangles are copied in one array per kind (struct of arrays) with the values their
+        intersection needs, computed once. Their rays are tested against all the primitives of a kind together (kernels.backend()),
+        the other objects (meshes...) with their own methods.
+        Call update(index) after moving or changing one object (done by scene[index] = obj), rebuild() after
+        adding or removing objects.
+        """
+        super().__init__(objects)
+        self.rebuild()
+
+    def rebuild(self):
+        rows = {kind: [] for kind in rowSizes}
+        self.indices = {kind: [] for kind in rowSizes}
+        # kind and position in the arrays of each object
+        self.locations = []
+        self.others = []
+        for index, obj in enumerate(self):
+            kind, row = packRow(obj)
+            if kind is None:
+                self.others.append(index)
+                self.locations.append((None, None))
+            else:
+                self.locations.append((kind, len(rows[kind])))
+                rows[kind].append(row)
+                self.indices[kind].append(index)
+
+        self.rows = {kind: np.array(rows[kind], dtype=float).reshape((-1, size)) for kind, size in rowSizes.items()}
+        self.indices = {kind: np.array(indices, dtype=int) for kind, indices in self.indices.items()}
+        self._scalarRows = {kind: [tuple(row) for row in rows.tolist()] for kind, rows in self.rows.items()}
+
+    def update(self, index: int):
+        """Packs the values of one object again (after it moved or changed), rebuilds everything if its kind changed"""
+        kind, row = packRow(self[index])
+        if kind is None or self.locations[index][0] != kind:
+            if kind is not None or self.locations[index][0] is not None:
+                self.rebuild()
+            return
+        position = self.locations[index][1]
+        self.rows[kind][position] = row
+        self._scalarRows[kind][position] = tuple(row.tolist())
+
+    def __setitem__(self, index, obj):
+        super().__setitem__(index, obj)
+        if isinstance(index, slice):
+            self.rebuild()
+        else:
+            self.update(index % len(self))
+
+    def subset(self, indices):
+        """PackedScene of some of the objects (indices in increasing order), without packing them again"""
+        packed = PackedScene.__new__(PackedScene)
+        list.__init__(packed, [self[i] for i in indices])
+        newIndices = np.full(len(self), -1)
+        newIndices[indices] = np.arange(len(indices))
+
+        packed.rows, packed.indices, packed._scalarRows = {}, {}, {}
+        packed.locations = [(None, None)] * len(indices)
+        for kind in rowSizes:
+            kept = np.flatnonzero(newIndices[self.indices[kind]] >= 0)
+            packed.rows[kind] = self.rows[kind][kept]
+            packed.indices[kind] = newIndices[self.indices[kind][kept]]
+            packed._scalarRows[kind] = [self._scalarRows[kind][position] for position in kept]
+            for position, index in enumerate(packed.indices[kind]):
+                packed.locations[index] = (kind, position)
+        packed.others = [int(newIndices[i]) for i in self.others if newIndices[i] >= 0]
+        return packed
+
+    # Normals =============================================================================================
+    def _normals(self, kind, positions, rayOrigins, rayDirections, distances):
+        rows = self.rows[kind][positions]
+        if kind == "sphere":
+            normals = rayOrigins + rayDirections * distances[:, None] - rows[:, :3]
+            return normals / np.linalg.norm(normals, axis=1)[:, None]
+        if kind == "plane":
+            return rows[:, :3]
+        return rows[:, 9:12]
+
+    def _normal(self, kind, position, rayOrigin, rayDirection, distance):
+        row = self._scalarRows[kind][position]
+        if kind == "sphere":
+            return Vector.normalize(rayOrigin + rayDirection * distance - Vector(*row[:3]))
+        if kind == "plane":
+            return Vector(*row[:3])
+        return Vector(*row[9:12])
+
+    # Arrays of rays ======================================================================================
+    def nearestIntersectedArray(self, rayOrigins, rayDirections):
+        """Same as shaders_class.nearestIntersectedObjectArray, the primitives are tested by the kernels of kernels.backend()"""
+        count = len(rayDirections)
+        nearestObjects = np.full(count, -1)
+        minDistances = np.full(count, np.inf)
+        normalsToSurface = np.zeros(rayDirections.shape)
+        allOrigins = np.broadcast_to(rayOrigins, rayDirections.shape)
+
+        def keep(objects, distances, normals):
+            # the nearest hit wins, the first object of the list if they are at the same distance (as the lists)
+            closer = (distances > 0) & ((distances < minDistances) | ((distances == minDistances) & (objects < nearestObjects)))
+            closer &= distances < np.inf
+            nearestObjects[closer], minDistances[closer] = objects[closer], distances[closer]
+            normalsToSurface[closer] = normals(closer)
+
+        kernelBackend = backend()
+        for kind in rowSizes:
+            if not len(self.rows[kind]):
+                continue
+            positions, distances = kernelBackend.nearestHits(kind, rayOrigins, rayDirections, self.rows[kind])
+            keep(self.indices[kind][positions], distances, lambda closer: self._normals(
+                kind, positions[closer], allOrigins[closer], rayDirections[closer], distances[closer]))
+
+        for i in self.others:
+            distances, normals = self[i].intersectArray(rayOrigins, rayDirections)
+            keep(np.full(count, i), distances, lambda closer: normals[closer])
+
+        return nearestObjects, minDistances, normalsToSurface
+
+    def occludedArray(self, rayOrigins, rayDirections, maxDistances):
+        """Same as shaders_class.occludedArray"""
+        count = len(rayDirections)
+        isOccluded = np.zeros(count, dtype=bool)
+        maxDistances = np.broadcast_to(maxDistances, isOccluded.shape)
+        kernelBackend = backend()
+        for kind in rowSizes:
+            if len(self.rows[kind]):
+                isOccluded |= kernelBackend.anyHits(kind, rayOrigins, rayDirections, self.rows[kind], maxDistances)
+
+        rayOrigins = np.broadcast_to(rayOrigins, rayDirections.shape)
+        for i in self.others:
+            rays = np.flatnonzero(~isOccluded)
+            if not len(rays):
+                break
+            isOccluded[rays] = self[i].occludesArray(rayOrigins[rays], rayDirections[rays], maxDistances[rays])
+        return isOccluded
+
+    # One ray =============================================================================================
+    def nearestIntersected(self, rayOrigin, rayDirection):
+        """Same as shaders_class.nearestIntersectedObject"""
+        ox, oy, oz, dx, dy, dz = rayOrigin.x, rayOrigin.y, rayOrigin.z, rayDirection.x, rayDirection.y, rayDirection.z
+        minDistance, nearestIndex, nearest = np.inf, len(self), None
+        for kind, kernel in scalarKernels.items():
+            indices = self.indices[kind]
+            for position, row in enumerate(self._scalarRows[kind]):
+                distance = kernel(ox, oy, oz, dx, dy, dz, row)
+                if distance and (distance < minDistance or (distance == minDistance and indices[position] < nearestIndex)):
+                    minDistance, nearestIndex, nearest = distance, indices[position], (kind, position)
+
+        normalToSurface = None
+        if nearest is not None:
+            normalToSurface = self._normal(nearest[0], nearest[1], rayOrigin, rayDirection, minDistance)
+        for i in self.others:
+            distance, normal = self[i].intersect(rayOrigin, rayDirection)
+            if distance and (distance < minDistance or (distance == minDistance and i < nearestIndex)):
+                minDistance, nearestIndex, normalToSurface = distance, i, normal
+
+        if normalToSurface is None:
+            return None, np.inf, Vector(0, 0, 0)
+        return self[nearestIndex], minDistance, normalToSurface
+
+    def occluded(self, rayOrigin, rayDirection, maxDistance):
+        """Same as shaders_class.occluded"""
+        ox, oy, oz, dx, dy, dz = rayOrigin.x, rayOrigin.y, rayOrigin.z, rayDirection.x, rayDirection.y, rayDirection.z
+        for kind, kernel in scalarKernels.items():
+            for row in self._scalarRows[kind]:
+                distance = kernel(ox, oy, oz, dx, dy, dz, row)
+                if distance is not None and 0 < distance < maxDistance:
+                    return True
+        for i in self.others:
+            if self[i].occludes(rayOrigin, rayDirection, maxDistance):
+                return True
+        return False
+
+
+def packObjects(objects):
+    """objects as a PackedScene, unless they already are in an acceleration structure (ObjectBVH, PackedScene)"""
+    if hasattr(objects, "nearestIntersectedArray"):
+        return objects
+    return PackedScene(objects)
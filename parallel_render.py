@@ -0,0 +1,86 @@
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from renderer import pixelRays, shadeRays, finishColors, splitTiles
+from antialiasing import renderAdaptiveTile
+from tile_culling import tileObjects
+from sampling import useStream
+from kernels import setBackend
+
+
+# Tiles =================================================================================================================================
+
+def renderTile(tile: tuple, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict):
+    """Renders the pixels of one tile, returns an array (tileHeight, tileWidth, 3)
+    The random samples of the tile come from its own stream (seed parameter and first pixel of the tile):
+    the image is the same whatever the number of processes and the order of the tiles.
+    With the tileCulling parameter (default True), the primary rays are only tested against the objects in the frustum
+    of the tile (see tile_culling.tileObjects), and the tiles that only see the sky are filled without tracing.
+    """
+    rowStart, rowEnd, columnStart, columnEnd = tile
+    objects = None
+    if parameters.get("tileCulling", True):
+        objects = tileObjects(tile, dimensions, FOV, worldInfos)
+        if not len(objects):
+            return np.broadcast_to(finishColors(worldInfos[2].toArray()), (rowEnd - rowStart, columnEnd - columnStart, 3)).copy()
+
+    with useStream(parameters.get("seed", 0), rowStart, columnStart):
+        if parameters.get("maxSamples", 1) > 1:
+            return renderAdaptiveTile(tile, dimensions, FOV, worldInfos, parameters, objects=objects)[0]
+
+        rows, columns = np.mgrid[rowStart:rowEnd, columnStart:columnEnd]
+        origin, directions = pixelRays(rows.ravel(), columns.ravel(), dimensions, FOV, worldInfos[3])
+
+        colors = shadeRays(origin, directions, worldInfos, parameters, objects)
+        return colors.reshape((rowEnd - rowStart, columnEnd - columnStart, 3))
+
+
+# Process pool ==========================================================================================================================
+
+# Scene of the current worker process, set once by _initWorker instead of being sent with every tile
+_workerScene = None
+
+def _initWorker(dimensions, FOV, worldInfos, parameters):
+    global _workerScene
+    _workerScene = (dimensions, FOV, worldInfos, parameters)
+    if "backend" in parameters:
+        setBackend(parameters["backend"])
+
+def _renderWorkerTile(tile):
+    tileTime = time.time()
+    colors = renderTile(tile, *_workerScene)
+    return tile, colors, time.time() - tileTime
+
+
+def renderParallel(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, workers: int = None, tileSize: int = 32):
+    """Same as render() but the image is split in tiles rendered by a pool of processes.
+    workers: number of processes (default: number of CPUs)
+    tileSize: width and height of the tiles in pixels
+
+    The scene is sent to each worker once. Tiles are handed out one by one to the first idle worker,
+    so a few expensive tiles (reflections...) don't hold back the others.
+    """
+    actualTime = time.time()
+
+    width, height = dimensions
+    image = np.zeros((height, width, 3))
+    tiles = splitTiles(dimensions, tileSize)
+    workers = workers or os.cpu_count()
+
+    if workers == 1:
+        for i, tile in enumerate(tiles):
+            image[tile[0]:tile[1], tile[2]:tile[3]] = renderTile(tile, dimensions, FOV, worldInfos, parameters)
+            print("%d/%d tiles" % (i+1, len(tiles)))
+        return image, time.time() - actualTime
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker,
+                             initargs=(dimensions, FOV, worldInfos, parameters)) as pool:
+        futures = [pool.submit(_renderWorkerTile, tile) for tile in tiles]
+        for i, future in enumerate(as_completed(futures)):
+            tile, colors, tileTime = future.result()
+            image[tile[0]:tile[1], tile[2]:tile[3]] = colors
+            print("%d/%d tiles" % (i+1, len(tiles)))
+
+    return image, time.time() - actualTime
@@ -0,0 +1,333 @@
+import sys
+import json
+import time
+import inspect
+import numpy as np
+from contextlib import contextmanager
+
+import kernels
+import objects_class
+import packed_scene
+import shaders_class
+import tile_culling
+from parallel_render import splitTiles, renderTile
+
+
+# Functions of shaders_class that trace rays: (name, ray kind, True if it takes arrays of rays)
+# the kind None is decided when called: primary outside of any shader, reflection inside one
+rayFunctions = (
+    ("nearestIntersectedObject", None, False),
+    ("nearestIntersectedObjectArray", None, True),
+    ("nearestReflectedObject", "reflection", False),
+    ("nearestReflectedObjectArray", "reflection", True),
+    ("occluded", "shadow", False),
+    ("occludedArray", "shadow", True),
+)
+# Functions of shaders_class whose rays are indirect lighting
+indirectFunctions = ("DiffuseIndirectLightning", "ambientOcclusion", "indirectLightingArray", "ambientOcclusionArray")
+# Methods of the objects that test rays (True if they take arrays of rays)
+objectMethods = (("intersect", False), ("intersectArray", True), ("occludes", False), ("occludesArray", True))
+# Kernels of the backends that test the rays against the packed primitives (packed_scene.PackedScene)
+backendMethods = ("nearestHits", "anyHits")
+# Kernel of the backends that traces the shadow rays of the light samples itself (shaders_class.directLightingArray)
+backendLightingMethod = "directLighting"
+# Name of the packed primitives in the reports, as their objects
+packedKinds = {"sphere": "Sphere", "plane": "Plane", "triangle": "Triangle"}
+
+
+class RenderProfiler:
+    """Counts the rays and intersection tests of a render and measures where its time goes.
+
+    Use it with "with profiler:" around a render (or enable() / disable()). While enabled, the methods of
+    the objects and shaders, the kernels of the packed scenes and the ray functions of shaders_class are replaced
+    by counting versions.
+    They are restored when it is disabled, so a disabled profiler costs nothing.
+    Times are exclusive: the time of a shader doesn't include the shadow and reflection rays it traces.
+    """
+
+    def __init__(self):
+        self._patches = []
+        self.reset()
+
+    def reset(self):
+        self.rays = {"primary": 0, "shadow": 0, "reflection": 0, "indirect": 0}
+        self.intersectionTests = {}
+        self.times = {"traversal": 0.0, "intersect": 0.0, "shade": 0.0, "culling": 0.0}
+        self.timeByObject = {}
+        self.timeByShader = {}
+        self.tiles = []
+        self.totalTime = 0.0
+        self._stack = []
+        self._shadingDepth = 0
+        self._indirectDepth = 0
+        self._cullingDepth = 0
+        self._rayDepth = 0
+        self._lightingDepth = 0
+        self._startTime = None
+
+    # Enable / disable ====================================================================================
+    def enable(self):
+        if self._patches:
+            return
+        self._startTime = time.time()
+
+        for name, kind, isArray in rayFunctions:
+            self._patchFunction(shaders_class, name, self._rayFunction(getattr(shaders_class, name), kind, isArray))
+        for name in indirectFunctions:
+            if hasattr(shaders_class, name):
+                self._patchFunction(shaders_class, name, self._indirectFunction(getattr(shaders_class, name)))
+
+        for cls in self._classes(objects_class, "intersect"):
+            for name, isArray in objectMethods:
+                if name in cls.__dict__:
+                    self._patchMethod(cls, name, self._objectMethod(cls.__dict__[name], cls.__name__, isArray))
+            if cls is objects_class.ImportedOBJ:
+                self._patchMethod(cls, "_intersectFace", self._triangleMethod(cls._intersectFace, False))
+                self._patchMethod(cls, "_intersectLeafFaces", self._triangleMethod(cls._intersectLeafFaces, True))
+
+        # packed primitives: one call tests every row of a kind against every ray
+        for backendClass in (kernels.NumpyBackend, kernels._loadNumba()):
+            if backendClass is not None:
+                for name in backendMethods:
+                    self._patchMethod(backendClass, name, staticmethod(self._kernelMethod(getattr(backendClass, name))))
+                method = getattr(backendClass, backendLightingMethod)
+                self._patchMethod(backendClass, backendLightingMethod, staticmethod(self._lightingMethod(method)))
+        for kind, kernel in list(packed_scene.scalarKernels.items()):
+            self._patches.append((packed_scene.scalarKernels, kind, kernel))
+            packed_scene.scalarKernels[kind] = self._scalarKernel(kernel, packedKinds[kind])
+
+        # the frustum tests of the tiles intersect objects too, they are counted apart
+        self._patchFunction(tile_culling, "tileObjects", self._cullingFunction(tile_culling.tileObjects))
+
+        for cls in self._classes(shaders_class, "calculate"):
+            for name in ("calculate", "calculateArray", "surface", "surfaceArray"):
+                if name in cls.__dict__:
+                    self._patchMethod(cls, name, self._shaderMethod(cls.__dict__[name], cls.__name__))
+
+    def disable(self):
+        for owner, name, original in reversed(self._patches):
+            if isinstance(owner, dict):
+                owner[name] = original
+            else:
+                setattr(owner, name, original)
+        self._patches = []
+        if self._startTime is not None:
+            self.totalTime += time.time() - self._startTime
+            self._startTime = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exception):
+        self.disable()
+
+    @staticmethod
+    def _classes(module, methodName):
+        return [cls for _name, cls in inspect.getmembers(module, inspect.isclass)
+                if cls.__module__ == module.__name__ and methodName in cls.__dict__]
+
+    def _patchFunction(self, module, name, wrapper):
+        # the function is replaced in every module that imported it (from shaders_class import *...)
+        original = getattr(module, name)
+        for module in list(sys.modules.values()):
+            try:
+                found = getattr(module, name, None) is original
+            except Exception:
+                found = False
+            if found:
+                self._patches.append((module, name, original))
+                setattr(module, name, wrapper)
+
+    def _patchMethod(self, cls, name, wrapper):
+        self._patches.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, wrapper)
+
+    # Wrappers ============================================================================================
+    def _timed(self, function, category, table=None, key=None):
+        """function with its exclusive time added to times[category] (and table[key])"""
+        stack, times = self._stack, self.times
+        perfCounter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            stack.append(0.0)
+            start = perfCounter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perfCounter() - start
+                exclusive = elapsed - stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                times[category] += exclusive
+                if table is not None:
+                    table[key] = table.get(key, 0.0) + exclusive
+        return wrapper
+
+    def _rayFunction(self, function, kind, isArray):
+        timed = self._timed(function, "traversal")
+
+        def wrapper(objects, rayOrigins, rayDirections, *args):
+            # a ray function calling another one (nearestReflectedObject...): the rays are already counted
+            if self._rayDepth:
+                return function(objects, rayOrigins, rayDirections, *args)
+            rayKind = kind or ("indirect" if self._indirectDepth else ("reflection" if self._shadingDepth else "primary"))
+            self.rays[rayKind] += len(rayDirections) if isArray else 1
+            self._rayDepth += 1
+            try:
+                return timed(objects, rayOrigins, rayDirections, *args)
+            finally:
+                self._rayDepth -= 1
+        return wrapper
+
+    def _indirectFunction(self, function):
+        def wrapper(*args, **kwargs):
+            self._indirectDepth += 1
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._indirectDepth -= 1
+        return wrapper
+
+    def _objectMethod(self, method, className, isArray):
+        timed = self._timed(method, "intersect", self.timeByObject, className)
+        tests = self.intersectionTests
+
+        def wrapper(obj, rayOrigins, rayDirections, *args):
+            if self._cullingDepth:
+                return method(obj, rayOrigins, rayDirections, *args)
+            tests[className] = tests.get(className, 0) + (len(rayDirections) if isArray else 1)
+            return timed(obj, rayOrigins, rayDirections, *args)
+        return wrapper
+
+    def _kernelMethod(self, method):
+        tests, timeByObject = self.intersectionTests, self.timeByObject
+        timedByKind = {kind: self._timed(method, "intersect", timeByObject, className) for kind, className in packedKinds.items()}
+
+        def wrapper(kind, rayOrigins, rayDirections, rows, *args):
+            # the shadow rays of directLighting are already counted
+            if not self._lightingDepth:
+                className = packedKinds[kind]
+                tests[className] = tests.get(className, 0) + len(rows) * len(rayDirections)
+            return timedByKind[kind](kind, rayOrigins, rayDirections, rows, *args)
+        return wrapper
+
+    def _lightingMethod(self, method):
+        # shadow rays and shading of the light samples in one kernel: its time goes to the traversal
+        timed = self._timed(method, "traversal")
+        tests = self.intersectionTests
+
+        def wrapper(*args):
+            weights, rows = args[9], args[13]
+            self.rays["shadow"] += len(weights)
+            for kind, kindRows in rows.items():
+                if len(kindRows):
+                    tests[packedKinds[kind]] = tests.get(packedKinds[kind], 0) + len(kindRows) * len(weights)
+            self._lightingDepth += 1
+            try:
+                return timed(*args)
+            finally:
+                self._lightingDepth -= 1
+        return wrapper
+
+    def _scalarKernel(self, kernel, className):
+        timed = self._timed(kernel, "intersect", self.timeByObject, className)
+        tests = self.intersectionTests
+
+        def wrapper(*args):
+            tests[className] = tests.get(className, 0) + 1
+            return timed(*args)
+        return wrapper
+
+    def _cullingFunction(self, function):
+        timed = self._timed(function, "culling")
+
+        def wrapper(*args, **kwargs):
+            self._cullingDepth += 1
+            try:
+                return timed(*args, **kwargs)
+            finally:
+                self._cullingDepth -= 1
+        return wrapper
+
+    def _triangleMethod(self, method, isArray):
+        # triangles of the meshes: the time is already counted by the ImportedOBJ methods
+        tests = self.intersectionTests
+
+        def wrapper(obj, faces, rayOrigins, rayDirections, *args):
+            count = len(faces) * len(rayDirections) if isArray else 1
+            tests["ImportedOBJ triangles"] = tests.get("ImportedOBJ triangles", 0) + count
+            return method(obj, faces, rayOrigins, rayDirections, *args)
+        return wrapper
+
+    def _shaderMethod(self, method, className):
+        timed = self._timed(method, "shade", self.timeByShader, className)
+
+        def wrapper(*args, **kwargs):
+            self._shadingDepth += 1
+            try:
+                return timed(*args, **kwargs)
+            finally:
+                self._shadingDepth -= 1
+        return wrapper
+
+    # Tiles ===============================================================================================
+    @contextmanager
+    def tile(self, tile: tuple):
+        """Measures the time and rays of the render of a tile (rowStart, rowEnd, columnStart, columnEnd)"""
+        rays = sum(self.rays.values())
+        tileTime = time.perf_counter()
+        yield
+        self.addTile(tile, time.perf_counter() - tileTime, sum(self.rays.values()) - rays)
+
+    def addTile(self, tile: tuple, tileTime: float, rays: int):
+        """Adds the time and rays of a tile measured by the renderer (the scalar renderer measures its pixels, see raytracer.render)"""
+        self.tiles.append({"tile": [int(value) for value in tile], "time": tileTime, "rays": int(rays)})
+
+    def heatmap(self, dimensions: tuple):
+        """Cost of each pixel (seconds): time of its tile divided by the number of pixels of the tile"""
+        width, height = dimensions
+        cost = np.zeros((height, width))
+        for tile in self.tiles:
+            rowStart, rowEnd, columnStart, columnEnd = tile["tile"]
+            cost[rowStart:rowEnd, columnStart:columnEnd] = tile["time"] / max((rowEnd - rowStart) * (columnEnd - columnStart), 1)
+        return cost
+
+    def writeHeatmap(self, path: str, dimensions: tuple):
+        """Writes the heatmap as an image: black (cheapest) -> red -> yellow -> white (most expensive)"""
+        from renderer import writeImage
+
+        cost = self.heatmap(dimensions)
+        scaled = cost / cost.max() if cost.max() > 0 else cost
+        image = np.clip(np.stack((scaled * 3, scaled * 3 - 1, scaled * 3 - 2), axis=-1), 0, 1)
+        writeImage(path, image)
+
+    # Report ==============================================================================================
+    def report(self):
+        totalTime = self.totalTime + (time.time() - self._startTime if self._startTime is not None else 0)
+        rays = dict(self.rays, total=sum(self.rays.values()))
+        times = dict(self.times, total=totalTime, other=totalTime - sum(self.times.values()))
+        return {"rays": rays, "intersectionTests": dict(self.intersectionTests), "time": times,
+                "timeByObject": dict(self.timeByObject), "timeByShader": dict(self.timeByShader), "tiles": list(self.tiles)}
+
+    def writeReport(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+
+def profileRender(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, tileSize: int = 16, profiler: RenderProfiler = None):
+    """Renders the image tile by tile in this process (renderTile) with a profiler, so that the time of
+    each tile is known. The tile size is the resolution of the heatmap (1: cost of every pixel, but slower)
+    Returns (image, time, profiler)
+    """
+    actualTime = time.time()
+    profiler = profiler or RenderProfiler()
+
+    width, height = dimensions
+    image = np.zeros((height, width, 3))
+    with profiler:
+        for tile in splitTiles(dimensions, tileSize):
+            with profiler.tile(tile):
+                image[tile[0]:tile[1], tile[2]:tile[3]] = renderTile(tile, dimensions, FOV, worldInfos, parameters)
+
+    return image, time.time() - actualTime, profiler
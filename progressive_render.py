@@ -0,0 +1,88 @@
+import time
+import numpy as np
+
+from renderer import shadePixels, writeImage
+from sampling import useStream
+
+
+def renderProgressive(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, samples: int = 16,
+                      coarseSize: int = 16, outputPath: str = None, saveInterval: float = 10, seed: int = 0):
+    """Generator version of render(): yields (image, infos) each time the image gets better.
+    The generator can be stopped at any moment (break), the last image yielded is always a complete frame.
+
+    samples: maximum number of samples per pixel
+    coarseSize: size in pixels of the blocks of the first preview
+    outputPath: if given, the current image is written there every saveInterval seconds and at the end
+    seed: seed of the sub-pixel jitter of the sample passes and of the random samples (each pass has its own stream)
+
+    First the image is refined coarse to fine: one ray per coarseSize x coarseSize block, then per block
+    half as big... until there is one ray per pixel (same image as renderBatch, but for the noise of the random samples:
+    each pass has its own stream). Then each pass adds a
+    jittered sample to every pixel and the image is the average of the samples.
+    infos: dict(pass, blockSize, samples, time, error, final), error is the mean standard error of the pixels
+    (None while there is only one sample per pixel), final is True for the last pass
+    """
+    startTime = lastSave = time.time()
+    width, height = dimensions
+    rng = np.random.default_rng(seed)
+
+    def finishPass(image, infos):
+        nonlocal lastSave
+        infos["time"] = time.time() - startTime
+        if outputPath is not None and (time.time() - lastSave >= saveInterval or infos["final"]):
+            writeImage(outputPath, image)
+            lastSave = time.time()
+        return image, infos
+
+    # Coarse to fine =====================================================================
+    firstSamples = np.zeros((height, width, 3))
+    blockSize = 1 << max(int(coarseSize).bit_length() - 1, 0)
+    passIndex = 0
+    while blockSize >= 1:
+        rows, columns = np.mgrid[0:height:blockSize, 0:width:blockSize]
+        # pixels already traced by the previous (twice as coarse) pass are skipped
+        new = (rows % (blockSize * 2) != 0) | (columns % (blockSize * 2) != 0) if passIndex else np.ones(rows.shape, dtype=bool)
+        rows, columns = rows[new], columns[new]
+        with useStream(seed, passIndex):
+            firstSamples[rows, columns] = shadePixels(rows, columns, dimensions, FOV, worldInfos, parameters)
+
+        preview = np.repeat(np.repeat(firstSamples[::blockSize, ::blockSize], blockSize, axis=0), blockSize, axis=1)
+        final = blockSize == 1 and samples <= 1
+        yield finishPass(preview[:height, :width], {"pass": passIndex, "blockSize": blockSize, "samples": 1, "error": None, "final": final})
+        blockSize //= 2
+        passIndex += 1
+
+    # Sample passes ======================================================================
+    colorSum = firstSamples.copy()
+    colorSquaredSum = firstSamples ** 2
+    rows, columns = np.divmod(np.arange(width * height), width)
+    for sampleCount in range(2, samples + 1):
+        jitter = rng.random((2, width * height)) - 0.5
+        with useStream(seed, passIndex):
+            colors = shadePixels(rows + jitter[0], columns + jitter[1], dimensions, FOV, worldInfos, parameters)
+        colors = colors.reshape((height, width, 3))
+        colorSum += colors
+        colorSquaredSum += colors ** 2
+
+        mean = colorSum / sampleCount
+        variance = np.maximum(colorSquaredSum / sampleCount - mean ** 2, 0) / (sampleCount - 1)
+        error = float(np.sqrt(variance).mean())
+        yield finishPass(mean, {"pass": passIndex, "blockSize": 1, "samples": sampleCount, "error": error, "final": sampleCount == samples})
+        passIndex += 1
+
+
+def renderUntil(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, timeBudget: float = None,
+                maxError: float = None, **progressiveOptions):
+    """Runs renderProgressive until the time budget (seconds) is spent or the error is below maxError
+    Returns (image, infos) of the last pass, the time budget is checked between passes.
+    """
+    image, infos = None, None
+    for image, infos in renderProgressive(dimensions, FOV, worldInfos, parameters, **progressiveOptions):
+        if timeBudget is not None and infos["time"] >= timeBudget:
+            break
+        if maxError is not None and infos["error"] is not None and infos["error"] <= maxError:
+            break
+
+    if progressiveOptions.get("outputPath") is not None and not infos["final"]:
+        writeImage(progressiveOptions["outputPath"], image)
+    return image, infos
@@ -1,37 +1,77 @@
 #! /bin/env python
 
-import numpy as np
-import matplotlib.pyplot as plt
 import time
+processStartTime = time.time()
+
+import os
+import json
+import argparse
+import numpy as np
 
 from Vector import *
 from objects_class import *
 from textures_class import *
 from shaders_class import *
+from renderer import renderBatch, writeImage, cameraBasis
+from antialiasing import renderAdaptive
+from parallel_render import renderParallel
+from profiler import RenderProfiler, profileRender
+from scene_loader import SceneCache, defaultParameters, buildValue
+from sampling import setStream, needsRandom
+from tile_culling import tileObjects
+from irradiance_cache import prepareCache, saveCache
+from visibility_cache import prepareVisibilityCache, saveVisibilityCache
+from packed_scene import packObjects
+from framebuffer import renderToFile, outOfCorePixels
+from denoiser import postProcess
+from animation import renderFrames, turntable
+from kernels import setBackend
 
 # Functions=============================================================================================================================
 
-def saveImage(image, width, height):
-    imageName = input("Your image name:")
+def saveImage(image, width, height, imageName=None):
+    if imageName is None:
+        imageName = input("Your image name:")
 
     path = 'Results/'
     fileName = path + imageName + '(%dX%d).png' % (width, height)
-    plt.imsave(fileName, image)
+    writeImage(fileName, image)
     print("Your image was successfully saved! \nPath: " + fileName)
 
-def render(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict): 
+def render(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, profiler: RenderProfiler = None, profileTileSize: int = 16):
     """Dimensions: tuple(height, width)
     FOV: Field Of View
     worldInfos: tuple(Objects, Lights, SkyDiffuse, Camera)
         objects: List containing all scene Objects
-        lights: List containing all scene Lights
+        light: lights_class.Lights (point, spot and area lights), or dict(position, ambient, diffuse, specular) of one point light
         skyDiffuse: color of the sky: Vector(red, green, blue) (value between 0 and 1)
-        camera: dict(position: Vector, direction: Vector)
+        camera: dict(position: Vector, direction: Vector): where the camera looks ((0, 0, 0): towards -z),
+            or dict(position, target: Vector) to look at a point (see renderer.cameraBasis)
     parameters: dict(maxReflection: int, indirectLightingMaxBounces: int, indirectLightingSamples: int, Lighting: str)
         Lighting: type of render:
             Direct: Only direct lighting (sharp and black shadows)
             Indirect: Only Inderect Lighting (sky light and less light)
             Global: Direct and Inderirect lighting
+        minSamples, maxSamples, aaThreshold, samplePattern: adaptive anti-aliasing of the batch and parallel
+            renderers (see antialiasing.renderAdaptiveTile), render() always traces one ray per pixel
+        seed: seed of all the random samples, the same seed gives the same image
+        sampleSequence: "random", "sobol" or "halton", samples of the indirect lighting (see sampling.unitSquareSamples)
+        irradianceCache, irradianceCacheError, irradianceCachePath: interpolates the indirect lighting from an
+            irradiance cache (see irradiance_cache.prepareCache), set up by renderWith
+        shadowCache, shadowCacheCellSize, shadowCachePath: reuses the shadow ray results of the previous points and
+            frames of a static scene (see visibility_cache.prepareVisibilityCache), set up by renderWith
+        russianRoulette: 0 (default) or a throughput: the reflection paths whose weight in the pixel gets lower are
+            terminated at random, the others go on with this weight (see shaders_class.tracePathsArray)
+        lightSamples: 0 (default): every light is sampled once at each hit, else number of shadow samples of each hit,
+            the lights are chosen in proportion to their power (see shaders_class.directLightingArray)
+        denoise: False (default), True or dict of arguments of denoiser.denoise: the image is filtered with an edge-avoiding
+            a-trous filter guided by auxiliary buffers (albedo, normals, depth, object ids) traced after the render, by renderWith
+        tileCulling: True (default): the primary rays of each tile of 16x16 pixels are only tested against the objects
+            in its frustum (see tile_culling.tileObjects)
+        backend: "auto", "numba" or "numpy", kernels of the packed objects and of the direct lighting, set up by renderWith
+            (see kernels.setBackend, default: RAYTRACER_BACKEND environment variable or "auto")
+    profiler: RenderProfiler measuring the render (optional): the time and rays of the pixels are added to it
+        by tiles of profileTileSize pixels, the resolution of its heatmap
     """
     actualTime = time.time()
 
@@ -42,17 +82,38 @@ def render(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict):
     screen = (-1, 1/ratio, 1, -1/ratio)
 
 
+    # each pixel has its own random stream, only made when the render uses random samples
+    seed, randomSamples = parameters.get("seed", 0), needsRandom(parameters, worldInfos[1])
+    culling, tileSize = parameters.get("tileCulling", True), 16
+    # orientation of the camera (see renderer.cameraBasis)
+    basis = cameraBasis(worldInfos[3])
+
     for i, y in enumerate(np.linspace(screen[1], screen[3], dimensions[1])):
+        if profiler is not None and i % profileTileSize == 0:
+            # time and rays of the tiles of this row of tiles
+            columnTiles = -(-dimensions[0] // profileTileSize)
+            tileTimes, tileRays = np.zeros(columnTiles), np.zeros(columnTiles, dtype=int)
+        if culling and i % tileSize == 0:
+            # objects the primary rays of each tile of this row of tiles can hit
+            tiles = [(i, min(i + tileSize, dimensions[1]), column, min(column + tileSize, dimensions[0]))
+                     for column in range(0, dimensions[0], tileSize)]
+            rowObjects = [tileObjects(tile, dimensions, FOV, worldInfos) for tile in tiles]
+
         for j, x in enumerate(np.linspace(screen[0], screen[2], dimensions[0])):
+            if profiler is not None:
+                pixelTime, pixelRays = time.perf_counter(), sum(profiler.rays.values())
+            if randomSamples:
+                setStream(seed, i, j)
 
             # Creates vectors
-            pixel = Vector(x, y, -FOV) + worldInfos[3]["position"]
-
             origin = worldInfos[3]["position"]
-            direction = Vector.normalize(pixel - origin)
-            #direction = Vector.normalize(direction + worldInfos[3]["direction"])
+            direction = Vector(x, y, -FOV)
+            if basis is not None:
+                direction = Vector(*(basis @ direction.toArray()).tolist())
+            direction = Vector.normalize(direction)
 
-            nearestObject, minDistance, normal = nearestIntersectedObject(worldInfos[0], origin, direction)
+            objects = rowObjects[j // tileSize] if culling else worldInfos[0]
+            nearestObject, minDistance, normal = nearestIntersectedObject(objects, origin, direction)
 
             if nearestObject is None:
                 color = worldInfos[2]
@@ -76,16 +137,303 @@ def render(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict):
             #clip color between 0 and 1
             color.clip(0, 1)
             image[i, j] = [color.x, color.y, color.z]
+            if profiler is not None:
+                tileTimes[j // profileTileSize] += time.perf_counter() - pixelTime
+                tileRays[j // profileTileSize] += sum(profiler.rays.values()) - pixelRays
+        if profiler is not None and (i % profileTileSize == profileTileSize - 1 or i == dimensions[1] - 1):
+            rowStart = i - i % profileTileSize
+            for column, (tileTime, rays) in enumerate(zip(tileTimes.tolist(), tileRays.tolist())):
+                columnStart = column * profileTileSize
+                profiler.addTile((rowStart, i + 1, columnStart, min(columnStart + profileTileSize, dimensions[0])), tileTime, rays)
         print("%d/%d" % (i+1, dimensions[1]))
 
     return image, time.time() - actualTime
 
 
+def prepareRender(worldInfos: tuple, parameters: dict):
+    """Kernel backend of the parameters, objects packed in a PackedScene (see packed_scene.packObjects) and caches
+    of the parameters loaded, before a render
+    Returns (worldInfos, parameters) to render with
+    """
+    if "backend" in parameters:
+        setBackend(parameters["backend"])
+    worldInfos = (packObjects(worldInfos[0]),) + tuple(worldInfos[1:])
+    parameters = prepareVisibilityCache(prepareCache(parameters), worldInfos[0])
+    return worldInfos, parameters
+
+
+def renderWith(renderer: str, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, workers: int = 1,
+               auxiliaryPath: str = None):
+    """renderer: "scalar" (render), "batch" (renderBatch) or "parallel" (renderParallel with workers processes)
+    A plain list of objects is packed in a PackedScene first (see packed_scene.packObjects).
+    With the irradianceCache and shadowCache parameters, the caches are loaded from irradianceCachePath and
+    shadowCachePath before the render and saved after.
+    The parallel workers fill their own copy of the caches: they aren't saved, and the image depends on the number of workers.
+    With the denoise parameter the image is denoised, auxiliaryPath: .npz file of the auxiliary buffers of the image
+    (see denoiser.postProcess), the render time includes them.
+    """
+    worldInfos, parameters = prepareRender(worldInfos, parameters)
+    if renderer == "parallel":
+        result = renderParallel(dimensions, FOV, worldInfos, parameters, workers)
+    elif renderer == "batch":
+        if parameters.get("maxSamples", 1) > 1:
+            result = renderAdaptive(dimensions, FOV, worldInfos, parameters)
+        else:
+            result = renderBatch(dimensions, FOV, worldInfos, parameters)
+    elif renderer == "scalar":
+        result = render(dimensions, FOV, worldInfos, parameters)
+    else:
+        raise ValueError("Unknown renderer: %s" % renderer)
+    saveCache(parameters)
+    saveVisibilityCache(parameters)
+    image, postProcessTime = postProcess(result[0], dimensions, FOV, worldInfos, parameters, auxiliaryPath)
+    return image, result[1] + postProcessTime
+
+
+def renderOutOfCore(output: str, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, workers: int = 1,
+                    framebufferPath: str = None, framebufferType: str = "float16"):
+    """renderWith for images too big for the memory: the bands of tiles are streamed to the output file (.png or .npy
+    framebuffer) as they are finished (see framebuffer.renderToFile), the image is never in memory
+    Returns (framebuffer or None, render time)
+    """
+    worldInfos, parameters = prepareRender(worldInfos, parameters)
+    result = renderToFile(output, dimensions, FOV, worldInfos, parameters, workers, framebufferPath=framebufferPath, dtype=framebufferType)
+    saveCache(parameters)
+    saveVisibilityCache(parameters)
+    return result
+
+
+def warnOutOfCore(parameters: dict, options: dict):
+    """Prints the options of a render that renderOutOfCore doesn't support: the denoise parameter (the filter needs
+    the whole image), and options: dict(name: value) such as auxiliary, profile, heatmap. Returns their names
+    """
+    ignored = (["denoise"] if parameters.get("denoise") else []) + [name for name, value in options.items() if value]
+    if ignored:
+        print("Warning: out-of-core renders don't support %s, ignored" % ", ".join(ignored))
+    return ignored
+
+
+def renderAnimation(outputPattern: str, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, animation: dict,
+                    renderer: str = "batch", workers: int = 1):
+    """Renders the frames of an animation and writes them to outputPattern % frame (for example "frame%03d.png").
+    The scene is prepared once (objects packed, caches loaded) for all the frames, see animation.renderFrames.
+    animation: dict(frames, camera: camera keyframes, or turntable: dict(target, radius, height, turns, startAngle),
+                    objects: {object index: keyframes}, temporalReuse, reuseTolerance)
+    Returns (list of the infos of the frames, render time)
+    """
+    actualTime = time.time()
+    worldInfos, parameters = prepareRender(worldInfos, parameters)
+    frames = animation["frames"]
+    if "turntable" in animation:
+        cameraKeyframes = turntable(frames=frames, **animation["turntable"])
+    else:
+        cameraKeyframes = animation.get("camera") or [dict(worldInfos[3], time=0)]
+    infos = []
+    for frame, image, frameInfos in renderFrames(dimensions, FOV, worldInfos, parameters, cameraKeyframes, frames,
+                                                 animation.get("objects"), renderer, workers, animation.get("temporalReuse", False),
+                                                 animation.get("reuseTolerance", 1)):
+        writeImage(outputPattern % frame, image)
+        infos.append(frameInfos)
+        print("frame %d/%d: %.3fs" % (frame+1, frames, frameInfos["time"]))
+    saveCache(parameters)
+    saveVisibilityCache(parameters)
+    return infos, time.time() - actualTime
+
+
+def renderProfiled(renderer: str, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict,
+                   reportPath: str = None, heatmapPath: str = None, auxiliaryPath: str = None, heatmapTileSize: int = 16):
+    """renderWith with a RenderProfiler, writes its JSON report and its cost heatmap (optional)
+    The scalar renderer measures its pixels by tiles, the others are rendered tile by tile in this process.
+    heatmapTileSize: size of these tiles (pixels), the resolution of the heatmap
+    Returns (image, time, profiler)
+    """
+    worldInfos, parameters = prepareRender(worldInfos, parameters)
+    if renderer == "scalar":
+        profiler = RenderProfiler()
+        with profiler:
+            image, renderTime = render(dimensions, FOV, worldInfos, parameters, profiler, heatmapTileSize)
+    else:
+        image, renderTime, profiler = profileRender(dimensions, FOV, worldInfos, parameters, heatmapTileSize)
+    saveCache(parameters)
+    saveVisibilityCache(parameters)
+    image, postProcessTime = postProcess(image, dimensions, FOV, worldInfos, parameters, auxiliaryPath)
+    renderTime += postProcessTime
+
+    report = profiler.report()
+    print("Profile: %d rays (%s), time: %s" % (
+        report["rays"]["total"], ", ".join("%s %d" % item for item in report["rays"].items() if item[0] != "total"),
+        ", ".join("%s %.3fs" % item for item in report["time"].items())))
+    if reportPath:
+        profiler.writeReport(reportPath)
+    if heatmapPath:
+        profiler.writeHeatmap(heatmapPath, dimensions)
+    return image, renderTime, profiler
+
+
+def runJob(job: dict, sceneCache: SceneCache, directory: str = "."):
+    """Renders one job and writes its image, without asking anything.
+    job: dict(scene, output, width, height, parameters, camera, renderer, workers, profile, heatmap, heatmapTileSize, outOfCore, framebuffer,
+             framebufferType, auxiliary, animation)
+        scene, output: paths, relative to directory
+        profile, heatmap: paths of the profiler report and cost heatmap (see renderProfiled), optional,
+            heatmapTileSize: resolution of the heatmap (default 16 pixels)
+        outOfCore: stream the image to the output while it is rendered (see renderOutOfCore), always done for the images
+            of more than framebuffer.outOfCorePixels pixels. framebuffer: path of a .npy framebuffer written too,
+            framebufferType: its type ("float16", "float32" or "uint8"). The denoise parameter, auxiliary, profile and heatmap
+            aren't supported there: they are ignored with a warning (see warnOutOfCore)
+        auxiliary: path of a .npz file to write the auxiliary buffers of the image to (see denoiser.postProcess)
+        animation: render frames instead of one image (see renderAnimation), output is then a pattern ("frame%03d.png")
+        parameters: replace the parameters of the scene file
+        camera: dict(position, direction or target), replaces the camera of the scene file
+    Returns the timings of the job (seconds)
+    """
+    jobTime = time.time()
+    scene, cached = sceneCache.load(os.path.join(directory, job["scene"]))
+    loadTime = time.time() - jobTime
+
+    camera = None
+    if "camera" in job:
+        camera = {key: Vector(*value) for key, value in job["camera"].items()}
+    jobParameters = dict(scene.parameters, **job.get("parameters", {}))
+    dimensions = (job.get("width", width), job.get("height", height))
+
+    output = os.path.join(directory, job["output"])
+    if "animation" in job:
+        _infos, renderTime = renderAnimation(output, dimensions, scene.FOV, scene.worldInfos(camera), jobParameters,
+                                             buildValue(job["animation"], directory), job.get("renderer", "batch"), job.get("workers", 1))
+        totalTime = time.time() - jobTime
+        return {"scene": job["scene"], "output": output, "sceneCached": cached, "sceneLoad": loadTime,
+                "render": renderTime, "write": 0, "total": totalTime, "overhead": totalTime - renderTime}
+
+    if job.get("outOfCore") or dimensions[0] * dimensions[1] > outOfCorePixels:
+        warnOutOfCore(jobParameters, {name: job.get(name) for name in ("auxiliary", "profile", "heatmap")})
+        framebufferPath = job.get("framebuffer") and os.path.join(directory, job["framebuffer"])
+        _framebuffer, renderTime = renderOutOfCore(output, dimensions, scene.FOV, scene.worldInfos(camera), jobParameters,
+                                                   job.get("workers", 1), framebufferPath, job.get("framebufferType", "float16"))
+        totalTime = time.time() - jobTime
+        return {"scene": job["scene"], "output": output, "sceneCached": cached, "sceneLoad": loadTime,
+                "render": renderTime, "write": 0, "total": totalTime, "overhead": totalTime - renderTime}
+
+    auxiliaryPath = job.get("auxiliary") and os.path.join(directory, job["auxiliary"])
+    if job.get("profile") or job.get("heatmap"):
+        image, renderTime, _profiler = renderProfiled(
+            job.get("renderer", "batch"), dimensions, scene.FOV, scene.worldInfos(camera), jobParameters,
+            job.get("profile") and os.path.join(directory, job["profile"]), job.get("heatmap") and os.path.join(directory, job["heatmap"]),
+            auxiliaryPath, job.get("heatmapTileSize", 16))
+    else:
+        image, renderTime = renderWith(job.get("renderer", "batch"), dimensions, scene.FOV, scene.worldInfos(camera),
+                                       jobParameters, job.get("workers", 1), auxiliaryPath)
+
+    writeTime = time.time()
+    writeImage(output, image)
+    writeTime = time.time() - writeTime
+
+    totalTime = time.time() - jobTime
+    return {"scene": job["scene"], "output": output, "sceneCached": cached, "sceneLoad": loadTime,
+            "render": renderTime, "write": writeTime, "total": totalTime, "overhead": totalTime - renderTime}
+
+
+def runJobs(jobs: list, directory: str = "."):
+    """Renders a list of jobs in this process: scenes used by several jobs are only loaded once"""
+    sceneCache = SceneCache()
+    reports = []
+    for i, job in enumerate(jobs):
+        report = runJob(job, sceneCache, directory)
+        reports.append(report)
+        print("job %d/%d: %s -> %s, render %.3fs, overhead %.3fs (scene %s %.3fs, write %.3fs)" % (
+            i+1, len(jobs), report["scene"], report["output"], report["render"], report["overhead"],
+            "cached" if report["sceneCached"] else "loaded", report["sceneLoad"], report["write"]))
+    return reports
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Python raytracer. Without scene or job file, renders the scene of this script.")
+    parser.add_argument("scene", nargs="?", help="scene file (JSON)")
+    parser.add_argument("-o", "--output", help="output image, by default the name is asked")
+    parser.add_argument("--width", type=int, default=width)
+    parser.add_argument("--height", type=int, default=height)
+    parser.add_argument("--parameters", type=json.loads, default={}, help='JSON, for example \'{"maxReflections": 2}\'')
+    parser.add_argument("--renderer", choices=("scalar", "batch", "parallel"), default="parallel" if renderWorkers > 1 else ("batch" if batchRender else "scalar"))
+    parser.add_argument("--workers", type=int, default=renderWorkers)
+    parser.add_argument("--jobs", help="job file (JSON): list of jobs, or dict(jobs, defaults) where defaults apply to every job")
+    parser.add_argument("--report", help="write the timings as JSON to this file")
+    parser.add_argument("--profile", help="count the rays and measure the render, write the report as JSON to this file")
+    parser.add_argument("--heatmap", help="with the profiler, write the render cost of the pixels as an image to this file")
+    parser.add_argument("--heatmap-tile-size", type=int, default=16, help="size of the tiles of the heatmap in pixels (1: cost of every pixel)")
+    parser.add_argument("--denoise", action="store_true", help="denoise the image (same as the denoise parameter)")
+    parser.add_argument("--auxiliary", help="write the auxiliary buffers of the image (albedo, normals, depth, object ids) to this .npz file")
+    parser.add_argument("--out-of-core", action="store_true", help="stream the image to the output (.png or .npy) while it is rendered, "
+                        "for images too big for the memory (always done above %d pixels with a scene file)" % outOfCorePixels)
+    parser.add_argument("--framebuffer", help="with --out-of-core, also write a memory-mapped framebuffer (.npy) to this file")
+    parser.add_argument("--framebuffer-type", choices=("float16", "float32", "uint8"), default="float16")
+    parser.add_argument("--animation", type=json.loads, help='with a scene file, render frames to the output pattern, JSON, for example '
+                        '\'{"frames": 24, "turntable": {"target": [0, 0, -1], "radius": 2, "height": 0.5}}\' (see renderAnimation)')
+    arguments = parser.parse_args(arguments)
+    if arguments.denoise:
+        arguments.parameters = dict(arguments.parameters, denoise=arguments.parameters.get("denoise") or True)
+    startupTime = time.time() - processStartTime
+    print("Startup: %.3f seconds" % startupTime)
+
+    if arguments.jobs or arguments.scene:
+        if arguments.jobs:
+            with open(arguments.jobs) as f:
+                jobs = json.load(f)
+            if isinstance(jobs, dict):
+                jobs = [dict(jobs.get("defaults", {}), **job) for job in jobs["jobs"]]
+            directory = os.path.dirname(os.path.abspath(arguments.jobs))
+        else:
+            if arguments.output is None:
+                parser.error("--output is required with a scene file")
+            jobs = [{"scene": arguments.scene, "output": arguments.output, "width": arguments.width, "height": arguments.height,
+                     "parameters": arguments.parameters, "renderer": arguments.renderer, "workers": arguments.workers,
+                     "profile": arguments.profile, "heatmap": arguments.heatmap, "heatmapTileSize": arguments.heatmap_tile_size,
+                     "outOfCore": arguments.out_of_core, "framebuffer": arguments.framebuffer, "framebufferType": arguments.framebuffer_type,
+                     "auxiliary": arguments.auxiliary}]
+            if arguments.animation:
+                jobs[0]["animation"] = arguments.animation
+            directory = "."
+
+        reports = runJobs(jobs, directory)
+        totalTime = time.time() - processStartTime
+        renderTime = sum(report["render"] for report in reports)
+        print("%d jobs in %.3f seconds: startup %.3fs, render %.3fs, overhead %.3fs" % (
+            len(reports), totalTime, startupTime, renderTime, totalTime - startupTime - renderTime))
+        if arguments.report:
+            with open(arguments.report, "w") as f:
+                json.dump({"startup": startupTime, "total": totalTime, "jobs": reports}, f, indent=4)
+        return
+
+    if arguments.out_of_core:
+        if arguments.output is None:
+            parser.error("--output is required with --out-of-core")
+        warnOutOfCore(arguments.parameters, {"auxiliary": arguments.auxiliary, "profile": arguments.profile, "heatmap": arguments.heatmap})
+        _framebuffer, renderTime = renderOutOfCore(arguments.output, (arguments.width, arguments.height), FOVP, (objects, light, skyDiffuse, camera),
+                                                   dict(parameters, **arguments.parameters), arguments.workers,
+                                                   arguments.framebuffer, arguments.framebuffer_type)
+        print("Render finished! It tooks ", renderTime, "seconds.")
+        return
+
+    if arguments.profile or arguments.heatmap:
+        image, renderTime, _profiler = renderProfiled(arguments.renderer, (arguments.width, arguments.height), FOVP, (objects, light, skyDiffuse, camera),
+                                                      dict(parameters, **arguments.parameters), arguments.profile, arguments.heatmap,
+                                                      arguments.auxiliary, arguments.heatmap_tile_size)
+    else:
+        image, renderTime = renderWith(arguments.renderer, (arguments.width, arguments.height), FOVP, (objects, light, skyDiffuse, camera),
+                                       dict(parameters, **arguments.parameters), arguments.workers, arguments.auxiliary)
+    print("Render finished! It tooks ", renderTime, "seconds.")
+    if arguments.output:
+        writeImage(arguments.output, image)
+    else:
+        saveImage(image, arguments.width, arguments.height)
+
+
 # Main Script=============================================================================================================================
-parameters = {"maxReflections": 0, "indirectLightingMaxBounces": 0, "indirectLightingSamples": 0, "Lighting": "Direct"}
+parameters = dict(defaultParameters)
 
 width, height = 480, 360
 maxDepth = 3
+batchRender = True # trace all the rays as NumPy arrays (renderBatch) instead of pixel by pixel
+renderWorkers = 1 # more than 1: render tiles on a pool of processes (renderParallel)
 
 camera = {"position": Vector(0, 0, .8), "direction": Vector(0, 0, 0)}
 FOVP = 1
@@ -116,8 +464,4 @@ image = np.zeros((height, width, 3))
 
 # Main loop
 if __name__ == "__main__":
-
-    render, time = render((width, height), FOVP, (objects, light, skyDiffuse, camera), parameters)
-    print("Render finished! It tooks ",time, "seconds.")
-    saveImage(render, width, height)
-
+    main()
@@ -0,0 +1,203 @@
+import os
+import time
+import zlib
+import struct
+import numpy as np
+
+from shaders_class import shadeNearestArray
+from sampling import useStream, needsRandom
+
+
+# Camera rays ===========================================================================================================================
+
+def screenBounds(dimensions: tuple):
+    """Returns (left, top, right, bottom) of the screen plane, the same bounds render() uses"""
+    ratio = float(dimensions[0]) / dimensions[1]
+    return (-1, 1/ratio, 1, -1/ratio)
+
+
+def cameraBasis(camera: dict):
+    """Rotation (3, 3) from the camera space (x right, y up, looking towards -z) to the scene, its columns are the right,
+    up and backward directions of the camera.
+    camera: dict(position, direction), direction: where the camera looks, (0, 0, 0) for -z (the default).
+        With a "target" point instead, the camera looks at it. The camera stays upright (y up).
+    Returns None if the camera looks towards -z (no rotation)
+    """
+    direction = camera["target"] - camera["position"] if "target" in camera else camera["direction"]
+    forward = np.asarray(direction.toArray(), dtype=float)
+    length = np.linalg.norm(forward)
+    if length == 0 or (forward[0] == 0 and forward[1] == 0 and forward[2] < 0):
+        return None
+    forward /= length
+    # looking straight down (up): the top of the image is towards -z (+z), as a camera tilted from -z
+    worldUp = np.array((0, 1, 0)) if abs(forward[1]) < 1 - 1e-9 else np.array((0, 0, forward[1]))
+    right = np.cross(forward, worldUp)
+    right /= np.linalg.norm(right)
+    return np.stack((right, np.cross(right, forward), -forward), axis=1)
+
+
+def pixelRays(rows, columns, dimensions: tuple, FOV: int, camera: dict):
+    """rows, columns: arrays of pixel coordinates, they can be fractional for sub-pixel samples
+    Returns the rays origin (3,) and their normalized directions (N, 3), turned as the camera (see cameraBasis)
+    """
+    screen = screenBounds(dimensions)
+    x = screen[0] + np.asarray(columns, dtype=float) * (screen[2] - screen[0]) / max(dimensions[0] - 1, 1)
+    y = screen[1] + np.asarray(rows, dtype=float) * (screen[3] - screen[1]) / max(dimensions[1] - 1, 1)
+
+    origin = camera["position"].toArray()
+    directions = np.stack((x, y, np.full(x.shape, -float(FOV))), axis=-1)
+    basis = cameraBasis(camera)
+    if basis is not None:
+        directions = directions @ basis.T
+    directions /= np.linalg.norm(directions, axis=-1)[..., None]
+
+    return origin, directions
+
+
+def finishColors(colors):
+    """Same post-process as render(): gamma then clip between 0 and 1"""
+    gamma = 1
+    return np.clip(colors ** gamma, 0, 1)
+
+
+# Batch render ==========================================================================================================================
+
+def shadeRays(rayOrigins, rayDirections, worldInfos: tuple, parameters: dict, objects=None):
+    """Shades primary rays (arrays) and returns their final colors (N, 3)
+    objects: the only objects the primary rays can hit (default: all), the shading still sees all of them
+    """
+    return finishColors(shadeNearestArray(rayOrigins, rayDirections, worldInfos, parameters, "all", objects=objects))
+
+
+def shadePixels(rows, columns, dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, chunkSize: int = 65536, objects=None):
+    """Traces one ray through each (row, column) pixel coordinate and returns the colors (N, 3)
+    chunkSize: maximum number of primary rays traced together (bounds the memory used)
+    objects: see shadeRays
+    """
+    origin, directions = pixelRays(rows, columns, dimensions, FOV, worldInfos[3])
+
+    colors = np.empty(directions.shape)
+    for start in range(0, len(directions), chunkSize):
+        end = start + chunkSize
+        colors[start:end] = shadeRays(origin, directions[start:end], worldInfos, parameters, objects)
+    return colors
+
+
+def splitTiles(dimensions: tuple, tileSize: int):
+    """Splits the image in square tiles: list of (rowStart, rowEnd, columnStart, columnEnd)"""
+    width, height = dimensions
+    return [
+        (row, min(row + tileSize, height), column, min(column + tileSize, width))
+        for row in range(0, height, tileSize)
+        for column in range(0, width, tileSize)
+    ]
+
+
+def renderBatch(dimensions: tuple, FOV: int, worldInfos: tuple, parameters: dict, chunkSize: int = 65536, tileSize: int = 32):
+    """Same as render() but traces the rays as NumPy arrays instead of one pixel at a time.
+    chunkSize: maximum number of primary rays traced together (bounds the memory used)
+    If the render draws random numbers, the image is traced tile by tile (tileSize) with the random stream of each tile,
+    as parallel_render.renderTile: the image is the same as renderParallel with the same seed and tileSize.
+    """
+    actualTime = time.time()
+
+    width, height = dimensions
+    seed = parameters.get("seed", 0)
+    if not needsRandom(parameters, worldInfos[1]):
+        rows, columns = np.divmod(np.arange(width * height), width)
+        with useStream(seed, 0, 0):
+            colors = shadePixels(rows, columns, dimensions, FOV, worldInfos, parameters, chunkSize)
+        return colors.reshape((height, width, 3)), time.time() - actualTime
+
+    image = np.empty((height, width, 3))
+    for rowStart, rowEnd, columnStart, columnEnd in splitTiles(dimensions, tileSize):
+        rows, columns = np.mgrid[rowStart:rowEnd, columnStart:columnEnd]
+        with useStream(seed, rowStart, columnStart):
+            colors = shadePixels(rows.ravel(), columns.ravel(), dimensions, FOV, worldInfos, parameters, chunkSize)
+        image[rowStart:rowEnd, columnStart:columnEnd] = colors.reshape((rowEnd - rowStart, columnEnd - columnStart, 3))
+    return image, time.time() - actualTime
+
+
+# Output ================================================================================================================================
+
+def toBytes(colors):
+    """Colors between 0 and 1 as 8 bits per channel, truncated (as matplotlib's imsave)"""
+    return (np.clip(colors, 0, 1) * 255).astype(np.uint8)
+
+
+class PNGWriter:
+
+    def __init__(self, path: str, width: int, height: int, compression: int = 6):
+        """PNG file (8 bits RGB) written a few rows at a time, in order from the top (writeRows),
+        the rows are compressed as they come: only the rows given to writeRows are in memory
+        """
+        self.path = path
+        self.width, self.height = width, height
+        self.rowsWritten = 0
+        self._previous = np.zeros((1, width * 3), dtype=np.uint8)
+        self._compressor = zlib.compressobj(compression)
+        self._file = open(path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)) + kind + data)
+        self._file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def writeRows(self, rows):
+        """rows: array (n, width, 3), uint8 or colors between 0 and 1 (see toBytes)"""
+        if rows.dtype != np.uint8:
+            rows = toBytes(rows)
+        rows = rows.reshape((len(rows), self.width * 3))
+        if self.rowsWritten + len(rows) > self.height:
+            raise ValueError("More rows than the height of the image")
+        # "up" filter: each row is stored as its difference with the row above it (compresses better)
+        differences = rows - np.concatenate((self._previous, rows[:-1]))
+        self._previous = rows[-1:]
+        filtered = np.concatenate((np.full((len(rows), 1), 2, dtype=np.uint8), differences), axis=1)
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rowsWritten += len(rows)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.rowsWritten != self.height:
+            self.abort()
+            raise ValueError("%d rows written instead of %d" % (self.rowsWritten, self.height))
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def abort(self):
+        """Closes and deletes the unfinished file (render interrupted)"""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __exit__(self, *exception):
+        if exception[0] is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def writePNG(path: str, image, rowsPerChunk: int = 256):
+    """Writes an image (height, width, 3) with values between 0 and 1 (or uint8) as a PNG file, a band of rows at a time"""
+    with PNGWriter(path, image.shape[1], image.shape[0]) as writer:
+        for start in range(0, image.shape[0], rowsPerChunk):
+            writer.writeRows(np.asarray(image[start:start + rowsPerChunk]))
+
+
+def writeImage(path: str, image):
+    """Writes an image (height, width, 3) with values between 0 and 1, PNG files without matplotlib (writePNG)"""
+    if path.lower().endswith(".png"):
+        writePNG(path, image)
+        return
+    import matplotlib.pyplot as plt
+
+    plt.imsave(path, np.clip(image, 0, 1))
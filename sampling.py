@@ -0,0 +1,129 @@
+import numpy as np
+from contextlib import contextmanager
+
+
+# Counter based random numbers ==========================================================================================================
+
+def hashUniform(keys, dimension: int = 0, seed: int = 0):
+    """Deterministic pseudo random numbers in [0, 1) from integer keys (arrays), one per key, dimension and seed.
+    The same pixel and sample always get the same number, however the image is split in tiles.
+    """
+    offset = np.uint64((dimension * 0x632BE59BD9B4E019 + seed * 0xD1B54A32D192ED03 + 1) % (1 << 64))
+    x = np.asarray(keys, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15) + offset
+    # splitmix64 finalizer
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(float) / float(1 << 53)
+
+
+# Low discrepancy sequences =============================================================================================================
+
+def radicalInverse(indices, base: int):
+    """Van der Corput sequence: digits of the index in base mirrored around the decimal point"""
+    indices = np.asarray(indices, dtype=np.int64).copy()
+    result = np.zeros(indices.shape)
+    factor = 1 / base
+    while indices.any():
+        indices, digits = np.divmod(indices, base)
+        result += digits * factor
+        factor /= base
+    return result
+
+
+def sobol2D(indices, scramble=None):
+    """First 2 dimensions of the Sobol sequence (32 bits) for the indices (array)
+    scramble: integers (uint32) XORed with the points (random digital shift), the points stay a (0, m, 2)-net
+    Returns u1, u2 in [0, 1)
+    """
+    indices = np.asarray(indices, dtype=np.uint64)
+    u1 = np.zeros(indices.shape, dtype=np.uint64)
+    u2 = np.zeros(indices.shape, dtype=np.uint64)
+    direction1, direction2 = 1 << 31, 1 << 31
+    bit = 0
+    while (indices >> np.uint64(bit)).any() and bit < 32:
+        bitSet = ((indices >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+        u1[bitSet] ^= np.uint64(direction1)
+        u2[bitSet] ^= np.uint64(direction2)
+        # dimension 1: bits reversed, dimension 2: Pascal matrix mod 2
+        direction1 >>= 1
+        direction2 ^= direction2 >> 1
+        bit += 1
+    if scramble is not None:
+        u1 ^= np.asarray(scramble[0], dtype=np.uint64)
+        u2 ^= np.asarray(scramble[1], dtype=np.uint64)
+    return u1.astype(float) / 2.0 ** 32, u2.astype(float) / 2.0 ** 32
+
+
+# Random streams ========================================================================================================================
+
+def streamGenerator(seed: int = 0, *key):
+    """Independent generator for a part of the render (key: integers, for example the first pixel of a tile).
+    The same seed and key always give the same numbers, in any process.
+    """
+    return np.random.default_rng(np.random.SeedSequence(int(seed), spawn_key=tuple(int(value) for value in key)))
+
+
+# Generator used by the samplers, replaced for each tile / pixel by useStream
+_generator = streamGenerator(0)
+
+
+def generator():
+    return _generator
+
+
+def setStream(seed: int = 0, *key):
+    """Makes the samplers use streamGenerator(seed, *key), returns the previous generator"""
+    global _generator
+    previous, _generator = _generator, streamGenerator(seed, *key)
+    return previous
+
+
+@contextmanager
+def useStream(seed: int = 0, *key):
+    """with useStream(seed, rowStart, columnStart): the samplers use this stream inside the block"""
+    global _generator
+    previous = setStream(seed, *key)
+    try:
+        yield _generator
+    finally:
+        _generator = previous
+
+
+def needsRandom(parameters: dict, light=None):
+    """True if a render with these parameters and lights draws random numbers
+    (indirect lighting, ambient occlusion, light sampling, area lights, russian roulette)
+    """
+    samples = parameters.get("indirectLightingSamples", 0) > 0
+    indirect = parameters.get("indirectLightingMaxBounces", 0) > 0 and parameters.get("Lighting", "Direct") != "Direct"
+    lightSampling = parameters.get("lightSamples", 0) > 0 or bool(getattr(light, "isRandom", False))
+    roulette = parameters.get("russianRoulette", 0) > 0 and parameters.get("maxReflections", 0) > 0
+    return (samples and (indirect or bool(parameters.get("ambientOcclusion")))) or lightSampling or roulette
+
+
+# Samples ===============================================================================================================================
+
+def unitSquareSamples(count: int, samples: int, sequence: str = "random"):
+    """samples points of the unit square for each of count points: u1, u2 arrays (count, samples)
+    sequence:
+        "random": latin hypercube, each row and each column of a samples x samples grid gets one sample
+        "sobol": scrambled Sobol points, stratified in 2D for any power of 2 of samples
+        "halton": Halton points (bases 2, 3) shifted by a random amount for each point
+    All of them use the current stream (useStream), so they are reproducible.
+    """
+    rng = _generator
+    if sequence == "random":
+        strata = np.argsort(rng.random((2, count, samples)), axis=2)
+        u1, u2 = (strata + rng.random((2, count, samples))) / samples
+    elif sequence == "sobol":
+        scramble = rng.integers(0, 1 << 32, size=(2, count, 1), dtype=np.uint64)
+        u1, u2 = sobol2D(np.broadcast_to(np.arange(samples), (count, samples)), scramble)
+    elif sequence == "halton":
+        shift = rng.random((2, count, 1))
+        u1 = (radicalInverse(np.arange(samples), 2) + shift[0]) % 1
+        u2 = (radicalInverse(np.arange(samples), 3) + shift[1]) % 1
+    else:
+        raise ValueError("Unknown sample sequence: %s" % sequence)
+    return u1, u2
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+
+from Vector import Vector
+from objects_class import *
+from shaders_class import *
+from textures_class import *
+from bvh_class import ObjectBVH
+from packed_scene import PackedScene
+from lights_class import PointLight, SpotLight, AreaLight, Lights
+
+
+# Classes that can be used in a scene file with {"type": "ClassName", argument: value...}
+sceneClasses = {cls.__name__: cls for cls in (
+    Sphere, Plane, Triangle, ImportedOBJ,
+    DefaultShader, DiffuseShader,
+    SquareTexture, TextureValue, ImageTexture,
+    PointLight, SpotLight, AreaLight,
+)}
+
+defaultParameters = {"maxReflections": 0, "indirectLightingMaxBounces": 0, "indirectLightingSamples": 0, "Lighting": "Direct",
+                     "minSamples": 1, "maxSamples": 1, "aaThreshold": 0.05, "samplePattern": "stratified",
+                     "seed": 0, "sampleSequence": "random", "irradianceCache": False,
+                     "shadowCache": False, "tileCulling": True, "lightSamples": 0, "denoise": False}
+
+
+def buildValue(value, directory: str):
+    """Converts a value of a scene file:
+    [x, y, z] -> Vector
+    {"type": "ClassName", ...} -> ClassName(...) with the other keys as arguments
+    other dicts and lists are converted item by item
+    """
+    if isinstance(value, list):
+        if len(value) == 3 and all(isinstance(item, (int, float)) for item in value):
+            return Vector(*value)
+        return [buildValue(item, directory) for item in value]
+
+    if isinstance(value, dict):
+        arguments = {key: buildValue(item, directory) for key, item in value.items() if key != "type"}
+        if "type" not in value:
+            return arguments
+        if value["type"] not in sceneClasses:
+            raise ValueError("Unknown type in scene file: %s" % value["type"])
+        if value["type"] in ("ImportedOBJ", "ImageTexture"):
+            arguments["path"] = os.path.join(directory, arguments["path"])
+        return sceneClasses[value["type"]](**arguments)
+
+    return value
+
+
+class Scene:
+
+    def __init__(self, description: dict, directory: str = "."):
+        """description: content of a scene file
+            objects: list of objects
+            light: dict(position, ambient, diffuse, specular) of a single point light
+            lights: list of lights (PointLight, SpotLight, AreaLight), instead of light
+            skyDiffuse: [red, green, blue]
+            camera: dict(position, direction)
+            FOV: Field Of View (default 1)
+            parameters: render parameters (optional, see render())
+            acceleration: "bvh" to put the objects in an ObjectBVH, "none" to keep a plain list,
+                else (default) they are packed in a PackedScene
+        directory: paths of the scene (OBJ files, images) are relative to it
+        """
+        loadTime = time.time()
+        self.objects = buildValue(description["objects"], directory)
+        if description.get("acceleration") == "bvh":
+            self.objects = ObjectBVH(self.objects)
+        elif description.get("acceleration") != "none":
+            self.objects = PackedScene(self.objects)
+        if "lights" in description:
+            self.light = Lights(buildValue(description["lights"], directory))
+        else:
+            self.light = buildValue(description["light"], directory)
+        self.skyDiffuse = buildValue(description["skyDiffuse"], directory)
+        self.camera = buildValue(description["camera"], directory)
+        self.FOV = description.get("FOV", 1)
+        self.parameters = dict(defaultParameters, **description.get("parameters", {}))
+        self.loadTime = time.time() - loadTime
+
+    @classmethod
+    def fromFile(cls, path: str):
+        with open(path) as f:
+            description = json.load(f)
+        return cls(description, os.path.dirname(os.path.abspath(path)))
+
+    def worldInfos(self, camera: dict = None):
+        """(objects, light, skyDiffuse, camera) tuple used by the renderers
+        camera: replaces the camera of the scene
+        """
+        return (self.objects, self.light, self.skyDiffuse, camera or self.camera)
+
+
+class SceneCache:
+    """Scenes already loaded by path, so that jobs on the same scene don't parse it (and rebuild its meshes) again.
+    A scene is reloaded if its file has changed.
+    """
+
+    def __init__(self):
+        self.scenes = {}
+
+    def load(self, path: str):
+        """Returns (scene, cached)"""
+        path = os.path.abspath(path)
+        modifiedTime = os.path.getmtime(path)
+        if path in self.scenes and self.scenes[path][0] == modifiedTime:
+            return self.scenes[path][1], True
+
+        scene = Scene.fromFile(path)
+        self.scenes[path] = (modifiedTime, scene)
+        return scene, False
@@ -1,14 +1,20 @@
 import math
 import numpy as np
-from random import random, uniform
 from copy import copy
 
 from objects_class import *
 from Vector import Vector
 from textures_class import *
+from sampling import unitSquareSamples, generator
+from lights_class import asLights
+from kernels import backend
 
 
 def nearestIntersectedObject(objects, rayOrigin, rayDirection):
+    if hasattr(objects, "nearestIntersected"):
+        # acceleration structure (ObjectBVH)
+        return objects.nearestIntersected(rayOrigin, rayDirection)
+
     distances = []
     normals = []
     for obj in objects:
@@ -27,52 +33,494 @@ def nearestIntersectedObject(objects, rayOrigin, rayDirection):
 
     return nearestObject, minDistance, normalToSurface
 
-# Indirect lighting functions  =======================================================================================================
 
-def DiffuseIndirectLightning(position, normal, worldInfos, parameters):
-    newParameters = copy(parameters)
-    newParameters["maxReflections"] = 0
-    newParameters["indirectLightingMaxBounces"] -= 1
-    newParameters["directLightingShadows"] = True
-    indirectLightning = Vector(0, 0, 0)
+def nearestIntersectedObjectArray(objects, rayOrigins, rayDirections):
+    """Batched nearestIntersectedObject
+    rayOrigins: array (N, 3) or (3,)
+    rayDirections: array (N, 3)
+    Returns the index of the nearest object for each ray (-1 if none), the distances and the normals
+    """
+    if hasattr(objects, "nearestIntersectedArray"):
+        return objects.nearestIntersectedArray(rayOrigins, rayDirections)
+
+    nearestObjects = np.full(len(rayDirections), -1)
+    minDistances = np.full(len(rayDirections), np.inf)
+    normalsToSurface = np.zeros(rayDirections.shape)
+    for i, obj in enumerate(objects):
+        distances, normals = obj.intersectArray(rayOrigins, rayDirections)
+        closer = (distances > 0) & (distances < minDistances)
+        nearestObjects[closer] = i
+        minDistances[closer] = distances[closer]
+        normalsToSurface[closer] = normals[closer]
+
+    return nearestObjects, minDistances, normalsToSurface
+
+
+def occluded(objects, rayOrigin, rayDirection, maxDistance):
+    """True if the ray hits an object closer than maxDistance (shadow rays)
+    Unlike nearestIntersectedObject, it stops at the first object found and doesn't compute normals.
+    """
+    if hasattr(objects, "occluded"):
+        return objects.occluded(rayOrigin, rayDirection, maxDistance)
+    if hasattr(objects, "nearestIntersected"):
+        # acceleration structure without any hit query
+        return objects.nearestIntersected(rayOrigin, rayDirection)[1] < maxDistance
 
-    for i in range(parameters["indirectLightingSamples"]):
-        # Generate random normalized vector in half sphere
-        randVector = Vector(uniform(-1, 1), uniform(-1, 1), uniform(0, 1)).normalize()
-
-        # Rotate vector by the normal
-        randVector = randVector.rotate(normal)
+    for obj in objects:
+        if obj.occludes(rayOrigin, rayDirection, maxDistance):
+            return True
+    return False
+
+
+def occludedArray(objects, rayOrigins, rayDirections, maxDistances):
+    """Batched occluded, returns bools (N,)"""
+    if hasattr(objects, "occludedArray"):
+        return objects.occludedArray(rayOrigins, rayDirections, maxDistances)
+    if hasattr(objects, "nearestIntersectedArray"):
+        return objects.nearestIntersectedArray(rayOrigins, rayDirections)[1] < maxDistances
+
+    isOccluded = np.zeros(len(rayDirections), dtype=bool)
+    rays = np.arange(len(rayDirections))
+    rayOrigins = np.broadcast_to(rayOrigins, rayDirections.shape)
+    maxDistances = np.broadcast_to(maxDistances, isOccluded.shape)
+    for obj in objects:
+        isOccluded[rays] = obj.occludesArray(rayOrigins[rays], rayDirections[rays], maxDistances[rays])
+        rays = rays[~isOccluded[rays]]
+        if not len(rays):
+            break
+    return isOccluded
+
+
+def shadowRaysArray(objects, lightPosition, points, normals, toLight, distances, parameters):
+    """occludedArray for the shadow rays of points (N, 3) toward a light (array (3,)).
+    With a VisibilityCache as shadowCache parameter, only the points the cache doesn't know are traced,
+    and their results are added to it.
+    """
+    cache = parameters.get("shadowCache")
+    if not hasattr(cache, "lookup"):
+        return occludedArray(objects, points, toLight, distances)
+
+    facing = dotArray(normals, toLight) > 0
+    isShadowed, known = cache.lookup(lightPosition, points, facing)
+    unknown = np.flatnonzero(~known)
+    if len(unknown):
+        isShadowed[unknown] = occludedArray(objects, points[unknown], toLight[unknown], distances[unknown])
+        cache.record(lightPosition, points[unknown], facing[unknown], isShadowed[unknown])
+    return isShadowed
+
+
+def nearestReflectedObject(objects, rayOrigin, rayDirection):
+    """nearestIntersectedObject of a reflection ray (the profiler counts them apart from the primary rays)"""
+    return nearestIntersectedObject(objects, rayOrigin, rayDirection)
+
+
+def nearestReflectedObjectArray(objects, rayOrigins, rayDirections):
+    """nearestIntersectedObjectArray of reflection rays"""
+    return nearestIntersectedObjectArray(objects, rayOrigins, rayDirections)
+
+
+def shadeNearestArray(rayOrigins, rayDirections, worldInfos, parameters, renderMode, returnDistances=False, objects=None):
+    """Traces a batch of rays and shades every hit with the shader of the object it hits, with its reflections.
+    Rays that hit nothing get the sky color.
+    objects: the only objects the rays can hit (see tile_culling.tileObjects), default: all the objects of worldInfos
+    Returns colors: array (N, 3), and the distances of the hits (np.inf if none) if returnDistances
+    """
+    if objects is None:
+        objects = worldInfos[0]
+    colors, minDistances = tracePathsArray(objects, rayOrigins, rayDirections, np.ones(len(rayDirections)), 0, worldInfos, parameters, renderMode)
+
+    if returnDistances:
+        return colors, minDistances
+    return colors
+
+
+# Path integrator ===================================================================================================================
+# The reflections are paths: each hit adds its own light (shader surface) times the throughput of the path, then the
+# path goes on in the reflected direction with its throughput multiplied by the reflection of the shader.
+
+def reflectedRays(rayDirections, intersections, normals):
+    """Reflection rays of hits (N, 3): origins moved a bit along the normals and mirrored directions"""
+    return intersections + normals * 1e-5, rayDirections - normals * 2 * dotArray(rayDirections, normals)[:, None]
+
+
+def _roulette(throughputs, parameters):
+    """Russian roulette: the paths with a throughput lower than the russianRoulette parameter are terminated at
+    random, the others go on with the throughput of the threshold (the mean of the image doesn't change)
+    Returns the paths kept and their throughputs
+    """
+    threshold = parameters.get("russianRoulette", 0)
+    if threshold <= 0:
+        return np.ones(len(throughputs), dtype=bool), throughputs
+    low = throughputs < threshold
+    kept = ~low | (generator().random(len(throughputs)) * threshold < throughputs)
+    return kept, np.where(low, threshold, throughputs)[kept]
+
+
+def tracePathsArray(objects, rayOrigins, rayDirections, throughputs, depth: int, worldInfos, parameters, renderMode, hits=None):
+    """Wavefront path integrator: the rays of every path are traced together, one reflection at a time,
+    the paths ending with the reflections of the shaders, maxReflections, or the russian roulette (see _roulette)
+    objects: the objects the first rays can hit, the reflections can hit all the objects of worldInfos
+    throughputs (N,): weight of each ray in its color, depth: number of reflections before these rays
+    hits: (nearestObjects, minDistances, normals) of the first rays when they are already known (indices in objects)
+    Returns the colors (N, 3) weighted by the throughputs, and the distances of the first hits (N,) (np.inf if none)
+    """
+    count = len(rayDirections)
+    colors = np.zeros((count, 3))
+    sky = worldInfos[2].toArray()
+    # index of the first ray of each path that is still traced
+    paths = np.arange(count)
+    rayOrigins = np.broadcast_to(rayOrigins, rayDirections.shape)
+    if hits is None:
+        nearest = nearestReflectedObjectArray if depth else nearestIntersectedObjectArray
+        hits = nearest(objects, rayOrigins, rayDirections)
+    nearestObjects, minDistances, normals = hits
+    firstDistances = minDistances
+
+    while True:
+        missed = nearestObjects < 0
+        colors[paths[missed]] += throughputs[missed, None] * sky
+
+        reflections = np.zeros(len(paths))
+        intersections = np.zeros(rayDirections.shape)
+        for i in np.unique(nearestObjects[~missed]):
+            hit = nearestObjects == i
+            intersections[hit] = rayOrigins[hit] + rayDirections[hit] * minDistances[hit, None]
+            illumination, reflections[hit] = objects[i].surfaceArray(rayDirections[hit], intersections[hit], normals[hit], worldInfos, parameters, renderMode)
+            colors[paths[hit]] += throughputs[hit, None] * illumination
+
+        depth += 1
+        bounce = np.flatnonzero(reflections > 0) if depth <= parameters["maxReflections"] else np.zeros(0, dtype=int)
+        kept, keptThroughputs = _roulette(throughputs[bounce] * reflections[bounce], parameters)
+        bounce = bounce[kept]
+        if not len(bounce):
+            return colors, firstDistances
+
+        paths, throughputs = paths[bounce], keptThroughputs
+        rayOrigins, rayDirections = reflectedRays(rayDirections[bounce], intersections[bounce], normals[bounce])
+        objects = worldInfos[0]
+        nearestObjects, minDistances, normals = nearestReflectedObjectArray(objects, rayOrigins, rayDirections)
+
+
+def reflectionsArray(rayDirections, intersections, normals, reflections, worldInfos, parameters, renderMode):
+    """Light coming back along the reflection rays of shaded hits (N, 3) that reflect reflections (N,) of it
+    (depth 0, see tracePathsArray)
+    """
+    colors = np.zeros(intersections.shape)
+    bounce = np.flatnonzero(reflections > 0) if parameters["maxReflections"] > 0 else np.zeros(0, dtype=int)
+    kept, throughputs = _roulette(reflections[bounce], parameters)
+    bounce = bounce[kept]
+    if len(bounce):
+        origins, directions = reflectedRays(rayDirections[bounce], intersections[bounce], normals[bounce])
+        colors[bounce] = tracePathsArray(worldInfos[0], origins, directions, throughputs, 1, worldInfos, parameters, renderMode)[0]
+    return colors
+
+
+def tracePath(rayDirection, intersection, normal, reflection: float, worldInfos, parameters, renderMode):
+    """tracePathsArray of one path (Vectors), from a hit that reflects reflection of the light (depth 0)
+    Returns the light coming back along the reflected rays, weighted by their throughputs
+    """
+    objects, backgroundColor = worldInfos[0], worldInfos[2]
+    color = Vector(0, 0, 0)
+    throughput, depth = reflection, 0
+    threshold = parameters.get("russianRoulette", 0)
+    while throughput > 0 and depth < parameters["maxReflections"]:
+        if throughput < threshold:
+            if generator().random() * threshold >= throughput:
+                break
+            throughput = threshold
 
-        # Calculate ray (with position=shiftedPoint)
-        nearestObject, minDistance, objectNormal = nearestIntersectedObject(worldInfos[0], position, randVector)
+        shiftedPoint = intersection + normal * 1e-5
+        rayDirection = rayDirection - normal * 2 * Vector.dotProduct(rayDirection, normal)
+        nearestObject, minDistance, normal = nearestReflectedObject(objects, shiftedPoint, rayDirection)
         if nearestObject is None:
-            indirectLightning += worldInfos[2]
-        else:
-            intersection = position + randVector * minDistance
-            illumination = nearestObject.shader(randVector, intersection, worldInfos, newParameters, "diffuse")
+            return color + backgroundColor * throughput
+
+        intersection = shiftedPoint + rayDirection * minDistance
+        illumination, reflection = nearestObject.surface(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
+        color += illumination * throughput
+        throughput *= reflection
+        depth += 1
+    return color
 
-            intersectionToLight = Vector.normalize(worldInfos[1]["position"]- (intersection + normal * 1e-5))
-            indirectLightning += illumination * math.cos(Vector.dotProduct(intersectionToLight, objectNormal))
 
-    indirectLightning /= parameters["indirectLightingSamples"]
-    return indirectLightning
+def dotArray(a, b):
+    return np.einsum("ij,ij->i", *np.broadcast_arrays(a, b))
 
 
-def ambientOcclusion(position, normal, worldInfos, parameters):
-    aoFactor = 0
+def normalizeArray(a):
+    return a / np.linalg.norm(a, axis=-1)[..., None]
 
-    for i in range(parameters["indirectLightingSamples"]):
-        # Generate random normalized vector in half sphere
-        randVector = Vector(uniform(-1, 1), uniform(-1, 1), uniform(0, 1)).normalize()
+# Indirect lighting functions  =======================================================================================================
 
-        # Rotate vector by the normal
-        randVector = randVector.rotate(normal)
+# Maximum number of indirect rays traced together (bounds the memory used)
+indirectPacketSize = 65536
+
+
+def orthonormalBasis(normals):
+    """Two tangents (N, 3) perpendicular to the normals (N, 3) and to each other, without branches or trigonometry
+    (Duff et al. 2017, "Building an Orthonormal Basis, Revisited")
+    """
+    x, y, z = normals[:, 0], normals[:, 1], normals[:, 2]
+    sign = np.where(z >= 0, 1.0, -1.0)
+    a = -1 / (sign + z)
+    b = x * y * a
+    tangents = np.stack((1 + sign * x * x * a, sign * b, -sign * x), axis=1)
+    bitangents = np.stack((b, sign + y * y * a, -y), axis=1)
+    return tangents, bitangents
+
+
+def cosineHemisphereArray(normals, samples: int, sequence: str = "random"):
+    """samples directions around each normal (N, 3), with a probability proportional to the cosine with the normal
+    sequence: "random", "sobol" or "halton" (see sampling.unitSquareSamples)
+    Returns directions (N, samples, 3)
+    """
+    u1, u2 = unitSquareSamples(len(normals), samples, sequence)
+
+    # uniform point on the unit disk projected on the hemisphere (Malley's method)
+    radius, angle = np.sqrt(u1), 2 * math.pi * u2
+    x, y, z = radius * np.cos(angle), radius * np.sin(angle), np.sqrt(np.maximum(1 - u1, 0))
+
+    tangents, bitangents = orthonormalBasis(normals)
+    return x[..., None] * tangents[:, None] + y[..., None] * bitangents[:, None] + z[..., None] * normals[:, None]
+
+
+def _orientedPoints(positions, normals, rayDirections=None):
+    """Normalized normals turned to the side of the rays that hit the points (if given),
+    and the points moved a bit along them, so that the rays traced from them don't hit their own surface
+    Returns (origins, normals)
+    """
+    normals = normalizeArray(normals)
+    if rayDirections is not None:
+        normals = np.where((dotArray(normals, rayDirections) > 0)[:, None], -normals, normals)
+    return positions + normals * 1e-5, normals
+
+
+def _hemispherePackets(origins, normals, samples: int, sequence: str):
+    """Splits the points in packets of at most indirectPacketSize rays, yields (points, origins, directions)"""
+    pointsPerPacket = max(indirectPacketSize // samples, 1)
+    for start in range(0, len(origins), pointsPerPacket):
+        points = slice(start, start + pointsPerPacket)
+        directions = cosineHemisphereArray(normals[points], samples, sequence)
+        yield points, np.repeat(origins[points], samples, axis=0), directions.reshape((-1, 3))
+
+
+def _indirectSamples(origins, normals, worldInfos, parameters):
+    """Traces the indirect lighting samples of oriented points (see _orientedPoints)
+    Returns the lighting (N, 3) and the harmonic mean distance of the objects hit by the samples (N,)
+    """
+    samples = parameters["indirectLightingSamples"]
+    newParameters = copy(parameters)
+    newParameters["maxReflections"] = 0
+    newParameters["indirectLightingMaxBounces"] -= 1
 
-        # Calculate distance from nearest object
-        a, minDistance, a = nearestIntersectedObject(worldInfos[0], position, randVector)
+    lighting = np.zeros(origins.shape)
+    distances = np.empty(len(origins))
+    for points, packetOrigins, directions in _hemispherePackets(origins, normals, samples, parameters.get("sampleSequence", "random")):
+        colors, hitDistances = shadeNearestArray(packetOrigins, directions, worldInfos, newParameters, "diffuse", True)
+        lighting[points] = colors.reshape((-1, samples, 3)).mean(axis=1)
+        with np.errstate(divide="ignore"):
+            distances[points] = samples / (1 / hitDistances.reshape((-1, samples))).sum(axis=1)
+    return lighting, distances
+
+
+def _cachedIndirectLighting(origins, normals, worldInfos, parameters, cache):
+    """indirectLightingArray with an irradiance cache: the lighting is computed at a few points only (records)
+    and interpolated at the others. The points without records around them are filled in rounds: one point
+    per cell of a grid is computed, then the grid is halved, until the cells are smaller than the smallest record.
+    """
+    lighting, found = cache.lookup(origins, normals)
+    spacing = cache.error * cache.maxRadius
+    while not found.all():
+        missing = np.flatnonzero(~found)
+        if spacing > cache.error * cache.minRadius:
+            cells = np.floor(origins[missing] / spacing).astype(np.int64)
+            missing = missing[np.unique(cells, axis=0, return_index=True)[1]]
+        computed, distances = _indirectSamples(origins[missing], normals[missing], worldInfos, parameters)
+        cache.insert(origins[missing], normals[missing], computed, distances)
+        lighting[missing], found[missing] = computed, True
+
+        others = np.flatnonzero(~found)
+        lighting[others], found[others] = cache.lookup(origins[others], normals[others])
+        spacing /= 2
+    return lighting
+
+
+def indirectLightingArray(positions, normals, worldInfos, parameters, rayDirections=None):
+    """Diffuse light coming from the other objects and the sky at each point (N, 3), normals: (N, 3)
+    indirectLightingSamples rays are traced from each point, with cosine weighted directions: the average of
+    their colors is the light a diffuse surface receives. Their hits are shaded in "diffuse" mode with one bounce less.
+    The directions come from the sequence sampleSequence (parameter, default "random") and the current sampling stream.
+    With an IrradianceCache as irradianceCache parameter, the lighting is interpolated from the records of the cache.
+    rayDirections: rays that hit the points (optional), the samples are traced on their side of the surface
+    Returns the lighting of each point (N, 3), to multiply by the diffuse color
+    """
+    if parameters["indirectLightingSamples"] <= 0 or not len(positions):
+        return np.zeros(positions.shape)
+
+    origins, normals = _orientedPoints(positions, normals, rayDirections)
+    cache = parameters.get("irradianceCache")
+    if hasattr(cache, "lookup") and cache.usable(parameters["indirectLightingMaxBounces"]):
+        return _cachedIndirectLighting(origins, normals, worldInfos, parameters, cache)
+    return _indirectSamples(origins, normals, worldInfos, parameters)[0]
+
+
+def ambientOcclusionArray(positions, normals, worldInfos, parameters, rayDirections=None):
+    """Fraction of the hemisphere (cosine weighted) of each point that isn't hidden by an object closer than
+    aoDistance (parameter, default: infinite). Returns an array (N,) between 0 (occluded) and 1 (open)
+    """
+    samples = parameters["indirectLightingSamples"]
+    if samples <= 0 or not len(positions):
+        return np.ones(len(positions))
+
+    visibility = np.empty(len(positions))
+    maxDistance = parameters.get("aoDistance", np.inf)
+    origins, normals = _orientedPoints(positions, normals, rayDirections)
+    for points, packetOrigins, directions in _hemispherePackets(origins, normals, samples, parameters.get("sampleSequence", "random")):
+        isOccluded = occludedArray(worldInfos[0], packetOrigins, directions, np.full(len(directions), maxDistance))
+        visibility[points] = 1 - isOccluded.reshape((-1, samples)).mean(axis=1)
+    return visibility
+
+
+def DiffuseIndirectLightning(position, normal, worldInfos, parameters, rayDirection=None):
+    """indirectLightingArray of one point (Vectors), its samples are traced as one packet"""
+    rayDirections = None if rayDirection is None else rayDirection.toArray()[None]
+    lighting = indirectLightingArray(position.toArray()[None], normal.toArray()[None], worldInfos, parameters, rayDirections)[0]
+    return Vector(*lighting.tolist())
+
+
+def ambientOcclusion(position, normal, worldInfos, parameters, rayDirection=None):
+    """ambientOcclusionArray of one point (Vectors)"""
+    rayDirections = None if rayDirection is None else rayDirection.toArray()[None]
+    return float(ambientOcclusionArray(position.toArray()[None], normal.toArray()[None], worldInfos, parameters, rayDirections)[0])
+
+
+
+# Direct lighting functions  =========================================================================================================
+
+def directLightingArray(intersections, normals, worldInfos, parameters, shininess=None):
+    """Light received from the lights of worldInfos[1] (see lights_class.Lights) at each point (N, 3), with shadows
+    parameters:
+        lightSamples: 0 (default): one sample of every light, else number of shadow samples of each point:
+            the lights are chosen at random in proportion to their power, the cost doesn't depend on their number
+        shadowCache: see shadowRaysArray (lights with a fixed position only)
+    shininess: exponent of the highlights (DefaultShader), None without highlights
+    Returns:
+        diffuse (N, 3): sum of the samples, color * cosine / probability, unclipped like the single light of older scenes
+        visible (N,): False where every sample is shadowed
+        highlights (N, 3): sum of the samples times their highlight factor (normal . half vector) ** (shininess / 4)
+        highlightWeights (N,): mean highlight factor of the samples, for the lighting that doesn't come from them
+    """
+    objects, camera = worldInfos[0], worldInfos[3]
+    lights = asLights(worldInfos[1])
+    count = len(intersections)
+    diffuse, highlights = np.zeros((count, 3)), np.zeros((count, 3))
+    visible, highlightWeights = np.zeros(count, dtype=bool), np.zeros(count)
+    if not len(lights) or not count:
+        return diffuse, visible, highlights, highlightWeights
+
+    samples = parameters.get("lightSamples", 0)
+    sampleCount = samples if samples > 0 else len(lights)
+    shiftedPoints = intersections + normals * 1e-5
+    toCamera = None
+    if shininess is not None:
+        toCamera = normalizeArray(camera["position"].toArray() - intersections)
+
+    # objects all packed and no shadow cache: the backend traces the shadow rays and adds the samples in one kernel
+    packedRows = None
+    if hasattr(objects, "rows") and not objects.others and not hasattr(parameters.get("shadowCache"), "lookup"):
+        packedRows = objects.rows
+
+    # samples are traced in packets of at most indirectPacketSize rays, one sample of every point at a time
+    samplesPerPacket = max(indirectPacketSize // count, 1)
+    for start in range(0, sampleCount, samplesPerPacket):
+        packetSamples = min(samplesPerPacket, sampleCount - start)
+        if samples > 0:
+            indices, probabilities = lights.choose(generator().random(packetSamples * count))
+            weights = 1 / (probabilities * samples)
+        else:
+            indices = np.repeat(np.arange(start, start + packetSamples), count)
+            weights = np.ones(len(indices))
+        u1 = u2 = None
+        if lights.isRandom:
+            u1, u2 = generator().random((2, len(indices)))
+
+        points = np.tile(np.arange(count), packetSamples)
+        positions, colors = lights.sample(indices, intersections[points], u1, u2)
+        if packedRows is not None:
+            backend().directLighting(diffuse, visible, highlights, highlightWeights, shiftedPoints, intersections, normals, positions,
+                                     colors, weights, toCamera, shininess, sampleCount, packedRows)
+            continue
+        toLight = normalizeArray(positions - shiftedPoints[points])
+        distances = np.linalg.norm(positions - intersections[points], axis=1)
+
+        isShadowed = np.zeros(len(indices), dtype=bool)
+        fixed = lights.fixedPosition(indices)
+        if hasattr(parameters.get("shadowCache"), "lookup"):
+            # the cache has a table by light position
+            for light in np.unique(indices[fixed]):
+                rays = np.flatnonzero(indices == light)
+                isShadowed[rays] = shadowRaysArray(objects, lights.positions[light], shiftedPoints[points[rays]], normals[points[rays]],
+                                                   toLight[rays], distances[rays], parameters)
+            rays = np.flatnonzero(~fixed)
+        else:
+            rays = np.arange(len(indices))
+        if len(rays):
+            isShadowed[rays] = occludedArray(objects, shiftedPoints[points[rays]], toLight[rays], distances[rays])
+
+        # points is the same list of points for each sample of the packet
+        backend().accumulateLighting(diffuse, visible, highlights, highlightWeights, colors, weights, toLight, normals,
+                                     ~isShadowed, toCamera, shininess, sampleCount)
+
+    return diffuse, visible, highlights, highlightWeights
+
+
+def directLighting(intersection, normal, worldInfos, parameters, shininess=None):
+    """directLightingArray of one point (Vectors), each sample traces its shadow ray with occluded
+    Returns diffuse (Vector), visible (bool), highlights (Vector) and highlightWeight (float)
+    """
+    objects, camera = worldInfos[0], worldInfos[3]
+    lights = asLights(worldInfos[1])
+    diffuse, highlights = Vector(0, 0, 0), Vector(0, 0, 0)
+    visible, highlightWeight = False, 0.0
+    if not len(lights):
+        return diffuse, visible, highlights, highlightWeight
+
+    samples = parameters.get("lightSamples", 0)
+    if samples > 0:
+        indices, probabilities = lights.choose(generator().random(samples))
+        weights = 1 / (probabilities * samples)
+    else:
+        indices, weights = np.arange(len(lights)), np.ones(len(lights))
+    u1 = u2 = None
+    if lights.isRandom:
+        u1, u2 = generator().random((2, len(indices)))
+    positions, colors = lights.sample(indices, np.tile(intersection.toArray(), (len(indices), 1)), u1, u2)
+
+    shiftedPoint = intersection + normal * 1e-5
+    if shininess is not None:
+        toCamera = Vector.normalize(camera["position"] - intersection)
+    useCache = hasattr(parameters.get("shadowCache"), "lookup")
+    for k, light in enumerate(indices):
+        position = Vector(*positions[k].tolist())
+        toLight = Vector.normalize(position - shiftedPoint)
+        distance = Vector.length(position - intersection)
+        if useCache and lights.fixedPosition(light):
+            isShadowed = bool(shadowRaysArray(objects, lights.positions[light], shiftedPoint.toArray()[None], normal.toArray()[None],
+                                              toLight.toArray()[None], np.array([distance]), parameters)[0])
+        else:
+            isShadowed = occluded(objects, shiftedPoint, toLight, distance)
 
-    aoFactor = aoFactor / parameters["indirectLightingSamples"]
+        contribution = Vector(0, 0, 0)
+        if not isShadowed:
+            visible = True
+            contribution = Vector(*colors[k].tolist()) * (weights[k] * Vector.dotProduct(toLight, normal))
+            diffuse += contribution
+        if shininess is not None:
+            factor = Vector.dotProduct(normal, Vector.normalize(toLight + toCamera)) ** (shininess / 4)
+            highlights += contribution * factor
+            highlightWeight += factor / len(indices)
 
+    return diffuse, visible, highlights, highlightWeight
 
 
 # Basic shaders functions   ===========================================================================================================
@@ -99,65 +547,93 @@ class DefaultShader:
         self.reflection = reflection
 
     def calculate(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
-        
-        objects, light, backgroundColor, camera = worldInfos[0], worldInfos[1], worldInfos[2], worldInfos[3]
-
-        newParameters = copy(parameters)
-        newParameters["maxReflections"] -= 1
-        
+        """Color of a hit with its reflections (see tracePath)"""
+        illumination, reflection = self.surface(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
+        return illumination + tracePath(rayDirection, intersection, normal, reflection, worldInfos, parameters, renderMode)
 
-        shiftedPoint = intersection + normal * 1e-5
-        intersectionToLight = Vector.normalize(light["position"] - shiftedPoint)
-
-        _a, minDistance, _b = nearestIntersectedObject(objects, shiftedPoint, intersectionToLight)
-        intersectionToLightDistance = Vector.length(light["position"] - intersection)
-        isShadowed = minDistance < intersectionToLightDistance
+    def surface(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
+        """Light of a hit without its reflections, and the fraction of the reflected light it adds
+        Returns (illumination: Vector, reflection: float)
+        """
+        light = worldInfos[1]
+        direct, isLit, highlights, highlightWeight = directLighting(intersection, normal, worldInfos, parameters, self.shininess)
 
-        if parameters["Lighting"]=="Direct" and isShadowed:
-            return Vector(0, 0, 0)
+        if parameters["Lighting"]=="Direct" and not isLit:
+            return Vector(0, 0, 0), 0.0
 
         illumination = Vector(0, 0, 0)
 
         # Ambient
         if renderMode=="ambient"  or renderMode=="all":
-            illumination += self.ambient.getColor(intersection) * light["ambient"]
+            ambient = self.ambient.getColor(intersection) * asLights(light).ambient
+            if parameters.get("ambientOcclusion"):
+                ambient *= ambientOcclusion(intersection, normal, worldInfos, parameters, rayDirection)
+            illumination += ambient
 
         # Diffuse
         if renderMode=="diffuse" or renderMode=="all":
-            lighting = Vector(0, 0, 0)
-            if parameters["indirectLightingMaxBounces"]>0 and parameters["Lighting"]=="Indirect":
-                #lighting += DiffuseIndirectLightning(intersection, normal, worldInfos, newParameters)
-                lighting *= AmbientOcclusion(intersection, normal, worldInfos, newParameters)
+            indirect = Vector(0, 0, 0)
+            if parameters["indirectLightingMaxBounces"]>0 and parameters["Lighting"]!="Direct":
+                indirect = DiffuseIndirectLightning(intersection, normal, worldInfos, parameters, rayDirection)
 
-            if not(isShadowed) and parameters["Lighting"]=="Direct":
-                lighting += light["diffuse"] * Vector.dotProduct(intersectionToLight, normal)
+            lighting = indirect
+            if parameters["Lighting"]!="Indirect":
+                lighting = indirect + direct
+            else:
+                highlights = Vector(0, 0, 0)
 
             illumination += self.diffuse.getColor(intersection) * lighting 
 
         # Specular
         if renderMode=="specular"  or renderMode=="all":
-            intersectionToCamera = Vector.normalize(camera["position"] - intersection)
-            h = Vector.normalize(intersectionToLight + intersectionToCamera)
-            illumination += self.specular.getColor(intersection) * lighting * Vector.dotProduct(normal, h) ** (self.shininess / 4)
-
-        # Shadows
-        """if renderMode=="all":
-            if isShadowed:
-               illumination = illumination / 2
-        """
+            # each light sample makes its own highlight, the indirect lighting uses their mean
+            illumination += self.specular.getColor(intersection) * (indirect * highlightWeight + highlights)
+
+        return illumination, self.reflection
 
-        # Reflections
-        if parameters["maxReflections"]>0 and self.reflection>0:
-            direction = rayDirection - normal * 2 * Vector.dotProduct(rayDirection, normal)
-            nearestObject, minDistance, objectNormal = nearestIntersectedObject(objects, shiftedPoint, direction)
-            if nearestObject is None:
-                return illumination + backgroundColor * self.reflection
+    def calculateArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        """Batched calculate: rayDirections, intersections and normals are arrays (N, 3)"""
+        illumination, reflections = self.surfaceArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+        return illumination + reflectionsArray(rayDirections, intersections, normals, reflections, worldInfos, parameters, renderMode)
+
+    def surfaceArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        """Batched surface: returns illumination (N, 3) and reflection (N,)"""
+        light = worldInfos[1]
+        direct, isLit, highlights, highlightWeights = directLightingArray(intersections, normals, worldInfos, parameters, self.shininess)
+
+        illumination = np.zeros(intersections.shape)
+
+        # Ambient
+        if renderMode=="ambient"  or renderMode=="all":
+            ambient = self.ambient.getColorArray(intersections) * asLights(light).ambient.toArray()
+            if parameters.get("ambientOcclusion"):
+                ambient = ambient * ambientOcclusionArray(intersections, normals, worldInfos, parameters, rayDirections)[:, None]
+            illumination += ambient
+
+        # Diffuse
+        if renderMode=="diffuse" or renderMode=="all":
+            indirect = np.zeros(intersections.shape)
+            if parameters["indirectLightingMaxBounces"]>0 and parameters["Lighting"]!="Direct":
+                indirect = indirectLightingArray(intersections, normals, worldInfos, parameters, rayDirections)
+
+            lighting = indirect
+            if parameters["Lighting"]!="Indirect":
+                lighting = indirect + direct
             else:
-                intersection = shiftedPoint + direction * minDistance
-                reflectionColor = nearestObject._shader.calculate(direction, intersection, objectNormal, worldInfos, newParameters, renderMode)
-                return illumination + reflectionColor * self.reflection
-        else:
-            return illumination
+                highlights = np.zeros(intersections.shape)
+
+            illumination += self.diffuse.getColorArray(intersections) * lighting
+
+        # Specular
+        if renderMode=="specular"  or renderMode=="all":
+            # each light sample makes its own highlight, the indirect lighting uses their mean
+            illumination += self.specular.getColorArray(intersections) * (indirect * highlightWeights[:, None] + highlights)
+
+        reflections = np.full(len(intersections), float(self.reflection))
+        if parameters["Lighting"]=="Direct":
+            illumination[~isLit] = 0
+            reflections[~isLit] = 0
+        return illumination, reflections
 
 # Diffuse Shader
 class DiffuseShader:
@@ -172,59 +648,77 @@ class DiffuseShader:
         self.reflection = reflection
 
     def calculate(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
-        objects, light, backgroundColor, camera = worldInfos[0], worldInfos[1], worldInfos[2], worldInfos[3]
-
-        newParameters = copy(parameters)
-        newParameters["maxReflections"] -= 1
-        
-
-        shiftedPoint = intersection + normal * 1e-5
-        intersectionToLight = Vector.normalize(light["position"] - shiftedPoint)
+        """Color of a hit with its reflections (see tracePath)"""
+        illumination, reflection = self.surface(rayDirection, intersection, normal, worldInfos, parameters, renderMode)
+        return illumination + tracePath(rayDirection, intersection, normal, reflection, worldInfos, parameters, renderMode)
 
-        _a, minDistance, _b = nearestIntersectedObject(objects, shiftedPoint, intersectionToLight)
-        intersectionToLightDistance = Vector.length(light["position"] - intersection)
-        isShadowed = minDistance < intersectionToLightDistance
+    def surface(self, rayDirection, intersection, normal, worldInfos, parameters, renderMode):
+        """Light of a hit without its reflections, and the fraction of the reflected light it adds
+        Returns (illumination: Vector, reflection: float)
+        """
+        light = worldInfos[1]
+        direct, isLit, _highlights, _highlightWeight = directLighting(intersection, normal, worldInfos, parameters)
 
-        if parameters["Lighting"]=="Direct" and isShadowed:
-            return Vector(0, 0, 0)
+        if parameters["Lighting"]=="Direct" and not isLit:
+            return Vector(0, 0, 0), 0.0
 
         illumination = Vector(0, 0, 0)
 
         # Ambient
         if renderMode=="ambient"  or renderMode=="all":
-            illumination += self.ambient.getColor(intersection) * light["ambient"]
+            ambient = self.ambient.getColor(intersection) * asLights(light).ambient
+            if parameters.get("ambientOcclusion"):
+                ambient *= ambientOcclusion(intersection, normal, worldInfos, parameters, rayDirection)
+            illumination += ambient
 
         # Diffuse
         if renderMode=="diffuse" or renderMode=="all":
             lighting = Vector(0, 0, 0)
             if parameters["indirectLightingMaxBounces"]>0 and parameters["Lighting"]!="Direct":
-                #lighting += DiffuseIndirectLightning(intersection, normal, worldInfos, newParameters)
-                lighting *= AmbientOcclusion(intersection, normal, worldInfos, newParameters)
+                lighting += DiffuseIndirectLightning(intersection, normal, worldInfos, parameters, rayDirection)
 
-            if not(isShadowed) and parameters["Lighting"]!="Indirect":
-                lighting += light["diffuse"] * Vector.dotProduct(intersectionToLight, normal)
+            if parameters["Lighting"]!="Indirect":
+                lighting += direct
 
             illumination += self.diffuse.getColor(intersection) * lighting
 
-        # Shadows
-        """if renderMode=="all":
-            if isShadowed:
-               illumination = illumination / 2
-        """
+        return illumination, self.reflection
 
-        # Reflections
-        #print(parameters["maxReflections"])
-        if parameters["maxReflections"]>0 and self.reflection>0:
-            direction = rayDirection - normal * 2 * Vector.dotProduct(rayDirection, normal)
-            nearestObject, minDistance, objectNormal = nearestIntersectedObject(objects, shiftedPoint, direction)
-            if nearestObject is None:
-                return illumination + backgroundColor * self.reflection
-            else:
-                intersection = shiftedPoint + direction * minDistance
-                reflectionColor = nearestObject._shader.calculate(direction, intersection, objectNormal, worldInfos, newParameters, renderMode)
-                return illumination + reflectionColor * self.reflection
-        else:
-            return illumination
+    def calculateArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        """Batched calculate: rayDirections, intersections and normals are arrays (N, 3)"""
+        illumination, reflections = self.surfaceArray(rayDirections, intersections, normals, worldInfos, parameters, renderMode)
+        return illumination + reflectionsArray(rayDirections, intersections, normals, reflections, worldInfos, parameters, renderMode)
+
+    def surfaceArray(self, rayDirections, intersections, normals, worldInfos, parameters, renderMode):
+        """Batched surface: returns illumination (N, 3) and reflection (N,)"""
+        light = worldInfos[1]
+        direct, isLit, _highlights, _highlightWeights = directLightingArray(intersections, normals, worldInfos, parameters)
+
+        illumination = np.zeros(intersections.shape)
+
+        # Ambient
+        if renderMode=="ambient"  or renderMode=="all":
+            ambient = self.ambient.getColorArray(intersections) * asLights(light).ambient.toArray()
+            if parameters.get("ambientOcclusion"):
+                ambient = ambient * ambientOcclusionArray(intersections, normals, worldInfos, parameters, rayDirections)[:, None]
+            illumination += ambient
+
+        # Diffuse
+        if renderMode=="diffuse" or renderMode=="all":
+            lighting = np.zeros(intersections.shape)
+            if parameters["indirectLightingMaxBounces"]>0 and parameters["Lighting"]!="Direct":
+                lighting += indirectLightingArray(intersections, normals, worldInfos, parameters, rayDirections)
+
+            if parameters["Lighting"]!="Indirect":
+                lighting += direct
+
+            illumination += self.diffuse.getColorArray(intersections) * lighting
+
+        reflections = np.full(len(intersections), float(self.reflection))
+        if parameters["Lighting"]=="Direct":
+            illumination[~isLit] = 0
+            reflections[~isLit] = 0
+        return illumination, reflections
 
 # Glass Shader
 class GlassShader:
@@ -0,0 +1,16 @@
+import os
+import sys
+
+# the modules of the raytracer are at the root of the repository
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import pytest
+
+from scene_loader import Scene
+
+
+@pytest.fixture
+def defaultScene():
+    """scenes/default.json: spheres, a triangle and a textured plane, one point light, nothing random"""
+    return Scene.fromFile(os.path.join(root, "scenes", "default.json"))
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from Vector import Vector
+from objects_class import Sphere, Plane, Triangle, ImportedOBJ
+from shaders_class import DiffuseShader, nearestIntersectedObject, nearestIntersectedObjectArray, occluded, occludedArray
+from bvh_class import BVH, ObjectBVH
+from packed_scene import PackedScene
+
+
+shader = DiffuseShader(Vector(0.1, 0.1, 0.1), Vector(0.5, 0.5, 0.5), 0)
+
+
+def randomObjects(meshPath, seed=0):
+    rng = np.random.default_rng(seed)
+    objects = [Plane(Vector(0, 1, 0), 3, shader)]
+    for _ in range(15):
+        objects.append(Sphere(Vector(*rng.uniform(-2, 2, 3)), rng.uniform(0.1, 0.5), shader))
+        point = Vector(*rng.uniform(-2, 2, 3))
+        objects.append(Triangle(point, point + Vector(*rng.normal(size=3)), point + Vector(*rng.normal(size=3)), shader))
+    objects.append(ImportedOBJ(str(meshPath), Vector(0, 0, 0), 1, shader, cacheDirectory=str(meshPath.parent / ".meshcache")))
+    return objects
+
+
+def randomRays(count=400, seed=1):
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    return rng.uniform(-3, 3, (count, 3)), directions, rng.uniform(0.5, 4, count)
+
+
+@pytest.fixture
+def meshPath(tmp_path):
+    # octahedron
+    path = tmp_path / "octahedron.obj"
+    path.write_text("v 1.000000 0.000000 0.000000\nv -1.000000 0.000000 0.000000\nv 0.000000 1.000000 0.000000\n"
+                    "v 0.000000 -1.000000 0.000000\nv 0.000000 0.000000 1.000000\nv 0.000000 0.000000 -1.000000\n"
+                    "f 1 3 5\nf 3 2 5\nf 2 4 5\nf 4 1 5\nf 3 1 6\nf 2 3 6\nf 4 2 6\nf 1 4 6\n")
+    return path
+
+
+@pytest.mark.parametrize("structure", [ObjectBVH, PackedScene])
+def test_nearestHitsMatchBruteForce(meshPath, structure):
+    objects = randomObjects(meshPath)
+    accelerated = structure(objects)
+    origins, directions, _maxDistances = randomRays()
+
+    indices, distances, normals = nearestIntersectedObjectArray(objects, origins, directions)
+    foundIndices, foundDistances, foundNormals = nearestIntersectedObjectArray(accelerated, origins, directions)
+    assert (indices >= 0).sum() > len(indices) // 2
+    assert np.array_equal(foundIndices, indices)
+    hit = indices >= 0
+    assert np.allclose(foundDistances[hit], distances[hit], rtol=1e-12, atol=0)
+    assert np.allclose(foundNormals[hit], normals[hit], rtol=1e-9, atol=1e-12)
+
+    for origin, direction in zip(origins[:100], directions[:100]):
+        origin, direction = Vector(*origin), Vector(*direction)
+        obj, distance, _normal = nearestIntersectedObject(objects, origin, direction)
+        foundObj, foundDistance, _foundNormal = nearestIntersectedObject(accelerated, origin, direction)
+        assert foundObj is obj
+        assert foundDistance == pytest.approx(distance, rel=1e-12)
+
+
+@pytest.mark.parametrize("structure", [ObjectBVH, PackedScene])
+def test_shadowRaysMatchBruteForce(meshPath, structure):
+    objects = randomObjects(meshPath)
+    accelerated = structure(objects)
+    origins, directions, maxDistances = randomRays()
+
+    isOccluded = occludedArray(objects, origins, directions, maxDistances)
+    assert 0 < isOccluded.sum() < len(isOccluded)
+    assert np.array_equal(occludedArray(accelerated, origins, directions, maxDistances), isOccluded)
+    for i in range(100):
+        origin, direction = Vector(*origins[i]), Vector(*directions[i])
+        assert occluded(accelerated, origin, direction, maxDistances[i]) == isOccluded[i]
+
+
+def test_bvhLeavesAndSavedArrays():
+    rng = np.random.default_rng(2)
+    boundsMin = rng.uniform(-2, 2, (200, 3))
+    boundsMax = boundsMin + rng.uniform(0, 0.5, (200, 3))
+    bvh = BVH(boundsMin, boundsMax, leafSize=2)
+
+    # every primitive is in exactly one leaf, inside the bounds of the leaf
+    assert sorted(bvh.primitives.tolist()) == list(range(200))
+    for node in np.flatnonzero(bvh.nodeSize):
+        primitives = bvh.primitives[bvh.nodeFirst[node]:bvh.nodeFirst[node] + bvh.nodeSize[node]]
+        assert (boundsMin[primitives] >= bvh.nodeMin[node]).all() and (boundsMax[primitives] <= bvh.nodeMax[node]).all()
+
+    loaded = BVH.fromArrays(bvh.toArrays(), offset=1, scale=2)
+    for name in ("nodeFirst", "nodeSize", "nodeLeft", "nodeRight", "nodeAxis", "primitives"):
+        assert np.array_equal(getattr(loaded, name), getattr(bvh, name))
+    assert np.allclose(loaded.nodeMin, (bvh.nodeMin + 1) * 2) and np.allclose(loaded.nodeMax, (bvh.nodeMax + 1) * 2)
+    assert loaded.depth == bvh.depth
+
+
+def test_packedSceneUpdate(meshPath):
+    objects = randomObjects(meshPath)
+    packed = PackedScene(objects)
+    origins, directions, _maxDistances = randomRays()
+    packed[1] = objects[1] = Sphere(Vector(0, 0, 0), 1.5, shader)
+    assert np.array_equal(packed.nearestIntersectedArray(origins, directions)[0],
+                          nearestIntersectedObjectArray(objects, origins, directions)[0])
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from Vector import Vector
+from objects_class import Sphere
+from raytracer import prepareRender, renderWith
+from renderer import renderBatch, splitTiles
+from parallel_render import renderParallel
+from tile_culling import tileObjects
+from animation import TemporalReuse, renderFrames, cameraAt, objectStates, turntable
+
+
+dimensions = (48, 36)
+
+
+def sceneAt(scene, camera, objects=None):
+    worldInfos = scene.worldInfos(camera)
+    return (objects or worldInfos[0],) + worldInfos[1:]
+
+
+@pytest.mark.parametrize("renderer", ["batch", "parallel"])
+def test_renderFramesIsRenderWithEachFrame(defaultScene, renderer):
+    cameraKeyframes = turntable(Vector(-0.2, 0, -1), 2, 0.5, 12)
+    # the small green sphere goes up
+    objectKeyframes = {2: [{"time": 0, "center": Vector(-0.3, 0, 0)}, {"time": 2, "center": Vector(-0.3, 0.4, 0)}]}
+    worldInfos, parameters = prepareRender(defaultScene.worldInfos(), defaultScene.parameters)
+    frames = list(renderFrames(dimensions, defaultScene.FOV, worldInfos, parameters, cameraKeyframes, 3, objectKeyframes,
+                               renderer=renderer, workers=2))
+    assert [frame for frame, _image, _infos in frames] == [0, 1, 2]
+
+    for frame, image, _infos in frames:
+        objects = list(defaultScene.objects)
+        objects[2] = Sphere(objectStates(objectKeyframes, frame)[2]["center"], objects[2].radius, objects[2]._shader)
+        expected = renderWith(renderer, dimensions, defaultScene.FOV, sceneAt(defaultScene, cameraAt(cameraKeyframes, frame), objects),
+                              defaultScene.parameters, workers=2)[0]
+        assert np.array_equal(image, expected)
+    # the animated objects are put back
+    assert defaultScene.objects[2].center.toArray().tolist() == [-0.3, 0, 0]
+
+
+def test_culledRenderWithARotatedCamera(defaultScene):
+    camera = {"position": Vector(1.2, 0.6, 0.5), "target": Vector(-0.4, -0.2, -0.6)}
+    worldInfos, parameters = prepareRender(sceneAt(defaultScene, camera), defaultScene.parameters)
+    # some tiles only see some of the objects
+    tiles = splitTiles(dimensions, 8)
+    assert min(len(tileObjects(tile, dimensions, defaultScene.FOV, worldInfos)) for tile in tiles) < len(worldInfos[0])
+
+    unculled = renderBatch(dimensions, defaultScene.FOV, worldInfos, parameters)[0]
+    for culling in (True, False):
+        image = renderParallel(dimensions, defaultScene.FOV, worldInfos, dict(parameters, tileCulling=culling), workers=1, tileSize=8)[0]
+        assert np.array_equal(image, unculled)
+        scalar = renderWith("scalar", dimensions, defaultScene.FOV, worldInfos, dict(parameters, tileCulling=culling))[0]
+        assert np.abs(scalar - unculled).max() < 1e-12
+
+
+def test_temporalReuseOnATurntable(defaultScene):
+    worldInfos, parameters = prepareRender(defaultScene.worldInfos(), defaultScene.parameters)
+    cameraKeyframes = turntable(Vector(-0.2, 0, -1), 2, 0.5, 72)
+    reuse = TemporalReuse(dimensions, defaultScene.FOV, worldInfos, parameters)
+    pixels = dimensions[0] * dimensions[1]
+
+    first, infos = reuse.render(cameraAt(cameraKeyframes, 0))
+    assert infos == {"reused": 0, "shaded": pixels}
+    assert np.array_equal(first, renderBatch(dimensions, defaultScene.FOV, sceneAt(defaultScene, cameraAt(cameraKeyframes, 0)), parameters)[0])
+
+    # same camera: the colors are copied or shaded again the same way
+    image, infos = reuse.render(cameraAt(cameraKeyframes, 0))
+    assert infos["reused"] > pixels // 4 and infos["reused"] + infos["shaded"] == pixels
+    assert np.array_equal(image, first)
+
+    for frame in (1, 2):
+        camera = cameraAt(cameraKeyframes, frame)
+        image, infos = reuse.render(camera)
+        assert infos["reused"] > pixels // 4 and infos["reused"] + infos["shaded"] == pixels
+        expected = renderBatch(dimensions, defaultScene.FOV, sceneAt(defaultScene, camera), parameters)[0]
+        assert np.abs(image - expected).mean() < 0.01
+
+    # the triangle moved: its pixels are shaded again. Nothing is reused when an unbounded object moves
+    camera = cameraAt(cameraKeyframes, 2)
+    reused = reuse.render(camera)[1]["reused"]
+    oldBounds = worldInfos[0][3].bounds()
+    assert reuse.render(camera, {3: (oldBounds, (oldBounds[0] + 0.1, oldBounds[1] + 0.1))})[1]["reused"] < reused // 2
+    assert reuse.render(camera, {4: (None, None)})[1] == {"reused": 0, "shaded": pixels}
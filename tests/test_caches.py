@@ -0,0 +1,165 @@
+import os
+import copy
+import numpy as np
+
+from Vector import Vector
+from objects_class import Sphere, ImportedOBJ
+from shaders_class import DiffuseShader
+from textures_class import loadMipmaps, TextureCache
+from visibility_cache import VisibilityCache, prepareVisibilityCache, sceneSignature
+from irradiance_cache import IrradianceCache, prepareCache
+from incremental_render import IncrementalRender
+from raytracer import renderWith
+
+
+def touch(path, seconds=1):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+# Texture cache =========================================================================================================================
+
+def test_textureCacheIsReusedThenInvalidated(tmp_path):
+    path = str(tmp_path / "texture.npy")
+    np.save(path, np.full((4, 4, 3), 0.25))
+    cacheDirectory = str(tmp_path / ".texturecache")
+
+    levels = loadMipmaps(path, cacheDirectory)
+    assert [level.shape[:2] for level in levels] == [(4, 4), (2, 2), (1, 1)]
+    assert len(loadMipmaps(path, cacheDirectory)) == 3
+    assert len(os.listdir(cacheDirectory)) == 1
+
+    np.save(path, np.full((2, 2, 3), 0.5))
+    levels = loadMipmaps(path, cacheDirectory)
+    assert len(levels) == 2 and np.all(levels[0] == 0.5)
+    assert len(os.listdir(cacheDirectory)) == 2
+
+
+def test_textureCacheReloadsChangedFiles(tmp_path):
+    path = str(tmp_path / "texture.npy")
+    np.save(path, np.full((4, 4, 3), 0.25))
+    cache = TextureCache()
+    first = cache.mipmaps(path, str(tmp_path / ".texturecache"))
+    assert cache.mipmaps(path, str(tmp_path / ".texturecache")) is first
+    assert (cache.hits, cache.loads) == (1, 1)
+
+    np.save(path, np.full((4, 4, 3), 0.75))
+    touch(path)
+    assert np.all(cache.mipmaps(path, str(tmp_path / ".texturecache"))[0] == 0.75)
+    assert cache.loads == 2
+
+
+# Visibility cache ======================================================================================================================
+
+def test_visibilityCacheIsKeptForTheSameGeometry(defaultScene):
+    objects = list(defaultScene.objects)
+    signature = sceneSignature(objects)
+    # another shader doesn't change the geometry
+    objects[0] = Sphere(objects[0].center, objects[0].radius, DiffuseShader(Vector(0, 0, 0), Vector(1, 1, 1), 0))
+    assert sceneSignature(objects) == signature
+    objects[0] = Sphere(objects[0].center + Vector(0, 0.1, 0), objects[0].radius, objects[0]._shader)
+    assert sceneSignature(objects) != signature
+
+
+def test_sceneSignatureSeesEveryVertex(tmp_path):
+    path = tmp_path / "triangle.obj"
+    path.write_text("v 0.000000 0.000000 0.000000\nv 1.000000 0.000000 0.000000\nv 1.000000 1.000000 0.000000\nf 1 2 3\n")
+    mesh = ImportedOBJ(str(path), Vector(0, 0, 0), 1, DiffuseShader(Vector(0, 0, 0), Vector(1, 1, 1), 0),
+                       cacheDirectory=str(tmp_path / ".meshcache"))
+    # a big mesh: one vertex moved anywhere in it is another geometry
+    mesh.vertices = np.random.default_rng(0).uniform(-1, 1, (200000, 3))
+    signature = sceneSignature([mesh])
+    edited = copy.copy(mesh)
+    edited.vertices = mesh.vertices.copy()
+    edited.vertices[12345, 1] += 0.01
+    assert sceneSignature([edited]) != signature
+    assert sceneSignature([copy.copy(mesh)]) == signature
+
+
+def test_visibilityCacheIsInvalidatedWhenTheGeometryChanges(defaultScene, tmp_path):
+    path = str(tmp_path / "shadows.npz")
+    parameters = dict(defaultScene.parameters, shadowCache=True, shadowCachePath=path)
+    worldInfos = defaultScene.worldInfos()
+    image = renderWith("batch", (24, 18), defaultScene.FOV, worldInfos, parameters)[0]
+    assert os.path.exists(path)
+
+    cache = prepareVisibilityCache(parameters, worldInfos[0])["shadowCache"]
+    assert cache.tables and cache.validate(worldInfos[0])
+    # the saved cells still give the image of the same scene
+    assert np.array_equal(renderWith("batch", (24, 18), defaultScene.FOV, worldInfos, parameters)[0], image)
+
+    objects = list(worldInfos[0])
+    objects[0] = Sphere(objects[0].center + Vector(0.3, 0, 0), objects[0].radius, objects[0]._shader)
+    cache = prepareVisibilityCache(parameters, objects)["shadowCache"]
+    assert isinstance(cache, VisibilityCache) and not cache.tables
+
+
+# Irradiance cache ======================================================================================================================
+
+def test_irradianceCacheInterpolatesCloseRecords():
+    cache = IrradianceCache(0.3, maxRadius=1)
+    cache.insert(np.array([[0.0, 0, 0], [0.1, 0, 0]]), np.tile([0.0, 1.0, 0.0], (2, 1)), np.array([[1.0, 0, 0], [0, 1.0, 0]]),
+                 np.array([1.0, 1.0]))
+    points = np.array([[0.0, 0, 0], [0.05, 0, 0], [3, 0, 0], [0, 0, 0]])
+    normals = np.array([[0.0, 1, 0], [0, 1, 0], [0, 1, 0], [0, -1, 0]])
+    irradiance, found = cache.lookup(points, normals)
+    # far away or facing the other way: no record
+    assert found.tolist() == [True, True, False, False]
+    assert irradiance[0, 0] > irradiance[0, 1] > 0
+    assert np.allclose(irradiance[1], [0.5, 0.5, 0])
+
+
+def test_irradianceCacheIndexesNewRecordsOnly(monkeypatch):
+    rng = np.random.default_rng(1)
+    positions, irradiance = rng.uniform(-1, 1, (400, 3)), rng.random((400, 3))
+    normals = np.tile([0.0, 1.0, 0.0], (400, 1))
+    distances = rng.uniform(0.02, 0.5, 400)
+    points = rng.uniform(-1, 1, (200, 3))
+    pointNormals = np.tile([0.0, 1.0, 0.0], (200, 1))
+    whole = IrradianceCache(0.3)
+    whole.insert(positions, normals, irradiance, distances)
+    expected = whole.lookup(points, pointNormals)
+    assert expected[1].any() and not expected[1].all()
+
+    cache = IrradianceCache(0.3)
+    indexed = []
+    indexRecords = cache._indexRecords
+    monkeypatch.setattr(cache, "_indexRecords", lambda: indexed.append(len(cache) - cache._indexedCount) or indexRecords())
+    # one record at a time, like the scalar path: the octree is updated by the lookups, with the new records only
+    for i in range(200):
+        cache.insert(positions[i:i + 1], normals[i:i + 1], irradiance[i:i + 1], distances[i:i + 1])
+    cache.lookup(points, pointNormals)
+    for i in range(200, 400):
+        cache.insert(positions[i:i + 1], normals[i:i + 1], irradiance[i:i + 1], distances[i:i + 1])
+        cache.lookup(points[:1], pointNormals[:1])
+    assert indexed == [200] + [1] * 200
+
+    found = cache.lookup(points, pointNormals)
+    assert len(indexed) == 201
+    assert np.array_equal(found[1], expected[1]) and np.array_equal(found[0], expected[0])
+
+
+def test_irradianceCacheIsSavedAndLoaded(tmp_path):
+    path = str(tmp_path / "irradiance.npz")
+    rng = np.random.default_rng(0)
+    cache = IrradianceCache(0.2)
+    normals = np.tile([0.0, 1.0, 0.0], (10, 1))
+    cache.insert(rng.uniform(-1, 1, (10, 3)), normals, rng.random((10, 3)), rng.uniform(0.1, 1, 10))
+    cache.save(path)
+
+    loaded = prepareCache({"irradianceCache": True, "irradianceCachePath": path})["irradianceCache"]
+    assert len(loaded) == len(cache) and loaded.error == 0.2
+    assert np.array_equal(loaded.irradiance, cache.irradiance)
+
+
+def test_incrementalEditsStartANewIrradianceCache(defaultScene):
+    parameters = dict(defaultScene.parameters, Lighting="Global", indirectLightingMaxBounces=1, indirectLightingSamples=2,
+                      irradianceCache=True)
+    incremental = IncrementalRender((24, 18), defaultScene.FOV, defaultScene.worldInfos(), parameters)
+    cache = incremental.parameters["irradianceCache"]
+    assert len(cache)
+
+    objects = incremental.objects
+    incremental.objectChanged(2, Sphere(objects[2].center + Vector(0, 0.1, 0), objects[2].radius, objects[2]._shader))
+    assert incremental.parameters["irradianceCache"] is not cache
+    assert incremental.parameters["irradianceCache"].error == cache.error
@@ -0,0 +1,52 @@
+import numpy as np
+
+from Vector import Vector
+from raytracer import prepareRender
+from denoiser import auxiliaryBuffers, denoise
+
+
+dimensions = (48, 36)
+
+
+def buffersOf(scene, camera=None):
+    worldInfos, _parameters = prepareRender(scene.worldInfos(camera), scene.parameters)
+    return auxiliaryBuffers(dimensions, scene.FOV, worldInfos)
+
+
+def test_auxiliaryBuffers(defaultScene):
+    # the big sphere seen from behind, with the sky above the plane
+    buffers = buffersOf(defaultScene, {"position": Vector(0.3, 0.3, -2.4), "target": Vector(-0.2, 0, -1)})
+    height, width = dimensions[1], dimensions[0]
+    assert buffers["albedo"].shape == buffers["normals"].shape == (height, width, 3)
+    assert buffers["depth"].shape == buffers["objectIds"].shape == (height, width)
+
+    sky = buffers["objectIds"] < 0
+    assert 0 < sky.sum() < sky.size
+    assert np.all(buffers["depth"][sky] == np.inf) and np.all(buffers["normals"][sky] == 0)
+    assert np.allclose(buffers["albedo"][sky], defaultScene.skyDiffuse.toArray())
+    assert np.all(np.isfinite(buffers["depth"][~sky])) and np.allclose(np.linalg.norm(buffers["normals"][~sky], axis=1), 1)
+    # diffuse color of the big red sphere
+    assert np.allclose(buffers["albedo"][buffers["objectIds"] == 0], [0.7, 0, 0])
+
+
+def test_flatImageIsUnchanged(defaultScene):
+    buffers = buffersOf(defaultScene)
+    image = np.full((dimensions[1], dimensions[0], 3), 0.3)
+    assert np.allclose(denoise(image, buffers), 0.3, rtol=1e-12, atol=0)
+
+
+def test_objectsAreNotMixed():
+    # two objects side by side with the same normals, depth and albedo: only the object ids separate them
+    height, width = 32, 32
+    objectIds = np.zeros((height, width), dtype=int)
+    objectIds[:, width // 2:] = 1
+    buffers = {"albedo": np.full((height, width, 3), 0.5), "normals": np.broadcast_to([0.0, 0, 1], (height, width, 3)),
+               "depth": np.ones((height, width)), "objectIds": objectIds}
+    rng = np.random.default_rng(0)
+    image = np.where(objectIds[:, :, None] == 0, 0.2, 0.8) + rng.uniform(-0.05, 0.05, (height, width, 3))
+
+    denoised = denoise(image, buffers, sigmaColor=10)
+    left, right = denoised[objectIds == 0], denoised[objectIds == 1]
+    assert left.max() <= image[objectIds == 0].max() and right.min() >= image[objectIds == 1].min()
+    # the noise is averaged inside each object
+    assert left.std() < image[objectIds == 0].std() / 3 and right.std() < image[objectIds == 1].std() / 3
@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+
+from renderer import PNGWriter, writePNG, toBytes
+from parallel_render import renderParallel
+from framebuffer import renderToFile, readFramebuffer
+from raytracer import prepareRender
+
+
+def readPNG(path):
+    with Image.open(path) as image:
+        assert image.mode == "RGB"
+        return np.asarray(image)
+
+
+# PNG writer ============================================================================================================================
+
+def test_pngWriterRoundTrip(tmp_path):
+    path = str(tmp_path / "image.png")
+    image = np.random.default_rng(0).uniform(-0.1, 1.1, (37, 53, 3))
+    # bands of rows that don't divide the height
+    writePNG(path, image, rowsPerChunk=5)
+    assert np.array_equal(readPNG(path), toBytes(image))
+
+
+def test_pngWriterDeletesUnfinishedFiles(tmp_path):
+    path = str(tmp_path / "image.png")
+    with pytest.raises(KeyboardInterrupt):
+        with PNGWriter(path, 4, 4) as writer:
+            writer.writeRows(np.zeros((2, 4, 3)))
+            raise KeyboardInterrupt
+    assert not os.path.exists(path)
+
+    writer = PNGWriter(path, 4, 4)
+    writer.writeRows(np.zeros((3, 4, 3)))
+    with pytest.raises(ValueError):
+        writer.close()
+    assert not os.path.exists(path)
+
+
+# Out-of-core render ====================================================================================================================
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("extension", [".png", ".npy"])
+def test_renderToFileIsTheParallelRender(defaultScene, tmp_path, workers, extension):
+    dimensions, tileSize = (48, 36), 16
+    parameters = dict(defaultScene.parameters, Lighting="Global", indirectLightingMaxBounces=1, indirectLightingSamples=2, seed=3)
+    worldInfos, parameters = prepareRender(defaultScene.worldInfos(), parameters)
+    image = renderParallel(dimensions, defaultScene.FOV, worldInfos, parameters, workers=2, tileSize=tileSize)[0]
+
+    path = str(tmp_path / ("image" + extension))
+    renderToFile(path, dimensions, defaultScene.FOV, worldInfos, parameters, workers, tileSize, dtype="float32")
+    if extension == ".png":
+        assert np.array_equal(readPNG(path), toBytes(image))
+    else:
+        assert np.array_equal(readFramebuffer(path), image.astype(np.float32))
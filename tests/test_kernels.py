@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import kernels
+from packed_scene import scalarKernels
+
+
+def randomRows(seed=0):
+    """Packed rows (packed_scene.packRow) of random spheres, planes and triangles around the origin"""
+    rng = np.random.default_rng(seed)
+    spheres = np.c_[rng.normal(size=(30, 3)) * 3, rng.uniform(0.05, 1, 30)]
+    planes = np.array([[0, 1, 0, 2.0], [0.6, 0, 0.8, 6.0]])
+    points = rng.normal(size=(20, 3)) * 3
+    edges1, edges2 = rng.normal(size=(20, 3)), rng.normal(size=(20, 3))
+    triangles = np.c_[points, edges1, edges2, -np.cross(edges1, edges2)]
+    return {"sphere": spheres, "plane": planes, "triangle": triangles}
+
+
+def randomRays(count=500, seed=1):
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    return rng.uniform(-1, 1, (count, 3)), directions, rng.uniform(0.5, 10, count)
+
+
+@pytest.mark.parametrize("kind", ["sphere", "plane", "triangle"])
+def test_numpyKernelsMatchScalarKernels(kind):
+    rows = randomRows()[kind]
+    origins, directions, maxDistances = randomRays()
+    positions, distances = kernels.NumpyBackend.nearestHits(kind, origins, directions, rows)
+    isOccluded = kernels.NumpyBackend.anyHits(kind, origins, directions, rows, maxDistances)
+    for n, (origin, direction) in enumerate(zip(origins.tolist(), directions.tolist())):
+        hits = [scalarKernels[kind](*origin, *direction, tuple(row)) for row in rows.tolist()]
+        hits = [np.inf if not distance else distance for distance in hits]
+        assert distances[n] == pytest.approx(min(hits), rel=1e-9)
+        assert positions[n] == (int(np.argmin(hits)) if min(hits) < np.inf else -1)
+        assert isOccluded[n] == (min(hits) < maxDistances[n])
+
+
+def test_numbaBackendMatchesNumpy():
+    pytest.importorskip("numba")
+    assert "numba" in kernels.availableBackends()
+    origins, directions, maxDistances = randomRays()
+    for rayOrigins in (origins, np.zeros(3)):
+        differences = kernels.compareBackends(randomRows(), rayOrigins, directions, maxDistances)["numba"]
+        assert "direct lighting" in differences
+        for kernel, difference in differences.items():
+            assert difference < 1e-9, kernel
@@ -0,0 +1,15 @@
+from Vector import Vector
+from lights_class import PointLight, SpotLight, AreaLight
+
+
+def test_defaultColorsAreNotShared():
+    lights = [PointLight(Vector(0, 1, 0), Vector(1, 1, 1)), PointLight(Vector(0, 2, 0), Vector(1, 1, 1)),
+              SpotLight(Vector(0, 1, 0), Vector(0, -1, 0), 30, Vector(1, 1, 1)),
+              AreaLight(Vector(0, 1, 0), Vector(1, 0, 0), Vector(0, 0, 1), Vector(1, 1, 1))]
+    # Vector += changes the vector itself
+    lights[0].ambient += Vector(0.5, 0.5, 0.5)
+    lights[0].specular *= 0.5
+    for light in lights[1:]:
+        assert light.ambient.toArray().tolist() == [0, 0, 0]
+        assert light.specular.toArray().tolist() == [1, 1, 1]
+    assert PointLight(Vector(0, 1, 0), Vector(1, 1, 1)).ambient.toArray().tolist() == [0, 0, 0]
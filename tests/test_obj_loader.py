@@ -0,0 +1,64 @@
+import os
+import numpy as np
+
+from obj_loader import parseOBJ, loadOBJ
+
+
+square = b"v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n"
+
+
+def test_quadsAreSplitInTriangles():
+    mesh = parseOBJ(None, square + b"f 1 2 3 4\n")
+    assert mesh["faces"].tolist() == [[0, 1, 2], [0, 2, 3]]
+    assert (mesh["faceUVs"] == -1).all() and (mesh["faceNormals"] == -1).all()
+
+
+def test_vertexNormalIndices():
+    mesh = parseOBJ(None, square + b"vn 0 0 1\nvn 0 0 -1\nf 1//1 2//1 3//2\n")
+    assert mesh["faces"].tolist() == [[0, 1, 2]]
+    assert mesh["faceUVs"].tolist() == [[-1, -1, -1]]
+    assert mesh["faceNormals"].tolist() == [[0, 0, 1]]
+    assert mesh["normals"].tolist() == [[0, 0, 1], [0, 0, -1]]
+
+
+def test_vertexUVNormalIndices():
+    mesh = parseOBJ(None, square + b"vt 0 0\nvt 1 0\nvt 1 1\nvn 0 0 1\nf 1/1/1 2/2/1 3/3/1 4/3/1\n")
+    assert mesh["faces"].tolist() == [[0, 1, 2], [0, 2, 3]]
+    assert mesh["faceUVs"].tolist() == [[0, 1, 2], [0, 2, 2]]
+    assert mesh["faceNormals"].tolist() == [[0, 0, 0], [0, 0, 0]]
+    assert mesh["uvs"].tolist() == [[0, 0], [1, 0], [1, 1]]
+
+
+def test_negativeIndicesAreRelativeToTheEnd():
+    mesh = parseOBJ(None, square + b"vt 0 0\nvt 1 1\nf -4/-2 -3/-1 -2/-1\n")
+    assert mesh["faces"].tolist() == [[0, 1, 2]]
+    assert mesh["faceUVs"].tolist() == [[0, 1, 1]]
+
+
+def test_mixedFaceFormats():
+    mesh = parseOBJ(None, square + b"vn 0 0 1\nf 1 2 3\nf 1//1 3//1 4//1\n")
+    assert mesh["faces"].tolist() == [[0, 1, 2], [0, 2, 3]]
+    assert mesh["faceNormals"].tolist() == [[-1, -1, -1], [0, 0, 0]]
+
+
+def test_meshCacheIsReusedThenInvalidated(tmp_path):
+    path = tmp_path / "square.obj"
+    path.write_bytes(square + b"f 1 2 3 4\n")
+    cacheDirectory = str(tmp_path / ".meshcache")
+
+    first = loadOBJ(str(path), cacheDirectory)
+    second = loadOBJ(str(path), cacheDirectory)
+    assert not first["cached"] and second["cached"]
+    assert np.array_equal(second["faces"], first["faces"])
+
+    # another content: parsed again, under a new key
+    path.write_bytes(square + b"f 1 2 3\n")
+    changed = loadOBJ(str(path), cacheDirectory)
+    assert not changed["cached"]
+    assert changed["faces"].tolist() == [[0, 1, 2]]
+    assert len(os.listdir(cacheDirectory)) == 2
+
+    # same content, touched: the modification time is part of the key
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not loadOBJ(str(path), cacheDirectory)["cached"]
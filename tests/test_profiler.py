@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from raytracer import renderProfiled, renderWith
+
+
+@pytest.mark.parametrize("renderer", ["scalar", "batch"])
+def test_heatmapHasTheTilesOfTheRender(defaultScene, renderer):
+    dimensions = (40, 20)
+    image, _time, profiler = renderProfiled(renderer, dimensions, defaultScene.FOV, defaultScene.worldInfos(), defaultScene.parameters,
+                                            heatmapTileSize=8)
+    assert np.abs(image - renderWith("batch", dimensions, defaultScene.FOV, defaultScene.worldInfos(), defaultScene.parameters)[0]).max() < 1e-12
+
+    # 5 x 3 tiles of 8 pixels (the last row of tiles has 4 rows), every pixel in one of them
+    assert len(profiler.tiles) == 15
+    covered = np.zeros(dimensions[::-1], dtype=int)
+    for tile in profiler.tiles:
+        rowStart, rowEnd, columnStart, columnEnd = tile["tile"]
+        assert rowEnd - rowStart in (8, 4) and columnEnd - columnStart == 8
+        covered[rowStart:rowEnd, columnStart:columnEnd] += 1
+    assert (covered == 1).all()
+    assert sum(tile["rays"] for tile in profiler.tiles) == profiler.report()["rays"]["total"] > 0
+
+    # the cost of the pixels changes across the image, not only between the renders
+    assert len(np.unique(profiler.heatmap(dimensions))) > 1
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from Vector import Vector
+from objects_class import Sphere
+from raytracer import renderWith
+from incremental_render import IncrementalRender
+
+
+# two tiles by two of the parallel renderer
+dimensions = (48, 36)
+
+
+def render(scene, renderer, objects=None, light=None, workers=2, **parameters):
+    worldInfos = scene.worldInfos()
+    worldInfos = (objects or worldInfos[0], light or worldInfos[1]) + worldInfos[2:]
+    return renderWith(renderer, dimensions, scene.FOV, worldInfos, dict(scene.parameters, **parameters), workers=workers)[0]
+
+
+@pytest.mark.parametrize("maxReflections", [0, 2])
+def test_scalarBatchAndParallelRendersAgree(defaultScene, maxReflections):
+    batch = render(defaultScene, "batch", maxReflections=maxReflections)
+    assert np.abs(render(defaultScene, "scalar", maxReflections=maxReflections) - batch).max() < 1e-12
+    assert np.array_equal(render(defaultScene, "parallel", maxReflections=maxReflections), batch)
+
+
+def test_randomSamplesAreReproducible(defaultScene):
+    parameters = {"Lighting": "Global", "indirectLightingMaxBounces": 1, "indirectLightingSamples": 2, "seed": 3}
+    batch = render(defaultScene, "batch", **parameters)
+    assert np.array_equal(render(defaultScene, "batch", **parameters), batch)
+    assert not np.array_equal(render(defaultScene, "batch", **dict(parameters, seed=4)), batch)
+    # the tiles have their own streams: the number of processes doesn't change the image
+    assert np.array_equal(render(defaultScene, "parallel", workers=1, **parameters), render(defaultScene, "parallel", **parameters))
+
+
+def test_parallelRenderWithRandomSamplesIsTheBatchRender(defaultScene):
+    parameters = {"Lighting": "Global", "indirectLightingMaxBounces": 1, "indirectLightingSamples": 2, "seed": 3}
+    assert np.array_equal(render(defaultScene, "parallel", **parameters), render(defaultScene, "batch", **parameters))
+
+
+# Incremental render ====================================================================================================================
+
+def incrementalRender(scene, **parameters):
+    return IncrementalRender(dimensions, scene.FOV, scene.worldInfos(), dict(scene.parameters, **parameters))
+
+
+@pytest.mark.parametrize("maxReflections", [0, 2])
+def test_incrementalObjectChangedIsAFreshRender(defaultScene, maxReflections):
+    incremental = incrementalRender(defaultScene, maxReflections=maxReflections)
+    assert np.array_equal(incremental.image, render(defaultScene, "batch", maxReflections=maxReflections))
+
+    objects = list(defaultScene.objects)
+    # the small green sphere moves in front of the big one
+    objects[2] = Sphere(Vector(0.1, 0.1, -0.2), 0.15, objects[2]._shader)
+    image, infos = incremental.objectChanged(2, objects[2])
+    assert 0 < infos["traced"] < dimensions[0] * dimensions[1]
+    assert np.abs(image - render(defaultScene, "batch", objects, maxReflections=maxReflections)).max() < 1e-12
+
+
+def test_incrementalLightChangedIsAFreshRender(defaultScene):
+    incremental = incrementalRender(defaultScene)
+    light = dict(defaultScene.light, position=Vector(-3, 4, 2))
+    image, infos = incremental.lightChanged(light)
+    assert infos["traced"] == 0
+    assert np.abs(image - render(defaultScene, "batch", light=light)).max() < 1e-12
+
+
+def test_incrementalRenderWithRandomSamplesIsTheBatchRender(defaultScene):
+    parameters = {"Lighting": "Global", "indirectLightingMaxBounces": 1, "indirectLightingSamples": 2, "seed": 3}
+    assert np.array_equal(incrementalRender(defaultScene, **parameters).image, render(defaultScene, "batch", **parameters))
@@ -0,0 +1,19 @@
+import numpy as np
+
+from Vector import Vector
+from textures_class import ImageTexture
+
+
+def test_defaultAxesAreNotShared(tmp_path):
+    path = str(tmp_path / "texture.npy")
+    np.save(path, np.zeros((4, 4, 3)))
+    first, second = ImageTexture(path), ImageTexture(path)
+    # Vector += changes the vector itself
+    first.origin += Vector(1, 0, 0)
+    first.uAxis *= 2
+    first.vAxis += Vector(0, 1, 0)
+    assert second.origin.toArray().tolist() == [0, 0, 0]
+    assert second.uAxis.toArray().tolist() == [1, 0, 0]
+    assert second.vAxis.toArray().tolist() == [0, 0, -1]
+    u, v = second.uvArray(np.array([[0.5, 0, -0.25]]))
+    assert (u.tolist(), v.tolist()) == ([0.5], [0.25])
@@ -1,23 +1,239 @@
+import os
+import math
+import time
+import shutil
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
 from Vector import Vector
 
 
+# Every texture (and Vector, a texture of one color) has:
+#   getColor(position: Vector) -> Vector
+#   getColorArray(positions (N, 3)) -> colors (N, 3), or (3,) if it is the same everywhere
+
+
 class TextureValue:
-    
+
     def __init__(self, value):
-        """An unique color/value for all the object"""
+        """An unique color/value for all the object
+        value: Vector, number or other texture
+        """
         self.value = value
 
-    def getValue(self, position):
-        return self.value
+    def getColor(self, position):
+        return self.value.getColor(position) if hasattr(self.value, "getColor") else self.value
+
+    def getColorArray(self, positions):
+        if hasattr(self.value, "getColorArray"):
+            return self.value.getColorArray(positions)
+        return np.asarray(self.value, dtype=float)
+
+    # name used before getColor
+    getValue = getColor
 
 
 class SquareTexture:
-    
+
     def __init__(self, squareSize, val1, val2):
+        """Checkerboard of cubes of squareSize, val1 and val2: colors (Vectors) or other textures"""
         self.squareSize = squareSize
         self.val1, self.val2 = val1, val2
 
     def getColor(self, position):
-        tempVector = position / self.squareSize
-        temp = round(position.x) + round(position.y) + round(position.z)
-        return self.val1 if (abs(temp)%2==1) else self.val2
+        scaled = position / self.squareSize
+        temp = round(scaled.x) + round(scaled.y) + round(scaled.z)
+        return (self.val1 if temp % 2 == 1 else self.val2).getColor(position)
+
+    def getColorArray(self, positions):
+        odd = np.round(positions / self.squareSize).sum(axis=1) % 2 == 1
+        colors = np.empty(positions.shape)
+        # each value is only evaluated where it is used
+        colors[odd] = self.val1.getColorArray(positions[odd])
+        colors[~odd] = self.val2.getColorArray(positions[~odd])
+        return colors
+
+
+# Image textures ========================================================================================================================
+
+def readImage(path: str):
+    """Colors (height, width, 3) between 0 and 1 of an image file (.npy array, or PNG... read by matplotlib)"""
+    if path.endswith(".npy"):
+        image = np.load(path)
+    else:
+        # only imported for the scenes with image textures
+        import matplotlib.image
+        image = matplotlib.image.imread(path)
+    if image.dtype == np.uint8:
+        image = image / 255
+    if image.ndim == 2:
+        image = image[:, :, None]
+    if image.shape[2] < 3:
+        image = np.repeat(image[:, :, :1], 3, axis=2)
+    return np.asarray(image[:, :, :3], dtype=np.float32)
+
+
+def buildMipmaps(image):
+    """Levels of the mipmap of an image (height, width, 3): the image, then each level half the size of
+    the previous one (mean of 2x2 texels, the last row/column repeated on odd sizes), down to 1x1
+    """
+    levels = [image]
+    while image.shape[0] > 1 or image.shape[1] > 1:
+        if image.shape[0] > 1:
+            if image.shape[0] % 2:
+                image = np.concatenate((image, image[-1:]), axis=0)
+            image = (image[::2] + image[1::2]) / 2
+        if image.shape[1] > 1:
+            if image.shape[1] % 2:
+                image = np.concatenate((image, image[:, -1:]), axis=1)
+            image = (image[:, ::2] + image[:, 1::2]) / 2
+        levels.append(image)
+    return levels
+
+
+def loadMipmaps(path: str, cacheDirectory: str = None):
+    """Mipmap levels of an image file (buildMipmaps) with a binary cache: they are saved as .npy files in cacheDirectory
+    (default: .texturecache next to the image), under a key made of the content and modification time of the file.
+    Next loads (from any process) memory-map them instead of decoding the image: only the texels used are read,
+    and the processes rendering the same texture share its pages.
+    Returns the list of levels (read only arrays)
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    key = hashlib.sha1(data + str(os.stat(path).st_mtime_ns).encode()).hexdigest()
+
+    if cacheDirectory is None:
+        cacheDirectory = os.path.join(os.path.dirname(os.path.abspath(path)), ".texturecache")
+    directory = os.path.join(cacheDirectory, key)
+
+    if not os.path.isdir(directory):
+        # written in a temporary directory first, so that an interrupted save is never loaded
+        temporary = directory + ".%d.tmp" % os.getpid()
+        os.makedirs(temporary, exist_ok=True)
+        for level, image in enumerate(buildMipmaps(readImage(path))):
+            np.save(os.path.join(temporary, "level%d.npy" % level), image)
+        try:
+            os.rename(temporary, directory)
+        except OSError:
+            # saved at the same time by another process
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    levels = sorted(name for name in os.listdir(directory) if name.endswith(".npy"))
+    return [np.load(os.path.join(directory, "level%d.npy" % level), mmap_mode="r") for level in range(len(levels))]
+
+
+class TextureCache:
+
+    def __init__(self, maxBytes: int = 1 << 30):
+        """Mipmaps of the image files used by the ImageTextures, loaded once per process (loadMipmaps) and shared by
+        all the textures of the same file. The least recently used ones are dropped when they take more than
+        maxBytes together (the last one used is always kept).
+        """
+        self.maxBytes = maxBytes
+        # (path, modification time) -> levels, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits, self.loads, self.evictions = 0, 0, 0
+        self.loadTime = 0
+
+    def mipmaps(self, path: str, cacheDirectory: str = None):
+        """Levels of the mipmap of an image file, loaded again if the file changed"""
+        key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+        levels = self.entries.get(key)
+        if levels is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return levels
+
+        loadTime = time.time()
+        levels = self.entries[key] = loadMipmaps(path, cacheDirectory)
+        self.loadTime += time.time() - loadTime
+        self.loads += 1
+        self.size += sum(level.nbytes for level in levels)
+        while self.size > self.maxBytes and len(self.entries) > 1:
+            _key, evicted = self.entries.popitem(last=False)
+            self.size -= sum(level.nbytes for level in evicted)
+            self.evictions += 1
+        return levels
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+# Cache of the process, used by all the ImageTextures
+textureCache = TextureCache()
+
+
+def _bilinear(image, u, v):
+    """Colors (N, 3) of an image at texture coordinates u, v (N,), repeated outside of [0, 1] (v = 0 at the bottom)"""
+    height, width = image.shape[:2]
+    x, y = u * width - 0.5, (1 - v) * height - 0.5
+    x0, y0 = np.floor(x), np.floor(y)
+    fx, fy = (x - x0)[:, None], (y - y0)[:, None]
+    x0, y0 = x0.astype(int) % width, y0.astype(int) % height
+    x1, y1 = (x0 + 1) % width, (y0 + 1) % height
+    top = image[y0, x0] * (1 - fx) + image[y0, x1] * fx
+    bottom = image[y1, x0] * (1 - fx) + image[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+class ImageTexture:
+
+    def __init__(self, path: str, size: float = 1, origin: Vector = None, uAxis: Vector = None, vAxis: Vector = None,
+                 mapping: str = "planar", blur: float = 0, cacheDirectory: str = None):
+        """Colors of an image file, repeated over the surfaces
+        size: size of the image in the scene
+        mapping: how the points get their texture coordinates:
+            "planar": projected on the plane of uAxis and vAxis going through origin
+                (default: the horizontal plane through (0, 0, 0), u along x and v along -z)
+            "spherical": longitude and latitude around origin (vAxis up), the image covers the sphere once
+        blur: level of the mipmap used (0 the image, 1 half its size..., between two levels they are interpolated),
+            higher values avoid the aliasing of textures far away or seen at grazing angles
+        The image is loaded by textureCache (mipmapped once, memory mapped, shared by the textures of the same file).
+        """
+        self.path = path
+        self.size = size
+        self.origin = Vector(0, 0, 0) if origin is None else origin
+        self.uAxis = Vector(1, 0, 0) if uAxis is None else uAxis
+        self.vAxis = Vector(0, 0, -1) if vAxis is None else vAxis
+        if mapping not in ("planar", "spherical"):
+            raise ValueError("Unknown texture mapping: %s" % mapping)
+        self.mapping = mapping
+        self.blur = blur
+        self.cacheDirectory = cacheDirectory
+
+    def uvArray(self, positions):
+        """Texture coordinates (u, v) of the positions (N, 3)"""
+        relative = positions - self.origin.toArray()
+        uAxis, vAxis = self.uAxis.toArray(), self.vAxis.toArray()
+        if self.mapping == "planar":
+            return relative @ uAxis / self.size, relative @ vAxis / self.size
+
+        up = vAxis / np.linalg.norm(vAxis)
+        forward = uAxis - up * (uAxis @ up)
+        forward /= np.linalg.norm(forward)
+        side = np.cross(up, forward)
+        lengths = np.maximum(np.linalg.norm(relative, axis=1), 1e-12)
+        latitude = np.arcsin(np.clip(relative @ up / lengths, -1, 1))
+        longitude = np.arctan2(relative @ side, relative @ forward)
+        return longitude / (2 * math.pi) + 0.5, latitude / math.pi + 0.5
+
+    def sampleArray(self, u, v, blur: float = None):
+        """Colors (N, 3) at texture coordinates u, v (N,), for the rays that already have them (meshes)
+        blur: mipmap level, the blur of the texture by default
+        """
+        levels = textureCache.mipmaps(self.path, self.cacheDirectory)
+        level = min(max(self.blur if blur is None else blur, 0), len(levels) - 1)
+        lower = int(level)
+        colors = _bilinear(levels[lower], u, v)
+        if level > lower:
+            colors = colors * (lower + 1 - level) + _bilinear(levels[lower + 1], u, v) * (level - lower)
+        return colors
+
+    def getColorArray(self, positions):
+        return self.sampleArray(*self.uvArray(positions))
+
+    def getColor(self, position):
+        return Vector(*self.getColorArray(position.toArray()[None])[0].tolist())
@@ -0,0 +1,60 @@
+import numpy as np
+
+from renderer import pixelRays
+
+
+# Tile frustums =========================================================================================================================
+
+def tileCone(tile: tuple, dimensions: tuple, FOV: int, camera: dict, padding: float = 0.5):
+    """Cone of the primary rays of a tile (rowStart, rowEnd, columnStart, columnEnd): every ray of the tile is a
+    positive combination of its 4 corner rays, which go padding pixels beyond the tile (sub-pixel samples).
+    Returns the origin (3,), the corner directions (4, 3) around the cone and the inward normals (4, 3) of its sides
+    """
+    rowStart, rowEnd, columnStart, columnEnd = tile
+    top, bottom = rowStart - padding, rowEnd - 1 + padding
+    left, right = columnStart - padding, columnEnd - 1 + padding
+    origin, corners = pixelRays(np.array([top, top, bottom, bottom]), np.array([left, right, right, left]), dimensions, FOV, camera)
+
+    sides = np.cross(corners, np.roll(corners, -1, axis=0))
+    # inward: the opposite corner is on the positive side
+    sides *= np.sign(np.einsum("ij,ij->i", sides, np.roll(corners, -2, axis=0)))[:, None]
+    return origin, corners, sides
+
+
+def coneOverlapsBoxes(origin, sides, boundsMin, boundsMax):
+    """False for the boxes (N, 3) entirely outside one side of the cone (they can't be hit by its rays), True otherwise.
+    Conservative: a box near an edge of the cone can be kept without being hit.
+    """
+    # corner of each box the farthest along each side normal
+    farthest = np.where(sides[:, None] > 0, boundsMax[None], boundsMin[None]) - origin
+    return (np.einsum("sij,sj->si", farthest, sides) >= -1e-9).all(axis=0)
+
+
+def tileObjects(tile: tuple, dimensions: tuple, FOV: int, worldInfos: tuple, padding: float = 0.5, maxListObjects: int = 32):
+    """Objects the primary rays of a tile can hit, to intersect them instead of all the objects.
+    Objects with bounds are kept if their box overlaps the cone of the tile (tileCone), unbounded objects if their
+    coneOverlaps method says so (or always without it). An empty list means that the tile only sees the sky.
+    If more than maxListObjects objects are left in a scene with an acceleration structure, the structure is kept.
+    The objects of a PackedScene give a PackedScene of the visible ones (PackedScene.subset).
+    """
+    objects, camera = worldInfos[0], worldInfos[3]
+    origin, corners, sides = tileCone(tile, dimensions, FOV, camera, padding)
+
+    bounds = [obj.bounds() for obj in objects]
+    bounded = [i for i, objectBounds in enumerate(bounds) if objectBounds is not None]
+    visible = np.ones(len(objects), dtype=bool)
+    if bounded:
+        boundsMin = np.array([bounds[i][0] for i in bounded]).reshape((-1, 3))
+        boundsMax = np.array([bounds[i][1] for i in bounded]).reshape((-1, 3))
+        visible[bounded] = coneOverlapsBoxes(origin, sides, boundsMin, boundsMax)
+    for i, objectBounds in enumerate(bounds):
+        if objectBounds is None and hasattr(objects[i], "coneOverlaps"):
+            visible[i] = objects[i].coneOverlaps(origin, corners)
+
+    if visible.all():
+        return objects
+    if hasattr(objects, "subset"):
+        return objects.subset(np.flatnonzero(visible))
+    if hasattr(objects, "nearestIntersectedArray") and visible.sum() > maxListObjects:
+        return objects
+    return [obj for obj, isVisible in zip(objects, visible) if isVisible]
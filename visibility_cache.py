@@ -0,0 +1,180 @@
+import os
+import hashlib
+import numpy as np
+
+from Vector import Vector
+
+
+def sceneSignature(objects):
+    """Hash of the geometry of the objects (their positions, sizes, vertices...), not of their shaders:
+    it changes when an object is added, removed, moved or resized.
+    The arrays (mesh vertices...) are hashed whole, with their shape: moving a single vertex changes the signature.
+    """
+    digest = hashlib.sha1()
+    for obj in objects:
+        digest.update(type(obj).__name__.encode())
+        for name, value in sorted(vars(obj).items()):
+            if isinstance(value, Vector):
+                value = value.toArray()
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = np.array(value, dtype=float)
+            if isinstance(value, np.ndarray) and value.dtype.kind in "fiu":
+                digest.update(("%s%s" % (name, value.shape)).encode())
+                digest.update(np.ascontiguousarray(value).tobytes())
+    return digest.hexdigest()
+
+
+def _cellKeys(cells, facing):
+    """Integer cell coordinates (N, 3) and side of the surface (N,) -> one int64 key per point"""
+    cells = np.clip(cells + (1 << 19), 0, (1 << 20) - 1)
+    return (cells[:, 0] << 41) | (cells[:, 1] << 21) | (cells[:, 2] << 1) | facing.astype(np.int64)
+
+
+# Visibility cache
+class VisibilityCache:
+
+    def __init__(self, cellSize: float = 0.02, minSamples: int = 4):
+        """Results of the shadow rays of the previous frames, in a sparse grid: for each light position, each cell
+        counts the points found lit and shadowed (separately for the surfaces facing the light or not).
+        A point gets the answer of its cell without tracing a shadow ray if the cell has at least minSamples results,
+        all the same, and the 26 cells around it have no other result (so shadow edges are always traced).
+        The results of a frame are only added to the cells by commit() (renderWith calls it after the render),
+        the lookups of a frame use the cells of the previous ones.
+        cellSize: width of the cells, smaller than the details of the shadows
+        """
+        self.cellSize = cellSize
+        self.minSamples = minSamples
+        # light position -> (keys sorted, lit counts, shadowed counts, state: 0 unknown, 1 lit, 2 shadowed)
+        self.tables = {}
+        # light position -> list of (keys, isShadowed) of the current frame
+        self._pending = {}
+        self.signature = None
+
+        self.lookups = 0
+        self.hits = 0
+
+    def validate(self, objects):
+        """Forgets everything if the geometry changed since the last call (see sceneSignature)
+        Returns True if the cache was kept
+        """
+        signature = sceneSignature(objects)
+        kept = signature == self.signature
+        if not kept:
+            self.tables, self._pending = {}, {}
+            self.signature = signature
+        return kept
+
+    def _keys(self, points, facing):
+        return _cellKeys(np.floor(points / self.cellSize).astype(np.int64), facing)
+
+    def lookup(self, lightPosition, points, facing):
+        """points: (N, 3), facing: (N,) True where the surface faces the light
+        Returns isShadowed (N,) and known (N,): False where a shadow ray has to be traced
+        """
+        self.lookups += len(points)
+        table = self.tables.get(tuple(lightPosition))
+        if table is None:
+            known = np.zeros(len(points), dtype=bool)
+            return known.copy(), known
+
+        tableKeys, _lit, _shadowed, states = table
+        keys = self._keys(points, facing)
+        positions = np.minimum(np.searchsorted(tableKeys, keys), len(tableKeys) - 1)
+        state = np.where(tableKeys[positions] == keys, states[positions], 0)
+
+        known = state > 0
+        self.hits += int(known.sum())
+        return state == 2, known
+
+    def record(self, lightPosition, points, facing, isShadowed):
+        """Keeps the results of shadow rays traced from the points, for the next commit()"""
+        if len(points):
+            self._pending.setdefault(tuple(lightPosition), []).append((self._keys(points, facing), np.asarray(isShadowed, dtype=bool)))
+
+    def commit(self):
+        """Adds the results recorded since the last commit to the cells and updates the cells that can be used"""
+        for lightPosition, results in self._pending.items():
+            empty = np.zeros(0, dtype=np.int64)
+            tableKeys, lit, shadowed, _states = self.tables.get(lightPosition, (empty, empty, empty, None))
+            keys = np.concatenate([tableKeys] + [result[0] for result in results])
+            newShadowed = np.concatenate([result[1] for result in results])
+
+            allKeys, inverse = np.unique(keys, return_inverse=True)
+            allLit = np.bincount(inverse, np.concatenate((lit, ~newShadowed)), minlength=len(allKeys)).astype(np.int64)
+            allShadowed = np.bincount(inverse, np.concatenate((shadowed, newShadowed)), minlength=len(allKeys)).astype(np.int64)
+            self.tables[lightPosition] = (allKeys, allLit, allShadowed, self._states(allKeys, allLit, allShadowed))
+        self._pending = {}
+
+    def _states(self, keys, lit, shadowed):
+        states = np.where(shadowed == 0, 1, 2)
+        states[((lit > 0) & (shadowed > 0)) | (lit + shadowed < self.minSamples)] = 0
+
+        # a cell is only used if its neighbours (same side of the surfaces) don't disagree
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    if dx == dy == dz == 0:
+                        continue
+                    neighbours = keys + ((dx << 41) + (dy << 21) + (dz << 1))
+                    positions = np.minimum(np.searchsorted(keys, neighbours), len(keys) - 1)
+                    found = keys[positions] == neighbours
+                    disagree = np.where(states == 2, lit[positions] > 0, shadowed[positions] > 0)
+                    states[found & disagree] = 0
+        return states
+
+    def stats(self):
+        return {"cells": sum(len(table[0]) for table in self.tables.values()), "lights": len(self.tables),
+                "lookups": self.lookups, "hits": self.hits, "hitRate": self.hits / self.lookups if self.lookups else 0.0}
+
+    # Save / load =========================================================================================
+    def save(self, path: str):
+        """Saves the cells (.npz) with the signature of the scene, to reuse them in the next frames"""
+        self.commit()
+        arrays = {"settings": np.array((self.cellSize, self.minSamples)), "signature": np.array(self.signature or "")}
+        for i, (lightPosition, (keys, lit, shadowed, _states)) in enumerate(self.tables.items()):
+            arrays.update({"light%d" % i: np.array(lightPosition), "keys%d" % i: keys, "lit%d" % i: lit, "shadowed%d" % i: shadowed})
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        cellSize, minSamples = data["settings"].tolist()
+        cache = cls(cellSize, int(minSamples))
+        cache.signature = str(data["signature"]) or None
+        i = 0
+        while "light%d" % i in data:
+            keys, lit, shadowed = data["keys%d" % i], data["lit%d" % i], data["shadowed%d" % i]
+            cache.tables[tuple(data["light%d" % i].tolist())] = (keys, lit, shadowed, cache._states(keys, lit, shadowed))
+            i += 1
+        return cache
+
+
+def prepareVisibilityCache(parameters: dict, objects):
+    """Render parameters with a VisibilityCache as shadowCache, checked against the objects of the scene
+    shadowCache: True (new cache, or loaded from shadowCachePath if the file exists) or a VisibilityCache,
+        to keep it between the frames rendered in this process
+    shadowCacheCellSize: cell size of a new cache (default 0.02)
+    """
+    cache = parameters.get("shadowCache")
+    if cache is True:
+        path = parameters.get("shadowCachePath")
+        if path and os.path.exists(path):
+            cache = VisibilityCache.load(path)
+        else:
+            cache = VisibilityCache(parameters.get("shadowCacheCellSize", 0.02))
+    if not isinstance(cache, VisibilityCache):
+        return parameters
+
+    cache.validate(objects)
+    return dict(parameters, shadowCache=cache)
+
+
+def saveVisibilityCache(parameters: dict):
+    """Adds the results of the render to the cache of parameters prepared by prepareVisibilityCache,
+    and saves it to shadowCachePath (if given)
+    """
+    cache = parameters.get("shadowCache")
+    if isinstance(cache, VisibilityCache):
+        cache.commit()
+        if parameters.get("shadowCachePath"):
+            cache.save(parameters["shadowCachePath"])